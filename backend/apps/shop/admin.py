@@ -1,5 +1,17 @@
 from django.contrib import admin
-from .models import Manufacturer, Category, Product, Cart, Order, Review, RecentProduct
+from .models import (
+    Manufacturer,
+    Category,
+    Product,
+    Cart,
+    CartItem,
+    Order,
+    OrderLine,
+    CheckoutOutbox,
+    StripeEvent,
+    Review,
+    RecentProduct,
+)
 
 
 @admin.register(Manufacturer)
@@ -16,9 +28,9 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "price", "category", "manufacturer")
+    list_display = ("id", "sku", "name", "price", "category", "manufacturer")
     list_filter = ("category", "manufacturer")
-    search_fields = ("name", "description")
+    search_fields = ("sku", "name", "description")
     readonly_fields = ("photo_preview",)
 
     def photo_preview(self, obj):
@@ -29,11 +41,23 @@ class ProductAdmin(admin.ModelAdmin):
     photo_preview.short_description = "Фото"
 
 
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    extra = 0
+    raw_id_fields = ("product",)
+
+
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ("id", "user")
     search_fields = ("user__username", "user__email")
-    filter_horizontal = ("products",)
+    inlines = (CartItemInline,)
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    raw_id_fields = ("product",)
 
 
 @admin.register(Order)
@@ -42,6 +66,21 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ("status",)
     search_fields = ("user__username", "user__email")
     filter_horizontal = ("products",)
+    inlines = (OrderLineInline,)
+
+
+@admin.register(CheckoutOutbox)
+class CheckoutOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "order", "status", "attempts", "available_at")
+    list_filter = ("status",)
+    raw_id_fields = ("order",)
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "type", "created", "received_at", "processed_at")
+    list_filter = ("type",)
+    search_fields = ("event_id",)
 
 
 @admin.register(Review)
@@ -53,5 +92,5 @@ class ReviewAdmin(admin.ModelAdmin):
 
 @admin.register(RecentProduct)
 class RecentProductAdmin(admin.ModelAdmin):
-    list_display = ("id", "product", "user")
+    list_display = ("id", "product", "user", "viewed_at")
     search_fields = ("product__name", "user__username")
\ No newline at end of file
@@ -1,7 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class ShopConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.shop"
-    verbose_name = "Магазин"
\ No newline at end of file
+    verbose_name = "Магазин"
+
+    def ready(self):
+        from .models import Category, Manufacturer, Product, Review
+        from .signals import ensure_search_index, invalidate_catalog, render_photo_variants
+
+        post_migrate.connect(ensure_search_index, sender=self)
+        for model in (Product, Category, Manufacturer, Review):
+            post_save.connect(invalidate_catalog, sender=model)
+            post_delete.connect(invalidate_catalog, sender=model)
+        post_save.connect(render_photo_variants, sender=Product)
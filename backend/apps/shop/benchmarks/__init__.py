@@ -0,0 +1,8 @@
+"""
+Repeatable benchmarks of the shop and users APIs, run by ``manage.py benchmark``.
+
+``data`` fills a fresh test database with a deterministic synthetic catalog,
+``scenarios`` scripts one request type per route, and ``runner`` measures
+them in process and compares the results with a saved JSON baseline. Stripe
+is replaced by ``apps.shop.stripe_fake``, so nothing leaves the machine.
+"""
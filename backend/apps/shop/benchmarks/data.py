@@ -0,0 +1,179 @@
+import random
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from rest_framework.authtoken.models import Token
+
+from apps.shop.cache import bump_catalog_version
+from apps.shop.models import (
+    Cart,
+    CartItem,
+    Category,
+    Manufacturer,
+    Order,
+    OrderLine,
+    Product,
+    RecentProduct,
+    Review,
+)
+from apps.shop.ratings import RATING_FIELDS, compute_ratings
+from apps.users.models import User
+
+DEFAULT_COUNTS = {
+    "categories": 30,
+    "manufacturers": 100,
+    "products": 5000,
+    "users": 500,
+    "reviews": 20000,
+    "orders": 2000,
+    "cart_items": 1500,
+    "recent_views": 5000,
+}
+PASSWORD = "bench-password"
+STAFF_EMAIL = "bench-staff@example.com"
+WORDS = (
+    "дрель шуруповёрт перфоратор болгарка лобзик рубанок фрезер степлер паяльник уровень рулетка набор ключ "
+    "отвёртка молоток пила аккумулятор зарядное сверло бита диск кейс компактный профессиональный ударный "
+    "бесщёточный сетевой садовый строительный"
+).split()
+BATCH_SIZE = 1000
+
+
+@dataclass
+class Dataset:
+    category_ids: list
+    product_ids: list
+    staff_token: str
+    # user id -> token key, for customers only.
+    tokens: dict
+    review_ids: list
+    # user id -> ids of their orders, and of their unpaid orders' checkout sessions.
+    orders: dict = field(default_factory=dict)
+    sessions: dict = field(default_factory=dict)
+
+
+def _popular(rng, items, count):
+    """``count`` picks from ``items`` where the first ones are much more popular, as in real traffic."""
+    return rng.choices(items, weights=[1 / (rank + 1) for rank in range(len(items))], k=count)
+
+
+def generate(counts, seed, stripe):
+    """
+    Fill the database with synthetic data; the same ``counts`` and ``seed`` give the same rows.
+
+    Unpaid orders get checkout sessions on ``stripe``, a running fake Stripe server.
+    """
+    rng = random.Random(seed)
+
+    categories = Category.objects.bulk_create(Category(name=f"Категория {i}") for i in range(counts["categories"]))
+    manufacturers = Manufacturer.objects.bulk_create(
+        Manufacturer(name=f"Производитель {i}") for i in range(counts["manufacturers"])
+    )
+    products = Product.objects.bulk_create(
+        (
+            Product(
+                sku=f"BENCH-{i:07d}",
+                name=f"{' '.join(rng.sample(WORDS, 3)).capitalize()} {i}",
+                description=" ".join(rng.choices(WORDS, k=40)),
+                price=rng.randint(100, 200_000),
+                category=rng.choice(categories),
+                manufacturer=rng.choice(manufacturers),
+            )
+            for i in range(counts["products"])
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    product_ids = [product.id for product in products]
+
+    # One hash for everyone: hashing a password per user would dominate the setup.
+    password = make_password(PASSWORD)
+    customers = User.objects.bulk_create(
+        (
+            User(email=f"bench-{i}@example.com", fio=f"Покупатель {i}", password=password)
+            for i in range(counts["users"])
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    staff = User.objects.create(email=STAFF_EMAIL, fio="Администратор", password=password, is_staff=True)
+    tokens = Token.objects.bulk_create(
+        (Token(user=user, key=Token.generate_key()) for user in [*customers, staff]), batch_size=BATCH_SIZE
+    )
+
+    reviewed = _popular(rng, product_ids, counts["reviews"])
+    reviews = Review.objects.bulk_create(
+        (
+            Review(
+                product_id=product_id,
+                user=rng.choice(customers),
+                text=" ".join(rng.choices(WORDS, k=20)),
+                grade=Decimal(rng.randint(0, 50)) / 10,
+            )
+            for product_id in reviewed
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start : start + BATCH_SIZE]
+        ratings = compute_ratings(batch)
+        Product.objects.bulk_update(
+            [Product(id=product_id, **ratings[product_id]) for product_id in batch], RATING_FIELDS
+        )
+
+    dataset = Dataset(
+        category_ids=[category.id for category in categories],
+        product_ids=product_ids,
+        staff_token=tokens[-1].key,
+        tokens={token.user_id: token.key for token in tokens[:-1]},
+        review_ids=[review.id for review in reviews],
+    )
+    _generate_orders(dataset, customers, products, counts["orders"], rng, stripe)
+    _generate_carts(customers, products, counts["cart_items"], rng)
+    viewed = {
+        (rng.choice(customers).id, product_id) for product_id in _popular(rng, product_ids, counts["recent_views"])
+    }
+    RecentProduct.objects.bulk_create(
+        (RecentProduct(user_id=user_id, product_id=product_id) for user_id, product_id in sorted(viewed)),
+        batch_size=BATCH_SIZE,
+    )
+    bump_catalog_version()
+    return dataset
+
+
+def _generate_orders(dataset, customers, products, count, rng, stripe):
+    orders, lines = [], []
+    for _ in range(count):
+        status = rng.choices(("paid", "unpaid", "expired"), (7, 2, 1))[0]
+        order = Order(user=rng.choice(customers), order_price=0, status=status)
+        order_lines = [
+            OrderLine(product=product, product_name=product.name, unit_price=product.price, quantity=rng.randint(1, 3))
+            for product in _popular(rng, products, rng.randint(1, 5))
+        ]
+        order.order_price = sum(line.unit_price * line.quantity for line in order_lines)
+        orders.append(order)
+        lines.append(order_lines)
+    Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+
+    for order, order_lines in zip(orders, lines):
+        for line in order_lines:
+            line.order = order
+        session = stripe.create_session({"customer_email": order.user.email, "metadata[order_id]": str(order.id)}, None)
+        if order.status == "paid":
+            stripe.pay(session["id"])
+        order.checkout_session_id, order.checkout_url = session["id"], session["url"]
+        dataset.orders.setdefault(order.user_id, []).append(order.id)
+        if order.status == "unpaid":
+            dataset.sessions.setdefault(order.user_id, []).append(session["id"])
+    OrderLine.objects.bulk_create([line for order_lines in lines for line in order_lines], batch_size=BATCH_SIZE)
+    Order.objects.bulk_update(orders, ["checkout_session_id", "checkout_url"], batch_size=BATCH_SIZE)
+
+
+def _generate_carts(customers, products, count, rng):
+    carts = Cart.objects.bulk_create(Cart(user=user) for user in customers)
+    items = {}
+    for _ in range(count):
+        cart, product = rng.choice(carts), rng.choice(products)
+        items[cart.id, product.id] = CartItem(
+            cart=cart, product=product, quantity=rng.randint(1, 3), price_at_add=product.price
+        )
+    CartItem.objects.bulk_create(items.values(), batch_size=BATCH_SIZE)
@@ -0,0 +1,257 @@
+"""
+The canonical query of each hot endpoint, for ``manage.py check_query_plans``.
+
+Each plan builds the queryset its endpoint runs, through the same filters,
+paginator and helpers, against the synthetic dataset. ``explain`` reads the
+database's EXPLAIN output and reports full table scans and sorts: every
+listing here is meant to be answered by walking an index in order.
+"""
+import json
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connections
+from django.http import QueryDict
+
+from apps.shop.carts import cart_items
+from apps.shop.filters import REVIEW_ORDERINGS, ProductFilter
+from apps.shop.models import Cart, CartItem, Manufacturer, Order, OrderLine, Product, RecentProduct, Review
+from apps.shop.orders import order_history, order_summaries
+from apps.shop.pagination import KeysetPaginator
+from apps.shop.photos import variants_with_hash
+from apps.shop.recent import recent_products
+
+# Lookup tables of a few dozen rows: PostgreSQL may rightly prefer scanning them to probing an index.
+SMALL_TABLES = {"shop_category", "shop_manufacturer"}
+POSTGRES_SORTS = {"Sort", "Incremental Sort"}
+# Databases whose EXPLAIN output ``explain`` can read.
+VENDORS = ("postgresql", "sqlite")
+
+
+@dataclass
+class Plan:
+    name: str
+    build: callable
+    # Only checked on these database vendors; None for all.
+    vendors: tuple | None = None
+    # Set where a sort is inherent, e.g. ranking search matches.
+    allow_sort: bool = False
+
+    def check(self, dataset):
+        """The plan of this query as text lines, and the problems found in it."""
+        lines, found = explain(self.build(dataset))
+        if self.allow_sort:
+            found = [problem for problem in found if not problem.startswith("sort")]
+        return lines, found
+
+
+PLANS = {}
+
+
+def plan(name, vendors=None, allow_sort=False):
+    def register(build):
+        PLANS[name] = Plan(name, build, vendors, allow_sort)
+        return build
+
+    return register
+
+
+def _products_page(params, cursor_pages=0):
+    """The page query of ``GET /products?<params>``, after following ``next`` ``cursor_pages`` times."""
+    queryset = Product.objects.select_related("category", "manufacturer").defer("search_vector")
+    product_filter = ProductFilter(QueryDict(params), queryset=queryset)
+    paginator = KeysetPaginator(product_filter.get_ordering())
+    cursor = None
+    for _ in range(cursor_pages):
+        cursor = paginator.paginate(product_filter.qs, cursor).next_cursor
+    return paginator.page_queryset(product_filter.qs, cursor)
+
+
+def _busiest_customer(dataset):
+    return max(dataset.orders, key=lambda user_id: len(dataset.orders[user_id]))
+
+
+@plan("products")
+def products(dataset):
+    return _products_page("")
+
+
+@plan("products.next_page")
+def products_next_page(dataset):
+    return _products_page("", cursor_pages=2)
+
+
+@plan("products.by_price")
+def products_by_price(dataset):
+    return _products_page("sort_by=-price")
+
+
+@plan("products.by_rating")
+def products_by_rating(dataset):
+    return _products_page("sort_by=-rating")
+
+
+@plan("products.category")
+def products_category(dataset):
+    return _products_page(f"category={dataset.category_ids[0]}")
+
+
+@plan("products.category.next_page")
+def products_category_next_page(dataset):
+    return _products_page(f"category={dataset.category_ids[0]}", cursor_pages=2)
+
+
+@plan("products.category.by_price")
+def products_category_by_price(dataset):
+    return _products_page(f"category={dataset.category_ids[0]}&sort_by=price")
+
+
+@plan("products.manufacturer.by_price")
+def products_manufacturer_by_price(dataset):
+    manufacturer_id = Manufacturer.objects.order_by("id").values_list("id", flat=True).first()
+    return _products_page(f"manufacturer={manufacturer_id}&sort_by=price")
+
+
+@plan("products.name_search", vendors=("postgresql",), allow_sort=True)
+def products_name_search(dataset):
+    # Names end in a serial number: searching for one matches a handful of products, as a real name search does.
+    serial = Product.objects.get(id=dataset.product_ids[-1]).name.rsplit(" ", 1)[-1]
+    return _products_page(f"name={serial}")
+
+
+@plan("products.detail")
+def product_detail(dataset):
+    return Product.objects.select_related("category", "manufacturer").defer("search_vector").filter(
+        id=dataset.product_ids[0]
+    )
+
+
+@plan("photos.variants")
+def photo_variants(dataset):
+    # Any hash will do: the lookup is the same whether an earlier upload matches or not.
+    return variants_with_hash("0" * 64)
+
+
+@plan("reviews")
+def reviews(dataset):
+    paginator = KeysetPaginator(REVIEW_ORDERINGS["newest"])
+    return paginator.page_queryset(Review.objects.for_listing(dataset.product_ids[0]))
+
+
+@plan("reviews.by_grade")
+def reviews_by_grade(dataset):
+    paginator = KeysetPaginator(REVIEW_ORDERINGS["-grade"])
+    return paginator.page_queryset(Review.objects.for_listing(dataset.product_ids[0]))
+
+
+def _orders_page(orders):
+    return KeysetPaginator(["-id"], default_page_size=settings.SHOP_ORDERS_PAGE_SIZE).page_queryset(orders)
+
+
+def _orders_page_ids(dataset):
+    return list(_orders_page(Order.objects.filter(user_id=_busiest_customer(dataset))).values_list("id", flat=True))
+
+
+@plan("orders")
+def orders(dataset):
+    return _orders_page(order_history(_busiest_customer(dataset)))
+
+
+@plan("orders.summary")
+def orders_summary(dataset):
+    return _orders_page(order_summaries(_busiest_customer(dataset)))
+
+
+@plan("orders.status")
+def orders_status(dataset):
+    return _orders_page(order_history(_busiest_customer(dataset), ["paid"]))
+
+
+# The two queries prefetching the contents of an order page; each sorts that page's rows only.
+@plan("orders.products", allow_sort=True)
+def orders_products(dataset):
+    return (
+        Product.objects.select_related("category", "manufacturer")
+        .defer("search_vector")
+        .filter(order__in=_orders_page_ids(dataset))
+    )
+
+
+@plan("orders.lines", allow_sort=True)
+def orders_lines(dataset):
+    return OrderLine.objects.filter(order__in=_orders_page_ids(dataset)).order_by("id")
+
+
+@plan("orders.payment_status")
+def orders_payment_status(dataset):
+    user_id = next(iter(dataset.sessions))
+    session_id = dataset.sessions[user_id][0]
+    # Without the model's ordering, as ``get()`` runs it.
+    return Order.objects.only("id", "status").filter(checkout_session_id=session_id, user_id=user_id).order_by()
+
+
+@plan("cart")
+def cart(dataset):
+    user_id = CartItem.objects.order_by("id").values_list("cart__user_id", flat=True).first()
+    return Cart.objects.filter(user_id=user_id)
+
+
+# The window totals are computed over the cart's lines before they are put in order: a sort of one cart.
+@plan("cart.items", allow_sort=True)
+def cart_lines(dataset):
+    user_id = CartItem.objects.order_by("id").values_list("cart__user_id", flat=True).first()
+    return cart_items(user_id)
+
+
+@plan("recent")
+def recent(dataset):
+    return recent_products(RecentProduct.objects.order_by("id").values_list("user_id", flat=True).first())
+
+
+def explain(queryset):
+    """The plan as text lines, and the problems found in it."""
+    vendor = connections[queryset.db].vendor
+    if vendor == "postgresql":
+        root = json.loads(queryset.explain(format="json"))[0]["Plan"]
+        return _postgres_lines(root), _postgres_problems(root)
+    if vendor == "sqlite":
+        lines = queryset.explain().splitlines()
+        return lines, _sqlite_problems(lines)
+    raise ValueError(f"Cannot read {vendor} query plans")
+
+
+def _sqlite_problems(lines):
+    found = []
+    for line in lines:
+        # "<id> <parent> <unused> <detail>"; scans of subqueries and virtual tables read no stored table.
+        detail = line.split(" ", 3)[-1]
+        if detail.startswith("SCAN ") and not detail.startswith("SCAN (") and "USING" not in detail:
+            found.append(f"full scan: {detail}")
+        elif detail.startswith("USE TEMP B-TREE"):
+            found.append(f"sort: {detail}")
+    return found
+
+
+def _postgres_nodes(node, depth=0):
+    yield node, depth
+    for child in node.get("Plans", ()):
+        yield from _postgres_nodes(child, depth + 1)
+
+
+def _postgres_lines(root):
+    lines = []
+    for node, depth in _postgres_nodes(root):
+        target = f" on {node['Relation Name']}" if "Relation Name" in node else ""
+        index = f" using {node['Index Name']}" if "Index Name" in node else ""
+        lines.append(f"{'  ' * depth}{node['Node Type']}{target}{index} (rows={node.get('Plan Rows')})")
+    return lines
+
+
+def _postgres_problems(root):
+    found = []
+    for node, _ in _postgres_nodes(root):
+        if node["Node Type"] == "Seq Scan" and node["Relation Name"] not in SMALL_TABLES:
+            found.append(f"full scan: {node['Relation Name']}")
+        elif node["Node Type"] in POSTGRES_SORTS:
+            found.append(f"sort: {', '.join(node.get('Sort Key', []))}")
+    return found
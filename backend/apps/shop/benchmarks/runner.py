@@ -0,0 +1,128 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from apps.users.token_cache import token_cache
+
+# A regression must also exceed these absolute margins, so that noise on tiny values does not count.
+SLACK = {"p50_ms": 0.5, "p95_ms": 1.0, "alloc_kb": 16.0}
+# Queries per request are deterministic; any increase above rounding is a regression.
+QUERY_SLACK = 0.5
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def send(client, call):
+    headers = dict(call.headers)
+    if call.token:
+        headers["Authorization"] = f"Bearer {call.token}"
+    if call.body is not None:
+        body, content_type = call.body, "application/json"
+    elif call.data is not None:
+        body, content_type = json.dumps(call.data), "application/json"
+    else:
+        body, content_type = None, None
+    kwargs = {"headers": headers}
+    if body is not None:
+        kwargs.update(data=body, content_type=content_type)
+    response = client.generic(call.method, call.path, **kwargs)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    if response.status_code != call.status:
+        raise BenchmarkError(f"{call.method} {call.path}: expected {call.status}, got {response.status_code}")
+    return response
+
+
+def prime_token_cache():
+    """
+    Cache every token, as for users active in steady state.
+
+    Otherwise the query count of a scenario would depend on which users the
+    scenarios before it happened to authenticate.
+    """
+    token_cache.clear()
+    for token in Token.objects.select_related("user").iterator():
+        token_cache.set(token.key, token.user)
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+def run_scenario(scenario, dataset, requests, warmup, profiled, seed):
+    """
+    Latency percentiles from one pass, queries and allocations per request from a second one.
+
+    The passes are separate because tracemalloc slows down every allocation.
+    """
+    client = Client()
+    rng = random.Random(seed)
+    if scenario.max_requests:
+        requests = min(requests, scenario.max_requests)
+
+    latencies = []
+    for index in range(warmup + requests):
+        call = scenario.build(dataset, rng)
+        started = time.perf_counter()
+        send(client, call)
+        if index >= warmup:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    queries, allocated = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(min(profiled, requests)):
+            call = scenario.build(dataset, rng)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            with CaptureQueriesContext(connection) as captured:
+                send(client, call)
+            allocated.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+            queries.append(len(captured))
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "queries": round(statistics.mean(queries), 2),
+        "alloc_kb": round(statistics.mean(allocated), 1),
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """``(scenario, metric, baseline value, current value)`` for every metric past the threshold."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric, slack in SLACK.items():
+            if current[metric] > previous[metric] * (1 + threshold) + slack:
+                regressions.append((name, metric, previous[metric], current[metric]))
+        if current["queries"] > previous["queries"] + QUERY_SLACK:
+            regressions.append((name, "queries", previous["queries"], current["queries"]))
+    return regressions
@@ -0,0 +1,244 @@
+"""
+One scenario per route: a function that picks the next request from the dataset.
+
+Anything a request needs to exist first (a product to delete, a full cart to
+check out) is created inside the scenario function, which runs before the
+request is timed.
+"""
+import json
+import uuid
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from apps.shop.cart_store import get_cart_store
+from apps.shop.models import Review
+from apps.shop.ratings import review_added
+from apps.shop.stripe_fake import sign_payload
+from apps.users.models import User
+
+from .data import PASSWORD, STAFF_EMAIL, WORDS
+
+WEBHOOK_SECRET = "whsec_bench"
+
+
+@dataclass
+class Call:
+    method: str
+    path: str
+    token: str | None = None
+    data: dict | None = None
+    headers: dict = field(default_factory=dict)
+    status: int = 200
+    # Raw body, e.g. a signed webhook payload; sent instead of ``data``.
+    body: str | None = None
+
+
+@dataclass
+class Scenario:
+    name: str
+    build: callable
+    # Caps the request count for scenarios dominated by a fixed cost, like password hashing.
+    max_requests: int | None = None
+
+
+SCENARIOS = {}
+
+
+def scenario(name, max_requests=None):
+    def register(build):
+        SCENARIOS[name] = Scenario(name, build, max_requests)
+        return build
+
+    return register
+
+
+def _customer(dataset, rng, having=None):
+    """A customer's ``(user id, token)``; with ``having``, one that has entries in that mapping."""
+    user_id = rng.choice(list(having) if having is not None else list(dataset.tokens))
+    return user_id, dataset.tokens[user_id]
+
+
+@scenario("catalog.list")
+def catalog_list(dataset, rng):
+    params = rng.choice(
+        [
+            {},
+            {"sort_by": "price"},
+            {"sort_by": "-rating"},
+            {"category": rng.choice(dataset.category_ids)},
+            {"price_min": 1000, "price_max": rng.choice([5000, 20000, 100000])},
+        ]
+    )
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    return Call("GET", f"/api/shop/products?{query}")
+
+
+@scenario("catalog.search")
+def catalog_search(dataset, rng):
+    return Call("GET", f"/api/shop/products?q={rng.choice(WORDS)}&facets=category,manufacturer,price")
+
+
+@scenario("catalog.detail")
+def catalog_detail(dataset, rng):
+    _, token = _customer(dataset, rng)
+    return Call("GET", f"/api/shop/product/{rng.choice(dataset.product_ids)}", token)
+
+
+@scenario("catalog.reviews")
+def catalog_reviews(dataset, rng):
+    return Call("GET", f"/api/shop/product/{rng.choice(dataset.product_ids[:100])}/reviews?sort_by=newest")
+
+
+@scenario("catalog.create")
+def catalog_create(dataset, rng):
+    data = {"name": f"Новый товар {uuid.uuid4().hex[:8]}", "description": "Описание", "price": rng.randint(100, 9999)}
+    return Call("POST", "/api/shop/product", dataset.staff_token, data, status=201)
+
+
+# No scenarios for PATCH/DELETE product/<pk>: the GET-only detail route on the same path is matched first,
+# so those requests get 405 before reaching update_or_delete_product.
+
+
+@scenario("reviews.create")
+def reviews_create(dataset, rng):
+    _, token = _customer(dataset, rng)
+    data = {"product": rng.choice(dataset.product_ids), "text": "Отличный инструмент", "grade": "4.5"}
+    return Call("POST", "/api/shop/review", token, data, status=201)
+
+
+@scenario("reviews.update")
+def reviews_update(dataset, rng):
+    _, token = _customer(dataset, rng)
+    return Call("PATCH", f"/api/shop/review:{rng.choice(dataset.review_ids)}", token, {"grade": "3.0"})
+
+
+@scenario("reviews.delete")
+def reviews_delete(dataset, rng):
+    user_id, token = _customer(dataset, rng)
+    with transaction.atomic():
+        review = Review.objects.create(product_id=rng.choice(dataset.product_ids), user_id=user_id, text="-", grade=1)
+        review_added(review)
+    return Call("DELETE", f"/api/shop/review:{review.id}", token, status=204)
+
+
+@scenario("cart.list")
+def cart_list(dataset, rng):
+    _, token = _customer(dataset, rng)
+    return Call("GET", "/api/shop/cart", token)
+
+
+@scenario("cart.add")
+def cart_add(dataset, rng):
+    _, token = _customer(dataset, rng)
+    return Call("POST", f"/api/shop/cart/{rng.choice(dataset.product_ids)}", token)
+
+
+@scenario("cart.remove")
+def cart_remove(dataset, rng):
+    user_id, token = _customer(dataset, rng)
+    product_id = rng.choice(dataset.product_ids)
+    get_cart_store().apply(User(id=user_id), [{"op": "increment", "product": product_id, "quantity": 1}])
+    return Call("DELETE", f"/api/shop/cart/{product_id}", token, status=204)
+
+
+@scenario("cart.update")
+def cart_update(dataset, rng):
+    _, token = _customer(dataset, rng)
+    operations = [
+        {"op": "set", "product": product_id, "quantity": rng.randint(1, 3)}
+        for product_id in rng.sample(dataset.product_ids, 3)
+    ]
+    return Call("POST", "/api/shop/cart/items", token, {"operations": operations})
+
+
+@scenario("orders.list")
+def orders_list(dataset, rng):
+    _, token = _customer(dataset, rng, having=dataset.orders)
+    return Call("GET", "/api/shop/order", token)
+
+
+@scenario("orders.summary")
+def orders_summary(dataset, rng):
+    _, token = _customer(dataset, rng, having=dataset.orders)
+    return Call("GET", "/api/shop/order?view=summary", token)
+
+
+@scenario("orders.create")
+def orders_create(dataset, rng):
+    user_id, token = _customer(dataset, rng)
+    operations = [
+        {"op": "increment", "product": product_id, "quantity": 1} for product_id in rng.sample(dataset.product_ids, 3)
+    ]
+    get_cart_store().apply(User(id=user_id), operations)
+    return Call("POST", "/api/shop/order", token, headers={"Idempotency-Key": uuid.uuid4().hex}, status=202)
+
+
+@scenario("orders.checkout")
+def orders_checkout(dataset, rng):
+    user_id, token = _customer(dataset, rng, having=dataset.orders)
+    return Call("GET", f"/api/shop/order/{rng.choice(dataset.orders[user_id])}/checkout", token)
+
+
+@scenario("payments.status")
+def payments_status(dataset, rng):
+    user_id, token = _customer(dataset, rng, having=dataset.sessions)
+    return Call("GET", f"/api/shop/payment-status/{rng.choice(dataset.sessions[user_id])}", token)
+
+
+@scenario("payments.webhook")
+def payments_webhook(dataset, rng):
+    user_id = rng.choice(list(dataset.orders))
+    session = {
+        "id": f"cs_test_{uuid.uuid4().hex}",
+        "object": "checkout.session",
+        "status": "complete",
+        "payment_status": "paid",
+        "payment_intent": f"pi_{uuid.uuid4().hex}",
+        "metadata": {"order_id": str(rng.choice(dataset.orders[user_id]))},
+    }
+    event = {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "created": int(timezone.now().timestamp()),
+        "data": {"object": session},
+    }
+    payload = json.dumps(event)
+    headers = {"Stripe-Signature": sign_payload(payload, WEBHOOK_SECRET)}
+    return Call("POST", "/api/shop/stripe/webhook", body=payload, headers=headers)
+
+
+@scenario("recent.list")
+def recent_list(dataset, rng):
+    _, token = _customer(dataset, rng)
+    return Call("GET", "/api/shop/recent", token)
+
+
+@scenario("export.products", max_requests=20)
+def export_products(dataset, rng):
+    return Call("GET", "/api/shop/export/products.ndjson", dataset.staff_token)
+
+
+@scenario("export.orders", max_requests=20)
+def export_orders(dataset, rng):
+    return Call("GET", "/api/shop/export/orders.csv", dataset.staff_token)
+
+
+@scenario("users.sign_up", max_requests=10)
+def users_sign_up(dataset, rng):
+    data = {"email": f"bench-new-{uuid.uuid4().hex}@example.com", "password": PASSWORD, "fio": "Новый покупатель"}
+    return Call("POST", "/api/users/sign/", data=data, status=201)
+
+
+@scenario("users.login", max_requests=10)
+def users_login(dataset, rng):
+    return Call("POST", "/api/users/login/", data={"email": STAFF_EMAIL, "password": PASSWORD})
+
+
+@scenario("users.logout")
+def users_logout(dataset, rng):
+    user = User.objects.create(email=f"bench-logout-{uuid.uuid4().hex}@example.com", fio="-")
+    return Call("POST", "/api/users/logout/", Token.objects.create(user=user).key, status=204)
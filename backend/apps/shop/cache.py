@@ -0,0 +1,221 @@
+"""
+Versioned response cache for catalog reads.
+
+Every cached response is keyed by the catalog version, the request path, the
+normalized query string and the negotiated format. Writes to catalog models
+bump the version (see ``signals.py``), which makes all older entries
+unreachable; they are then dropped by the cache backend's LRU eviction. The
+ETag is derived from the same key, so a matching ``If-None-Match`` is answered
+with 304 before the database or the cached body is touched.
+
+For ``DATABASE_REPLICA_PIN_SECONDS`` after a bump, misses are built from the
+primary: a lagging replica would otherwise cache pre-write data under the new
+version.
+
+The version is kept in ``SHOP_CATALOG_VERSION_CACHE``, a cache shared by all
+workers: the catalog cache itself when it is Redis. Without one it is kept in
+the ``CatalogVersion`` row, which each process reads from the primary at most
+every ``SHOP_CATALOG_VERSION_TTL`` seconds (``DatabaseVersion``). A 304 or a
+hit then costs no query, but other workers serve their old entries for up to
+that long after a write.
+"""
+import hashlib
+import pickle
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+
+from config.replicas import read_from_primary
+
+from .models import CatalogVersion
+
+VERSION_KEY = "shop:catalog-version"
+BUMPED_KEY = "shop:catalog-recently-bumped"
+
+
+def get_cache():
+    return caches[settings.SHOP_CATALOG_CACHE]
+
+
+def get_version_cache():
+    return caches[settings.SHOP_CATALOG_VERSION_CACHE]
+
+
+class DatabaseVersion:
+    """
+    The version row and its last bump, re-read by a process at most every ``SHOP_CATALOG_VERSION_TTL`` seconds.
+
+    A process sees its own bumps at once; other processes keep their version for up to the TTL after a write.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._expires = 0.0
+
+    def get(self):
+        """``(version, bumped_at)``."""
+        if time.monotonic() >= self._expires:
+            state = _catalog_versions().values_list("version", "bumped_at").first()
+            if state is None:
+                row = _catalog_versions().get_or_create(id=1, defaults={"version": time.time_ns()})[0]
+                state = row.version, row.bumped_at
+            self._store(state)
+        return self._state
+
+    async def aget(self):
+        if time.monotonic() >= self._expires:
+            state = await _catalog_versions().values_list("version", "bumped_at").afirst()
+            if state is None:
+                row = (await _catalog_versions().aget_or_create(id=1, defaults={"version": time.time_ns()}))[0]
+                state = row.version, row.bumped_at
+            self._store(state)
+        return self._state
+
+    def bump(self):
+        bumped = _catalog_versions().update(version=F("version") + 1, bumped_at=timezone.now())
+        if not bumped:
+            _catalog_versions().get_or_create(id=1, defaults={"version": time.time_ns(), "bumped_at": timezone.now()})
+        self.clear()
+
+    def clear(self):
+        self._expires = 0.0
+
+    def _store(self, state):
+        self._state = tuple(state)
+        self._expires = time.monotonic() + settings.SHOP_CATALOG_VERSION_TTL
+
+
+database_version = DatabaseVersion()
+
+
+def get_catalog_version():
+    if not settings.SHOP_CATALOG_VERSION_CACHE:
+        return database_version.get()[0]
+    cache = get_version_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so a lost counter never reuses an old version.
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def aget_catalog_version():
+    if not settings.SHOP_CATALOG_VERSION_CACHE:
+        return (await database_version.aget())[0]
+    cache = get_version_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    if not settings.SHOP_CATALOG_VERSION_CACHE:
+        database_version.bump()
+        return
+    cache = get_version_cache()
+    cache.set(BUMPED_KEY, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def recently_bumped():
+    """Whether the version changed within ``DATABASE_REPLICA_PIN_SECONDS``."""
+    if not settings.SHOP_CATALOG_VERSION_CACHE:
+        return _within_pin(database_version.get()[1])
+    return bool(get_version_cache().get(BUMPED_KEY))
+
+
+async def arecently_bumped():
+    if not settings.SHOP_CATALOG_VERSION_CACHE:
+        return _within_pin((await database_version.aget())[1])
+    return bool(await get_version_cache().aget(BUMPED_KEY))
+
+
+def _catalog_versions():
+    return CatalogVersion.objects.filter(id=1)
+
+
+def _within_pin(bumped_at):
+    pin = timedelta(seconds=settings.DATABASE_REPLICA_PIN_SECONDS)
+    return bumped_at is not None and bumped_at >= timezone.now() - pin
+
+
+def response_key(request, version=None):
+    if version is None:
+        version = get_catalog_version()
+    query = sorted((key, value) for key, values in request.GET.lists() for value in values if value != "")
+    raw = repr((version, request.path, query, request.accepted_renderer.format))
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def cached_response(request, build):
+    """
+    Return the cached response for ``request``, calling ``build`` on a miss.
+
+    Only 200 responses are stored, and only if their pickled data fits in
+    ``SHOP_CATALOG_CACHE_MAX_ENTRY_BYTES``.
+    """
+    key = response_key(request)
+    etag = f'"{key}"'
+    if _is_not_modified(request, etag):
+        return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    cache = get_cache()
+    data = cache.get(f"shop:response:{key}")
+    if data is not None:
+        return Response(data, status=HTTP_200_OK, headers={"ETag": etag})
+
+    if recently_bumped():
+        read_from_primary()
+    response = build()
+    if _is_cacheable(response):
+        cache.set(f"shop:response:{key}", response.data)
+    if response.status_code == HTTP_200_OK:
+        response["ETag"] = etag
+    return response
+
+
+async def acached_response(request, build):
+    """``cached_response`` for async views; ``build`` is a coroutine function."""
+    key = response_key(request, await aget_catalog_version())
+    etag = f'"{key}"'
+    if _is_not_modified(request, etag):
+        return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    cache = get_cache()
+    data = await cache.aget(f"shop:response:{key}")
+    if data is not None:
+        return Response(data, status=HTTP_200_OK, headers={"ETag": etag})
+
+    if await arecently_bumped():
+        read_from_primary()
+    response = await build()
+    if _is_cacheable(response):
+        await cache.aset(f"shop:response:{key}", response.data)
+    if response.status_code == HTTP_200_OK:
+        response["ETag"] = etag
+    return response
+
+
+def _is_not_modified(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    return bool(if_none_match) and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*")
+
+
+def _is_cacheable(response):
+    return (
+        response.status_code == HTTP_200_OK
+        and len(pickle.dumps(response.data, pickle.HIGHEST_PROTOCOL)) <= settings.SHOP_CATALOG_CACHE_MAX_ENTRY_BYTES
+    )
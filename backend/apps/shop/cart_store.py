@@ -0,0 +1,376 @@
+"""
+Where the cart endpoints keep carts.
+
+Without ``SHOP_CART_CACHE`` carts live in the database (``CartItem``) and
+every change is written at once. With it, ``CacheCartStore`` keeps each active
+cart in that cache as a list of ``(product id, quantity, price at add)`` and
+writes changed carts back to the database from a daemon thread, every
+``SHOP_CART_FLUSH_INTERVAL`` seconds or once ``SHOP_CART_MAX_PENDING`` carts
+changed, all of them in one transaction. Checkout writes the user's cart
+first, so orders are always built from the latest cart.
+
+Which carts changed is kept in the same cache, as a journal of user ids
+numbered by ``cache.incr``: a worker that dies leaves its entries behind for
+the flusher of any other worker, which takes a lock so one flush runs at a
+time. A cart missing from the cache, after eviction or a cache restart, is
+loaded from the database again; changes are lost only if their cart leaves
+the cache before it is written back. The cache must be shared by all worker
+processes; a per-process one only suits a single process. Carts must not be
+changed in the database directly, e.g. in the admin, while they are cached.
+
+Changes to one cart are serialized by a lock in the cache holding a random
+token. A request waits up to ``LOCK_WAIT`` seconds for it and then gives up
+with ``CartBusy``; a lock is only released by its holder, while it has not
+expired. Checkout keeps the lock for its whole transaction, renewing it every
+third of ``LOCK_TIMEOUT``, and rolls back with ``CartBusy`` if it was lost.
+"""
+import atexit
+import contextlib
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+
+from .carts import (
+    aget_cart_items,
+    apply_cart_operations,
+    apply_operations,
+    product_prices,
+    summarize_cart,
+    write_carts,
+)
+from .models import CartItem, Product
+
+logger = logging.getLogger(__name__)
+
+# Seconds a lock on one cart is held at most, should its holder die.
+LOCK_TIMEOUT = 5
+# Seconds a request waits for a cart locked by another one.
+LOCK_WAIT = 10
+# Seconds the flush lock is held at most; a flush of SHOP_CART_MAX_PENDING carts takes far less.
+FLUSH_LOCK_TIMEOUT = 60
+
+JOURNAL_KEY = "shop:cart-journal"
+FLUSHED_KEY = "shop:cart-journal-flushed"
+GAP_KEY = "shop:cart-journal-gap"
+FLUSH_LOCK_KEY = "shop:cart-flush-lock"
+
+
+class CartBusy(Exception):
+    """The cart stayed locked by other requests for ``LOCK_WAIT`` seconds, or its checkout lost the lock."""
+
+
+@dataclass
+class Lease:
+    """A held lock: the token stored under its key, and the ``time.monotonic()`` at which it expires."""
+
+    token: str
+    expires: float
+
+
+@dataclass
+class CartLine:
+    """A cached cart line, serialized like a ``CartItem`` from ``cart_items``."""
+
+    product_id: int
+    product: Product
+    quantity: int
+    price_at_add: int
+
+    @property
+    def line_total(self):
+        return self.quantity * self.price_at_add
+
+
+class DatabaseCartStore:
+    def apply(self, user, operations):
+        apply_cart_operations(user, operations)
+
+    async def aitems(self, user):
+        return await aget_cart_items(user)
+
+    def summarize(self, items):
+        # Totals come with the lines, from the window sums of ``cart_items``.
+        return summarize_cart(items)
+
+    @contextlib.contextmanager
+    def checkout(self, user):
+        with transaction.atomic():
+            yield
+
+    def flush(self):
+        return 0
+
+
+class CacheCartStore:
+    def __init__(self):
+        # Journal entries added by this process since its last flush, to wake the flusher early.
+        self._marked = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def apply(self, user, operations):
+        """Same semantics as ``apply_cart_operations``; raises ``CartBusy`` if the cart stays locked."""
+        prices = product_prices({operation["product"] for operation in operations})
+        with self._locked(user.id):
+            lines = {product_id: [quantity, price] for product_id, quantity, price in self._lines(user.id)}
+            quantities = {product_id: line[0] for product_id, line in lines.items() if product_id in prices}
+            apply_operations(quantities, operations)
+            for product_id, quantity in quantities.items():
+                if quantity <= 0:
+                    lines.pop(product_id, None)
+                elif product_id in lines:
+                    lines[product_id][0] = quantity
+                else:
+                    lines[product_id] = [quantity, prices[product_id]]
+            self._cache().set(
+                _key(user.id),
+                [(product_id, quantity, price) for product_id, (quantity, price) in lines.items()],
+                settings.SHOP_CART_CACHE_TIMEOUT,
+            )
+            self._mark_changed(user.id)
+
+    async def aitems(self, user):
+        lines = await self._cache().aget(_key(user.id))
+        if lines is None:
+            lines = await self._aload(user.id)
+        products = {product.id: product async for product in _products().filter(id__in=[line[0] for line in lines])}
+        return _cart_lines(lines, products)
+
+    def summarize(self, items):
+        return {"subtotal": sum(item.line_total for item in items), "count": sum(item.quantity for item in items)}
+
+    @contextlib.contextmanager
+    def checkout(self, user):
+        """
+        Write the user's cart, then run the block in the same transaction; the cart leaves the cache once it commits.
+
+        The cart stays locked until then however long the block takes, so no change made meanwhile is lost with it.
+        """
+        with self._locked(user.id) as lease, _renewed(self._cache, _lock_key(user.id), lease, LOCK_TIMEOUT) as lost:
+            with transaction.atomic():
+                lines = self._cache().get(_key(user.id))
+                if lines is not None:
+                    write_carts({user.id: lines})
+                yield
+                if lost.is_set():
+                    raise CartBusy(f"Checkout of user {user.id} lost the cart lock")
+            # Its journal entries are skipped by the flusher once the cart is gone.
+            self._cache().delete(_key(user.id))
+
+    def flush(self):
+        """
+        Write the carts of up to ``SHOP_CART_MAX_PENDING`` journal entries, in journal order.
+
+        Carts locked by a request are journaled again for the next flush. Returns the number of carts written, 0
+        if another worker is flushing.
+        """
+        cache = self._cache()
+        with self._lock:
+            self._marked = 0
+        flush_lease = _acquire(cache, FLUSH_LOCK_KEY, FLUSH_LOCK_TIMEOUT)
+        if flush_lease is None:
+            return 0
+        try:
+            start = cache.get(FLUSHED_KEY, 0) + 1
+            last = min(cache.get(JOURNAL_KEY, 0), start + settings.SHOP_CART_MAX_PENDING - 1)
+            if last < start:
+                return 0
+            entries = cache.get_many([_journal_key(seq) for seq in range(start, last + 1)])
+            flushed, user_ids = start - 1, set()
+            for seq in range(start, last + 1):
+                if _journal_key(seq) in entries:
+                    user_ids.add(entries[_journal_key(seq)])
+                elif not self._gap_expired(cache, seq):
+                    # Numbered but not written yet: later entries wait for it, or for its writer to be given up on.
+                    break
+                flushed = seq
+
+            leases = {user_id: _acquire(cache, _lock_key(user_id), LOCK_TIMEOUT) for user_id in user_ids}
+            locked = {user_id for user_id, lease in leases.items() if lease is not None}
+            try:
+                cached = cache.get_many([_key(user_id) for user_id in locked])
+                # A cart missing here was checked out, or evicted before it could be written.
+                carts = {user_id: cached[_key(user_id)] for user_id in locked if _key(user_id) in cached}
+                write_carts(carts)
+            finally:
+                for user_id in locked:
+                    _release(cache, _lock_key(user_id), leases[user_id])
+            for user_id in user_ids - locked:
+                self._journal(cache, user_id)
+            cache.set(FLUSHED_KEY, flushed, timeout=None)
+            cache.delete_many([_journal_key(seq) for seq in range(start, flushed + 1)])
+        finally:
+            _release(cache, FLUSH_LOCK_KEY, flush_lease)
+        return len(carts)
+
+    def _lines(self, user_id):
+        lines = self._cache().get(_key(user_id))
+        return self._load(user_id) if lines is None else lines
+
+    def _load(self, user_id):
+        lines = list(_saved_lines(user_id))
+        # add() rather than set(): a change cached meanwhile is newer than what was read.
+        self._cache().add(_key(user_id), lines, settings.SHOP_CART_CACHE_TIMEOUT)
+        return lines
+
+    async def _aload(self, user_id):
+        lines = [line async for line in _saved_lines(user_id)]
+        await self._cache().aadd(_key(user_id), lines, settings.SHOP_CART_CACHE_TIMEOUT)
+        return lines
+
+    @contextlib.contextmanager
+    def _locked(self, user_id):
+        cache = self._cache()
+        lease = _acquire(cache, _lock_key(user_id), LOCK_TIMEOUT, wait=LOCK_WAIT)
+        if lease is None:
+            raise CartBusy(f"Cart of user {user_id} is locked")
+        try:
+            yield lease
+        finally:
+            _release(cache, _lock_key(user_id), lease)
+
+    def _mark_changed(self, user_id):
+        self._journal(self._cache(), user_id)
+        with self._lock:
+            self._marked += 1
+            full = self._marked >= settings.SHOP_CART_MAX_PENDING
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wakeup.set()
+
+    @staticmethod
+    def _journal(cache, user_id):
+        try:
+            seq = cache.incr(JOURNAL_KEY)
+        except ValueError:
+            # The first entry, or the counter was lost: numbering carries on after the flushed entries.
+            cache.add(JOURNAL_KEY, cache.get(FLUSHED_KEY, 0), timeout=None)
+            seq = cache.incr(JOURNAL_KEY)
+        cache.set(_journal_key(seq), user_id, timeout=None)
+
+    @staticmethod
+    def _gap_expired(cache, seq):
+        """Whether the missing entry ``seq`` has been missing long enough to give its writer up, or was evicted."""
+        gap = cache.get(GAP_KEY)
+        if gap is None or gap[0] != seq:
+            cache.set(GAP_KEY, (seq, time.time()), timeout=None)
+            return False
+        return time.time() - gap[1] > LOCK_TIMEOUT
+
+    @staticmethod
+    def _cache():
+        return caches[settings.SHOP_CART_CACHE]
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="cart-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.SHOP_CART_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write carts back to the database")
+            finally:
+                close_old_connections()
+
+
+def _acquire(cache, key, timeout, wait=0):
+    """Take the lock ``key`` for ``timeout`` seconds, waiting up to ``wait``; its lease, or None."""
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    delay = 0.005
+    while not cache.add(key, token, timeout):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.1)
+    return Lease(token, time.monotonic() + timeout)
+
+
+def _release(cache, key, lease):
+    # A lock that expired may have been taken by someone else since: it is only deleted while ours and unexpired.
+    # get() and delete() are two round trips, so a lease ending between them is the remaining, short, window.
+    if time.monotonic() < lease.expires and cache.get(key) == lease.token:
+        cache.delete(key)
+
+
+def _renew(cache, key, lease, timeout):
+    """Extend a held lock to ``timeout`` seconds from now; False if it expired or is someone else's."""
+    now = time.monotonic()
+    if now >= lease.expires or cache.get(key) != lease.token or not cache.touch(key, timeout):
+        return False
+    lease.expires = now + timeout
+    return True
+
+
+@contextlib.contextmanager
+def _renewed(get_cache, key, lease, timeout):
+    """Renew the lock every third of ``timeout`` while the block runs; the event yielded is set once it is lost."""
+    stop, lost = threading.Event(), threading.Event()
+
+    def run():
+        # Caches are per thread: this one gets its own connection.
+        cache = get_cache()
+        while not stop.wait(timeout / 3):
+            if not _renew(cache, key, lease, timeout):
+                lost.set()
+                return
+
+    thread = threading.Thread(target=run, name="cart-lock-renewal", daemon=True)
+    thread.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _key(user_id):
+    return f"shop:cart:{user_id}"
+
+
+def _journal_key(seq):
+    return f"shop:cart-journal:{seq}"
+
+
+def _lock_key(user_id):
+    return f"shop:cart-lock:{user_id}"
+
+
+def _saved_lines(user_id):
+    lines = CartItem.objects.filter(cart__user_id=user_id).order_by("id")
+    return lines.values_list("product_id", "quantity", "price_at_add")
+
+
+def _products():
+    return Product.objects.select_related("category", "manufacturer").defer("search_vector")
+
+
+def _cart_lines(lines, products):
+    # Products deleted since they were added are skipped, as their CartItem rows are deleted with them.
+    return [
+        CartLine(product_id, products[product_id], quantity, price)
+        for product_id, quantity, price in lines
+        if product_id in products
+    ]
+
+
+database_cart_store = DatabaseCartStore()
+cache_cart_store = CacheCartStore()
+
+
+def get_cart_store():
+    return cache_cart_store if settings.SHOP_CART_CACHE else database_cart_store
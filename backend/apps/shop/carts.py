@@ -0,0 +1,124 @@
+"""
+Cart mutations and reads over ``CartItem``.
+
+``apply_cart_operations`` applies a whole list of operations with a fixed
+number of queries: lock the cart, load the referenced products and the
+current lines, then one upsert and at most one delete. ``write_carts`` saves
+whole carts kept elsewhere (see ``cart_store.py``), any number of them in a
+fixed number of queries.
+"""
+from django.db import transaction
+from django.db.models import F, Sum, Window
+
+from .models import Cart, CartItem, Product
+
+
+class CartError(ValueError):
+    pass
+
+
+def apply_cart_operations(user, operations):
+    """
+    Apply ``set``/``increment``/``remove`` operations in order, atomically.
+
+    ``operations`` are dicts with ``op``, ``product`` and, except for
+    ``remove``, ``quantity``. A line whose quantity drops to zero or below
+    is removed. Lines keep the price the product had when first added.
+    """
+    product_ids = {operation["product"] for operation in operations}
+    with transaction.atomic():
+        cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+        prices = product_prices(product_ids)
+        quantities = dict(
+            CartItem.objects.filter(cart=cart, product_id__in=product_ids).values_list("product_id", "quantity")
+        )
+        apply_operations(quantities, operations)
+
+        upserts = [
+            CartItem(cart=cart, product_id=product_id, quantity=quantity, price_at_add=prices[product_id])
+            for product_id, quantity in quantities.items()
+            if quantity > 0
+        ]
+        removals = [product_id for product_id, quantity in quantities.items() if quantity <= 0]
+        if upserts:
+            CartItem.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+        if removals:
+            CartItem.objects.filter(cart=cart, product_id__in=removals).delete()
+    return cart
+
+
+def product_prices(product_ids):
+    """``{product id: price}``; raises ``CartError`` if any of them does not exist."""
+    prices = dict(Product.objects.filter(id__in=product_ids).values_list("id", "price"))
+    missing = set(product_ids) - prices.keys()
+    if missing:
+        raise CartError(f"Unknown products: {', '.join(map(str, sorted(missing)))}")
+    return prices
+
+
+def apply_operations(quantities, operations):
+    """Update ``{product id: quantity}`` in place; removed lines are left at 0."""
+    for operation in operations:
+        product_id = operation["product"]
+        if operation["op"] == "set":
+            quantities[product_id] = operation["quantity"]
+        elif operation["op"] == "increment":
+            quantities[product_id] = quantities.get(product_id, 0) + operation["quantity"]
+        else:
+            quantities[product_id] = 0
+
+
+def write_carts(carts):
+    """
+    Replace the lines of each user's cart, in one transaction.
+
+    ``carts`` maps user ids to lists of ``(product id, quantity, price at
+    add)``. Lines of products deleted in the meantime are dropped.
+    """
+    product_ids = {product_id for lines in carts.values() for product_id, _, _ in lines}
+    with transaction.atomic():
+        existing = set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+        cart_ids = dict(Cart.objects.filter(user_id__in=carts).values_list("user_id", "id"))
+        created = Cart.objects.bulk_create(
+            Cart(user_id=user_id) for user_id, lines in carts.items() if lines and user_id not in cart_ids
+        )
+        cart_ids.update((cart.user_id, cart.id) for cart in created)
+        CartItem.objects.filter(cart__user_id__in=carts).delete()
+        CartItem.objects.bulk_create(
+            CartItem(cart_id=cart_ids[user_id], product_id=product_id, quantity=quantity, price_at_add=price)
+            for user_id, lines in carts.items()
+            for product_id, quantity, price in lines
+            if product_id in existing
+        )
+
+
+def cart_items(user):
+    """Cart lines with products, plus subtotal and unit count, in one query."""
+    line_total = F("quantity") * F("price_at_add")
+    return (
+        CartItem.objects.filter(cart__user=user)
+        .select_related("product__category", "product__manufacturer")
+        .defer("product__search_vector")
+        .annotate(
+            line_total=line_total,
+            subtotal=Window(Sum(line_total)),
+            units=Window(Sum("quantity")),
+        )
+        .order_by("id")
+    )
+
+
+async def aget_cart_items(user):
+    return [item async for item in cart_items(user)]
+
+
+def summarize_cart(items):
+    """Totals of lines from ``cart_items``."""
+    if not items:
+        return {"subtotal": 0, "count": 0}
+    return {"subtotal": items[0].subtotal, "count": items[0].units}
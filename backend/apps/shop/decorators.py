@@ -0,0 +1,59 @@
+"""
+``@api_view`` for ``async def`` views.
+
+DRF has no async views, so ``async_api_view`` runs a view function through the
+same ``APIView`` pipeline ``@api_view`` builds: the method check, request
+parsing, content negotiation, authentication, permission and throttle checks,
+the exception handler and rendering of the returned ``Response``. Policy
+comes from the same defaults, and from ``@permission_classes``,
+``@throttle_classes`` and the other DRF decorators applied below it.
+``APIView.initial`` runs through ``sync_to_async`` because authentication and
+permissions may hit the database; the view itself stays on the event loop.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.views import APIView
+
+POLICIES = (
+    "renderer_classes",
+    "parser_classes",
+    "authentication_classes",
+    "throttle_classes",
+    "permission_classes",
+    "content_negotiation_class",
+)
+
+
+def async_api_view(http_method_names):
+    allowed_methods = [method.upper() for method in http_method_names]
+
+    def decorator(view):
+        # Like the class @api_view creates, so tests and settings can reach the policy through ``wrapper.cls``.
+        policy = {name: getattr(view, name, getattr(APIView, name)) for name in POLICIES}
+        view_class = type("AsyncWrappedAPIView", (APIView,), {**policy, "http_method_names": allowed_methods})
+
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            api_view = wrapper.cls()
+            api_view.args, api_view.kwargs = args, kwargs
+            request = api_view.initialize_request(request, *args, **kwargs)
+            api_view.request = request
+            api_view.headers = api_view.default_response_headers
+            try:
+                if request.method not in allowed_methods:
+                    raise MethodNotAllowed(request.method)
+                await sync_to_async(api_view.initial)(request, *args, **kwargs)
+                response = await view(request, *args, **kwargs)
+            except Exception as exc:
+                response = api_view.handle_exception(exc)
+            response = api_view.finalize_response(request, response, *args, **kwargs)
+            return response.render()
+
+        wrapper.cls = view_class
+        return wrapper
+
+    return decorator
@@ -0,0 +1,156 @@
+"""
+Streaming exports of the catalog and of orders.
+
+Rows are read with ``values_list().iterator(chunk_size=...)``, a server-side
+cursor on PostgreSQL, and encoded one chunk at a time, so memory use does not
+grow with the table. Rows come in ``(updated_at, id)`` order and ``since``
+keeps those modified at or after a timestamp: an incremental export passes
+the last ``updated_at`` it received (rows with exactly that timestamp repeat).
+"""
+import csv
+import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Order, OrderLine, Product
+
+# Output name -> lookup.
+PRODUCT_COLUMNS = {
+    "id": "id",
+    "sku": "sku",
+    "name": "name",
+    "description": "description",
+    "price": "price",
+    "category": "category__name",
+    "manufacturer": "manufacturer__name",
+    "photo": "photo",
+    "rating_avg": "rating_avg",
+    "rating_count": "rating_count",
+    "updated_at": "updated_at",
+}
+ORDER_COLUMNS = {
+    "id": "id",
+    "user": "user__email",
+    "order_price": "order_price",
+    "status": "status",
+    "payment_intent_id": "payment_intent_id",
+    "updated_at": "updated_at",
+}
+LINE_COLUMNS = {
+    "product_id": "product_id",
+    "product_name": "product_name",
+    "unit_price": "unit_price",
+    "quantity": "quantity",
+}
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+class InvalidSince(ValueError):
+    pass
+
+
+def parse_since(value):
+    if not value:
+        return None
+    since = parse_datetime(value)
+    if since is None and (day := parse_date(value)):
+        since = datetime.datetime.combine(day, datetime.time.min)
+    if since is None:
+        raise InvalidSince("since must be an ISO 8601 date or datetime")
+    return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+
+def _changed_since(queryset, since):
+    if since is not None:
+        queryset = queryset.filter(updated_at__gte=since)
+    return queryset.order_by("updated_at", "id")
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def product_rows(since=None, chunk_size=None):
+    chunk_size = chunk_size or settings.SHOP_EXPORT_CHUNK_SIZE
+    storage = Product._meta.get_field("photo").storage
+    rows = _changed_since(Product.objects.all(), since).values_list(*PRODUCT_COLUMNS.values())
+    for row in rows.iterator(chunk_size=chunk_size):
+        product = dict(zip(PRODUCT_COLUMNS, row))
+        product["photo"] = storage.url(product["photo"]) if product["photo"] else None
+        yield product
+
+
+def order_rows(since=None, chunk_size=None):
+    """Orders with a ``lines`` list, fetched with one query per chunk of orders."""
+    chunk_size = chunk_size or settings.SHOP_EXPORT_CHUNK_SIZE
+    rows = _changed_since(Order.objects.all(), since).values_list(*ORDER_COLUMNS.values())
+    for chunk in _chunks(rows.iterator(chunk_size=chunk_size), chunk_size):
+        orders = {row[0]: {**dict(zip(ORDER_COLUMNS, row)), "lines": []} for row in chunk}
+        lines = (
+            OrderLine.objects.filter(order_id__in=list(orders))
+            .order_by("order_id", "id")
+            .values_list("order_id", *LINE_COLUMNS.values())
+        )
+        for order_id, *line in lines:
+            orders[order_id]["lines"].append(dict(zip(LINE_COLUMNS, line)))
+        yield from orders.values()
+
+
+def order_line_rows(orders):
+    """One flat row per order line for CSV; an order without lines still gets a row."""
+    empty = dict.fromkeys(LINE_COLUMNS)
+    for order in orders:
+        lines = order.pop("lines")
+        for line in lines or [empty]:
+            yield {**order, **line}
+
+
+def encode_ndjson(rows, chunk_size=None):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for chunk in _chunks(rows, chunk_size or settings.SHOP_EXPORT_CHUNK_SIZE):
+        yield "".join(encoder.encode(row) + "\n" for row in chunk)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def encode_csv(rows, columns, chunk_size=None):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for chunk in _chunks(rows, chunk_size or settings.SHOP_EXPORT_CHUNK_SIZE):
+        yield "".join(writer.writerow([_csv_value(row[column]) for column in columns]) for row in chunk)
+
+
+def streaming_export(request, parts, export_format, filename):
+    """``request`` is the DRF request of the calling view."""
+    # ASGI serves a sync iterator by reading all of it first; hand it an async one instead.
+    if isinstance(request._request, ASGIRequest):
+        parts = _aiterate(parts)
+    response = StreamingHttpResponse(parts, content_type=FORMATS[export_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+async def _aiterate(iterator):
+    """Pull each part in the request's sync thread, where the database cursor lives."""
+    done = object()
+    try:
+        while (part := await sync_to_async(next)(iterator, done)) is not done:
+            yield part
+    finally:
+        await sync_to_async(iterator.close)()
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+
+# Filter parameters owned by each facet. A facet is counted with every other
+# filter applied but not its own, so the client can offer alternatives.
+FACET_PARAMS = {
+    "category": ("category",),
+    "manufacturer": ("manufacturer",),
+    "price": ("price_min", "price_max"),
+}
+
+
+class UnknownFacet(ValueError):
+    pass
+
+
+def parse_facets(value):
+    names = [name.strip() for name in (value or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in FACET_PARAMS]
+    if unknown:
+        raise UnknownFacet(f"Unknown facet: {', '.join(unknown)}")
+    return list(dict.fromkeys(names))
+
+
+def get_facet_counts(product_filter, names):
+    """Count products per facet value with one aggregate query per facet."""
+    counters = {"category": _count_related, "manufacturer": _count_related, "price": _count_price}
+    facets = {}
+    for name in names:
+        data = product_filter.data.copy()
+        for param in FACET_PARAMS[name]:
+            data.pop(param, None)
+        queryset = type(product_filter)(data, queryset=product_filter.queryset).qs.order_by()
+        facets[name] = counters[name](queryset, name)
+    return facets
+
+
+def _count_related(queryset, name):
+    rows = (
+        queryset.values(f"{name}_id", f"{name}__name")
+        .annotate(count=Count("id"))
+        .order_by("-count", f"{name}__name")
+    )
+    return [{"id": row[f"{name}_id"], "name": row[f"{name}__name"], "count": row["count"]} for row in rows]
+
+
+def _count_price(queryset, name):
+    bounds = settings.SHOP_PRICE_FACET_BOUNDS
+    buckets = list(zip([0, *bounds], [*bounds, None]))
+    bucket = Case(
+        *[When(price__lt=upper, then=Value(index)) for index, (_, upper) in enumerate(buckets[:-1])],
+        default=Value(len(buckets) - 1),
+        output_field=IntegerField(),
+    )
+    rows = queryset.annotate(bucket=bucket).values("bucket").annotate(count=Count("id"))
+    counts = {row["bucket"]: row["count"] for row in rows}
+    return [
+        {"min": lower, "max": upper, "count": counts.get(index, 0)}
+        for index, (lower, upper) in enumerate(buckets)
+    ]
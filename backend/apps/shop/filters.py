@@ -1,22 +1,73 @@
 import django_filters
-from .models import Product, Category, Manufacturer
+from .models import Product
+from .search import search_product_names, search_products
+
+
+REVIEW_ORDERINGS = {
+    "newest": ["-id"],
+    "oldest": ["id"],
+    "grade": ["grade"],
+    "-grade": ["-grade"],
+}
+
+
+class ProductOrderingFilter(django_filters.OrderingFilter):
+    def get_ordering_value(self, param):
+        value = super().get_ordering_value(param)
+        # "relevance" reads as most relevant first, so it maps to descending rank.
+        if value.lstrip("-") == "rank":
+            return "rank" if value.startswith("-") else "-rank"
+        return value
+
+    def filter(self, qs, value):
+        # The rank annotation only exists when a search query was given.
+        if value and "rank" not in qs.query.annotations:
+            value = [param for param in value if param.lstrip("-") != "relevance"]
+        return super().filter(qs, value)
 
 
 class ProductFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(lookup_expr="icontains", label="Search by name")
+    q = django_filters.CharFilter(method="filter_search", label="Full-text search")
+    name = django_filters.CharFilter(method="filter_name", label="Search by name")
     price_min = django_filters.NumberFilter(field_name="price", lookup_expr="gte", label="Minimum price")
     price_max = django_filters.NumberFilter(field_name="price", lookup_expr="lte", label="Maximum price")
-    category = django_filters.ModelChoiceFilter(queryset=Category.objects.all(), label="Filter by category")
-    manufacturer = django_filters.ModelChoiceFilter(queryset=Manufacturer.objects.all(), label="Filter by manufacturer")
+    # Plain id filters: a ModelChoiceFilter would look the row up on every request.
+    category = django_filters.NumberFilter(field_name="category_id", label="Filter by category")
+    manufacturer = django_filters.NumberFilter(field_name="manufacturer_id", label="Filter by manufacturer")
 
-    sort_by = django_filters.OrderingFilter(
+    sort_by = ProductOrderingFilter(
         fields=(
             ("name", "name"),
             ("price", "price"),
+            ("rating_avg", "rating"),
+            ("rank", "relevance"),
         ),
         label="Sort by",
     )
 
     class Meta:
         model = Product
-        fields = ["name", "price_min", "price_max", "category", "manufacturer"]
+        fields = ["q", "name", "price_min", "price_max", "category", "manufacturer"]
+
+    def filter_search(self, queryset, name, value):
+        return self.search(queryset)
+
+    def filter_name(self, queryset, name, value):
+        return self.search(queryset)
+
+    def search(self, queryset):
+        # `q` and `name` are applied together, by whichever of their two filters runs first.
+        if "rank" in queryset.query.annotations:
+            return queryset
+        text, name = self.form.cleaned_data.get("q"), self.form.cleaned_data.get("name")
+        if text:
+            return search_products(queryset, text, name=name)
+        return search_product_names(queryset, name)
+
+    def get_ordering(self):
+        self.errors
+        searching = bool(self.form.cleaned_data.get("q") or self.form.cleaned_data.get("name"))
+        params = self.form.cleaned_data.get("sort_by") or (["relevance"] if searching else ["name"])
+        if not searching:
+            params = [param for param in params if param.lstrip("-") != "relevance"] or ["name"]
+        return [self.filters["sort_by"].get_ordering_value(param) for param in params if param]
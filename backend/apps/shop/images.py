@@ -0,0 +1,43 @@
+"""
+Rendering of product photo variants.
+
+Only Pillow is imported here: ``render_variants`` runs in the worker processes
+started by ``apps.shop.photos``, which do not set up Django.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def render_variants(data, sizes):
+    """
+    Return ``{(variant, format): bytes}`` for an encoded image.
+
+    ``sizes`` maps variant names to the longest side in pixels. Images are
+    only ever scaled down, EXIF rotation is applied and transparency is
+    flattened onto white, since JPEG has none.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+
+    rendered = {}
+    for name, size in sizes.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            variant.save(buffer, image_format, **options)
+            rendered[(name, extension)] = buffer.getvalue()
+    return rendered
@@ -0,0 +1,63 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test running deployments with many concurrent connections and compare them. Start them first, "
+        "e.g. `gunicorn config.wsgi -w 2 --threads 8 -b :8001` and "
+        "`uvicorn config.asgi:application --workers 2 --port 8002`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", action="append", required=True, help="name=base_url, repeatable.")
+        parser.add_argument("--path", default="/api/shop/products", help="e.g. /api/shop/payment-status/<id>?wait=5")
+        parser.add_argument("--token", help="Sent as a Bearer token.")
+        parser.add_argument("--concurrency", default="10,100,500", help="Comma-separated client counts.")
+        parser.add_argument("--requests", type=int, default=5, help="Requests per client.")
+        parser.add_argument("--timeout", type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        targets = dict(target.split("=", 1) for target in options["target"])
+        headers = {"Authorization": f"Bearer {options['token']}"} if options["token"] else {}
+        levels = [int(level) for level in options["concurrency"].split(",")]
+
+        self.stdout.write(f"{'target':<10}{'clients':>9}{'ok':>8}{'failed':>8}{'req/s':>10}{'p50':>10}{'p95':>10}")
+        for name, base_url in targets.items():
+            for clients in levels:
+                latencies, failed, elapsed = asyncio.run(
+                    self.run_level(base_url, options["path"], headers, clients, options["requests"], options["timeout"])
+                )
+                p50 = statistics.median(latencies) if latencies else 0
+                p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+                self.stdout.write(
+                    f"{name:<10}{clients:>9}{len(latencies):>8}{failed:>8}{len(latencies) / elapsed:>10,.1f}"
+                    f"{p50 * 1000:>8.0f}ms{p95 * 1000:>8.0f}ms"
+                )
+
+    async def run_level(self, base_url, path, headers, clients, requests, timeout):
+        latencies, failed = [], 0
+        limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+        async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=timeout, limits=limits) as client:
+
+            async def worker():
+                nonlocal failed
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(path)
+                        response.raise_for_status()
+                    except httpx.HTTPError:
+                        failed += 1
+                    else:
+                        latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(clients)))
+            elapsed = time.perf_counter() - started
+        latencies.sort()
+        return latencies, failed, elapsed
@@ -0,0 +1,136 @@
+import random
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from apps.shop.benchmarks.data import DEFAULT_COUNTS, generate
+from apps.shop.benchmarks.runner import percentile, prime_token_cache
+from apps.shop.stripe_fake import start_fake_stripe
+from apps.users.token_cache import token_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests per second with and without connection pooling, at several numbers of concurrent "
+        "clients, against a fresh PostgreSQL test database filled with synthetic data. Each client is a thread "
+        "sending requests through the whole Django stack, so every request opens a connection unless pooled. "
+        "Run it with the production settings, e.g. DJANGO_SETTINGS_MODULE=config.settings.dev."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_COUNTS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--path", default="/api/shop/order", help="Requested as a random customer.")
+        parser.add_argument("--concurrency", default="1,16,64", help="Comma-separated client counts.")
+        parser.add_argument("--requests", type=int, default=50, help="Requests per client.")
+        parser.add_argument(
+            "--pool-size", type=int, help="max_size of the pool; defaults to the configured one, else 16."
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Connection pooling needs PostgreSQL; run with config.settings.dev")
+        levels = [int(level) for level in options["concurrency"].split(",")]
+        settings_dict = connection.settings_dict
+        configured = settings_dict["OPTIONS"].get("pool")
+        pool_options = {} if configured is True else dict(configured or {"min_size": 2, "max_size": 16})
+        if options["pool_size"]:
+            pool_options["max_size"] = options["pool_size"]
+            pool_options["min_size"] = min(pool_options.get("min_size", 2), options["pool_size"])
+        saved = dict(settings_dict["OPTIONS"]), settings_dict["CONN_MAX_AGE"]
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        stripe = start_fake_stripe()
+        try:
+            with override_settings(DATABASE_REPLICAS=[], STRIPE_API_BASE=stripe.url):
+                counts = {name: options[name] for name in DEFAULT_COUNTS}
+                self.stdout.write(f"Generating data: {', '.join(f'{n} {name}' for name, n in counts.items())}")
+                dataset = generate(counts, options["seed"], stripe)
+                prime_token_cache()
+                tokens = list(dataset.tokens.values())
+                self.stdout.write(f"Pool: {pool_options}")
+                self.stdout.write(
+                    f"{'pooling':<10}{'clients':>9}{'ok':>8}{'failed':>8}{'req/s':>10}{'p50':>10}{'p95':>10}"
+                )
+                for pooled in (False, True):
+                    self.configure(settings_dict, pool_options if pooled else None)
+                    for clients in levels:
+                        latencies, failed, elapsed = self.run_level(options["path"], tokens, clients, options)
+                        p50 = statistics.median(latencies) if latencies else 0
+                        p95 = percentile(latencies, 0.95) if latencies else 0
+                        self.stdout.write(
+                            f"{'on' if pooled else 'off':<10}{clients:>9}{len(latencies):>8}{failed:>8}"
+                            f"{len(latencies) / elapsed:>10,.1f}{p50 * 1000:>8.1f}ms{p95 * 1000:>8.1f}ms"
+                        )
+                    if pooled:
+                        self.stdout.write(f"Pool stats: {connection.pool.get_stats()}")
+        finally:
+            stripe.shutdown()
+            stripe.server_close()
+            token_cache.clear()
+            connection.close()
+            connection.close_pool()
+            settings_dict["OPTIONS"], settings_dict["CONN_MAX_AGE"] = saved
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    @staticmethod
+    def configure(settings_dict, pool_options):
+        # Connections of every thread are built from this same dict; the pool is created on first use.
+        connection.close()
+        connection.close_pool()
+        settings_dict["OPTIONS"] = {**settings_dict["OPTIONS"], "pool": pool_options}
+        settings_dict["CONN_MAX_AGE"] = 0
+
+    def run_level(self, path, tokens, clients, options):
+        latencies, failures = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(clients + 1)
+
+        def get(client, rng):
+            try:
+                response = client.get(path, headers={"Authorization": f"Bearer {rng.choice(tokens)}"})
+            except Exception:
+                return False
+            finally:
+                # What the request_finished handler does, which the test client disconnects: closes the
+                # connection, or gives it back to the pool.
+                close_old_connections()
+            return response.status_code == 200
+
+        def worker(seed):
+            client = Client()
+            rng = random.Random(seed)
+            own, failed = [], 0
+            get(client, rng)
+            start.wait()
+            try:
+                for _ in range(options["requests"]):
+                    started = time.perf_counter()
+                    if get(client, rng):
+                        own.append(time.perf_counter() - started)
+                    else:
+                        failed += 1
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(own)
+                    failures.append(failed)
+
+        threads = [threading.Thread(target=worker, args=(options["seed"] + index,)) for index in range(clients)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return latencies, sum(failures), elapsed
@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from apps.shop.models import Product
+from apps.shop.search import search_products
+
+WORDS = [
+    "дрель", "перфоратор", "шуруповёрт", "болгарка", "пила", "лобзик", "молоток", "уровень", "рулетка", "ключ",
+    "drill", "hammer", "saw", "grinder", "wrench", "screwdriver", "battery", "cordless", "impact", "compact",
+    "аккумуляторный", "сетевой", "ударный", "профессиональный", "бесщёточный", "набор", "кейс", "диск", "бита",
+]
+TERMS = ["дрель", "drill", "аккумуляторный", "impact wrench", "пила", "бесщёточный шуруповёрт"]
+
+
+class Command(BaseCommand):
+    help = "Compare full-text search latency against icontains on synthetic products (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            self.stdout.write(f"Generating {options['products']} products...")
+            Product.objects.bulk_create(
+                (
+                    Product(
+                        name=" ".join(rng.choices(WORDS, k=3)).capitalize(),
+                        description=" ".join(rng.choices(WORDS, k=30)),
+                        price=rng.randint(100, 100_000),
+                    )
+                    for _ in range(options["products"])
+                ),
+                batch_size=5000,
+            )
+
+            self.stdout.write(f"{'term':<28}{'icontains p50':>16}{'fts p50':>12}{'icontains p95':>16}{'fts p95':>12}")
+            for term in TERMS:
+                legacy = self.measure(
+                    lambda: Product.objects.filter(
+                        Q(name__icontains=term) | Q(description__icontains=term)
+                    ).order_by("name", "id")[:24],
+                    options["repeat"],
+                )
+                fts = self.measure(
+                    lambda: search_products(Product.objects.all(), term).order_by("-rank", "id")[:24],
+                    options["repeat"],
+                )
+                self.stdout.write(
+                    f"{term:<28}{legacy[0]:>14.2f}ms{fts[0]:>10.2f}ms{legacy[1]:>14.2f}ms{fts[1]:>10.2f}ms"
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def measure(build_queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(build_queryset())
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
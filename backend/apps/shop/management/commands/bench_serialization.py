@@ -0,0 +1,86 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from apps.shop.images import FORMATS
+from apps.shop.models import Category, Manufacturer, Product
+from apps.shop.serializers.products import ProductSerializer
+from config.storages import MinIOMediaStorage
+
+
+class PlainMediaStorage(S3Boto3Storage):
+    """``MinIOMediaStorage`` without the URL cache, for comparison."""
+
+    bucket_name = MinIOMediaStorage.bucket_name
+    location = MinIOMediaStorage.location
+    custom_domain = False
+
+
+class Command(BaseCommand):
+    help = "Time ProductSerializer on a page of products with and without the cached media URL resolver."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        field = Product._meta.get_field("photo")
+        original = field.storage
+        # Dummy credentials: signing happens locally, nothing is sent.
+        credentials = {"access_key": "bench", "secret_key": "bench"}
+
+        self.stdout.write(f"{'urls':<8}{'storage':<10}{'first':>10}{'p50':>10}")
+        try:
+            for signed in (False, True):
+                timings = {}
+                for name, storage_class in (("boto3", PlainMediaStorage), ("cached", MinIOMediaStorage)):
+                    field.storage = storage_class(querystring_auth=signed, **credentials)
+                    # Fresh instances: a FieldFile keeps the storage it was first accessed with.
+                    products = self.build_products(options["products"])
+                    timings[name], data = self.measure(products, options["repeat"])
+                    if not signed and name == "boto3":
+                        expected = data
+                    elif not signed and data != expected:
+                        raise CommandError("Cached public URLs differ from the ones boto3 builds")
+                for name, (first, p50) in timings.items():
+                    self.stdout.write(f"{'signed' if signed else 'public':<8}{name:<10}{first:>8.1f}ms{p50:>8.1f}ms")
+        finally:
+            field.storage = original
+
+    @staticmethod
+    def build_products(count):
+        category, manufacturer = Category(name="Инструменты"), Manufacturer(name="Bosch")
+        products = []
+        for index in range(count):
+            digest = f"{index:064x}"
+            variants = {
+                size: {extension: f"product_photos/variants/{digest}/{size}.{extension}" for extension in FORMATS}
+                for size in ("thumb", "card", "full")
+            }
+            photo = f"product_photos/photo-{index}.jpg"
+            products.append(
+                Product(
+                    id=index + 1,
+                    name=f"Товар {index}",
+                    description="Описание",
+                    price=1000 + index,
+                    category=category,
+                    manufacturer=manufacturer,
+                    photo=photo,
+                    photo_variants={"source": photo, "hash": digest, "variants": variants},
+                    photo_hash=digest,
+                )
+            )
+        return products
+
+    @staticmethod
+    def measure(products, repeat):
+        """Time of the first run (cold caches) and median of all runs."""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = ProductSerializer(products, many=True).data
+            timings.append((time.perf_counter() - started) * 1000)
+        return (timings[0], statistics.median(timings)), data
@@ -0,0 +1,120 @@
+import json
+import random
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from apps.shop.models import Order, StripeEvent
+from apps.shop.stripe_fake import sign_payload
+from apps.shop.views import stripe_webhook
+from apps.shop.webhooks import process_stripe_events
+
+SECRET = "whsec_bench"
+BENCH_EMAIL = "bench-stripe@example.com"
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a Stripe event stream through the webhook and the batch processor and report throughput "
+        "(rolled back afterwards)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="JSONL file with one Stripe event per line, e.g. from `stripe listen`.")
+        parser.add_argument("--orders", type=int, default=2000, help="Orders in the synthetic stream.")
+        parser.add_argument("--duplicates", type=float, default=0.1, help="Share of events delivered twice.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--save", help="Write the synthetic stream to this JSONL file.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            if options["file"]:
+                with open(options["file"], encoding="utf-8") as f:
+                    events = [json.loads(line) for line in f if line.strip()]
+            else:
+                events = self.synthetic_stream(options["orders"], options["duplicates"], rng)
+                if options["save"]:
+                    with open(options["save"], "w", encoding="utf-8") as f:
+                        f.writelines(json.dumps(event) + "\n" for event in events)
+
+            factory = RequestFactory()
+            requests = [
+                factory.post(
+                    "/api/shop/stripe/webhook",
+                    data=payload,
+                    content_type="application/json",
+                    HTTP_STRIPE_SIGNATURE=sign_payload(payload, SECRET),
+                )
+                for payload in (json.dumps(event) for event in events)
+            ]
+
+            with override_settings(STRIPE_WEBHOOK_SECRET=SECRET):
+                started = time.perf_counter()
+                codes = Counter(stripe_webhook(request).status_code for request in requests)
+                ingest = time.perf_counter() - started
+
+            stored = StripeEvent.objects.filter(processed_at__isnull=True).count()
+            started = time.perf_counter()
+            batches = 0
+            while process_stripe_events(options["batch_size"]):
+                batches += 1
+            process = time.perf_counter() - started
+
+            self.stdout.write(f"Delivered {len(events)} events, stored {stored} (responses: {dict(codes)})")
+            self.stdout.write(f"Ingest:  {ingest:.2f}s, {len(events) / ingest:,.0f} events/s")
+            self.stdout.write(f"Process: {process:.2f}s in {batches} batches, {stored / process:,.0f} events/s")
+            statuses = Counter(Order.objects.filter(user__email=BENCH_EMAIL).values_list("status", flat=True))
+            if statuses:
+                self.stdout.write(f"Order statuses: {dict(statuses)}")
+
+            transaction.set_rollback(True)
+
+    def synthetic_stream(self, count, duplicates, rng):
+        """Checkout outcomes for fresh orders: mostly paid, some expired, some paid then refunded."""
+        user, _ = get_user_model().objects.get_or_create(email=BENCH_EMAIL)
+        orders = Order.objects.bulk_create(
+            Order(user=user, order_price=rng.randint(100, 50_000)) for _ in range(count)
+        )
+        created = int(time.time()) - 3600
+        events = []
+
+        def add(type, obj):
+            events.append(
+                {
+                    "id": f"evt_{uuid.uuid4().hex}",
+                    "object": "event",
+                    "type": type,
+                    "created": created + len(events),
+                    "data": {"object": obj},
+                }
+            )
+
+        for order in orders:
+            session = {
+                "id": f"cs_test_{uuid.uuid4().hex}",
+                "object": "checkout.session",
+                "metadata": {"order_id": str(order.id)},
+            }
+            if rng.random() < 0.15:
+                add("checkout.session.expired", {**session, "status": "expired", "payment_status": "unpaid"})
+                continue
+            intent = f"pi_{uuid.uuid4().hex}"
+            add(
+                "checkout.session.completed",
+                {**session, "status": "complete", "payment_status": "paid", "payment_intent": intent},
+            )
+            if rng.random() < 0.05:
+                add("charge.refunded", {"id": f"ch_{uuid.uuid4().hex}", "payment_intent": intent, "refunded": True})
+
+        # Stripe redelivers events it did not get a 2xx for, possibly out of order.
+        for index in sorted(rng.sample(range(len(events)), int(len(events) * duplicates)), reverse=True):
+            events.insert(rng.randrange(index + 1, len(events) + 1), events[index])
+        return events
@@ -0,0 +1,136 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from apps.shop.benchmarks.data import DEFAULT_COUNTS, generate
+from apps.shop.benchmarks.runner import (
+    BenchmarkError,
+    environment,
+    find_regressions,
+    prime_token_cache,
+    run_scenario,
+)
+from apps.shop.benchmarks.scenarios import SCENARIOS, WEBHOOK_SECRET
+from apps.shop.cart_store import get_cart_store
+from apps.shop.recent import recent_views
+from apps.shop.stripe_fake import start_fake_stripe
+from apps.users.token_cache import token_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the API scenarios against a fresh test database filled with synthetic data and a fake Stripe, "
+        "report latency percentiles, queries and allocations per request, and compare them with a baseline. "
+        "Run it with the settings being measured; debug middleware such as silk adds its own cost."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_COUNTS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--requests", type=int, default=200, help="Timed requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=10, help="Untimed requests before the timed ones.")
+        parser.add_argument("--profiled", type=int, default=20, help="Requests measured for queries and allocations.")
+        parser.add_argument("--scenario", action="append", help="Run scenarios with this name prefix, repeatable.")
+        parser.add_argument("--list", action="store_true", help="List the scenarios and exit.")
+        parser.add_argument("--save", help="Write the results to this JSON file, e.g. as a new baseline.")
+        parser.add_argument("--baseline", help="Fail if a scenario regressed against this JSON file.")
+        parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative slowdown, 0.25 = 25%%.")
+
+    def handle(self, *args, **options):
+        if options["list"]:
+            self.stdout.write("\n".join(SCENARIOS))
+            return
+
+        prefixes = options["scenario"] or [""]
+        scenarios = [scenario for name, scenario in SCENARIOS.items() if name.startswith(tuple(prefixes))]
+        if not scenarios:
+            raise CommandError("No scenario matches; see --list")
+        counts = {name: options[name] for name in DEFAULT_COUNTS}
+
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as f:
+                baseline = json.load(f)
+            if baseline["counts"] != counts or baseline["seed"] != options["seed"]:
+                raise CommandError("The baseline was recorded with other data; pass the same counts and --seed")
+
+        results = self.run(scenarios, counts, options)
+        report = {
+            "environment": environment(),
+            "counts": counts,
+            "seed": options["seed"],
+            "requests": options["requests"],
+            "scenarios": results,
+        }
+        if options["save"]:
+            with open(options["save"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+                f.write("\n")
+            self.stdout.write(f"Saved results to {options['save']}")
+
+        if baseline is None:
+            return
+        if baseline["environment"] != report["environment"]:
+            self.stderr.write(f"Baseline environment {baseline['environment']} differs from {report['environment']}")
+        regressions = find_regressions(results, baseline, options["threshold"])
+        for name, metric, previous, current in regressions:
+            self.stderr.write(f"{name}: {metric} {previous} -> {current}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} regressions against {options['baseline']}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    def run(self, scenarios, counts, options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        stripe = start_fake_stripe()
+        try:
+            # Recent views and cached carts are flushed between scenarios rather than by the background threads,
+            # whose writes would otherwise contend with the scenarios' on SQLite. Replicas are not test databases.
+            with override_settings(
+                DATABASE_REPLICAS=[],
+                STRIPE_API_BASE=stripe.url,
+                STRIPE_TEST_SECRET_KEY="sk_test_bench",
+                STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                SHOP_RECENT_VIEWS_FLUSH_INTERVAL=24 * 3600,
+                SHOP_RECENT_VIEWS_MAX_PENDING=10**9,
+                SHOP_CART_FLUSH_INTERVAL=24 * 3600,
+                SHOP_CART_MAX_PENDING=10**9,
+            ):
+                self.stdout.write(f"Generating data: {', '.join(f'{n} {name}' for name, n in counts.items())}")
+                dataset = generate(counts, options["seed"], stripe)
+
+                self.stdout.write(
+                    f"{'scenario':<20}{'requests':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'queries':>9}{'alloc':>11}"
+                )
+                results = {}
+                for scenario in scenarios:
+                    prime_token_cache()
+                    try:
+                        result = run_scenario(
+                            scenario,
+                            dataset,
+                            options["requests"],
+                            options["warmup"],
+                            options["profiled"],
+                            options["seed"],
+                        )
+                    except BenchmarkError as e:
+                        raise CommandError(f"{scenario.name}: {e}")
+                    results[scenario.name] = result
+                    recent_views.flush()
+                    get_cart_store().flush()
+                    self.stdout.write(
+                        f"{scenario.name:<20}{result['requests']:>9}{result['p50_ms']:>8.2f}ms"
+                        f"{result['p95_ms']:>8.2f}ms{result['p99_ms']:>8.2f}ms{result['queries']:>9.1f}"
+                        f"{result['alloc_kb']:>9.0f}KB"
+                    )
+                return results
+        finally:
+            stripe.shutdown()
+            stripe.server_close()
+            token_cache.clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
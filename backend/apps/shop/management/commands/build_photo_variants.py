@@ -0,0 +1,60 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from apps.shop.models import Product
+from apps.shop.photos import generate_photo_variants, needs_variants
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate responsive variants for product photos that lack current ones. Safe to interrupt: "
+        "finished products are skipped on the next run, and --after-id skips the scan up to a product."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="Rendering processes.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--after-id", type=int, default=0, help="Resume after this product id.")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        done = failed = 0
+        last_id = options["after_id"]
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Threads wait on the pool and do the storage I/O, enough of them to keep every process busy.
+        with pool, ThreadPoolExecutor(max_workers=workers * 2) as threads:
+            while True:
+                products = list(
+                    Product.objects.filter(id__gt=last_id)
+                    .exclude(photo="")
+                    .exclude(photo__isnull=True)
+                    .only("id", "photo", "photo_variants")
+                    .order_by("id")[: options["batch_size"]]
+                )
+                if not products:
+                    break
+                last_id = products[-1].id
+
+                pending = [product for product in products if needs_variants(product)]
+                futures = {threads.submit(self.generate, product, pool): product for product in pending}
+                for future, product in futures.items():
+                    try:
+                        done += future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"Product {product.id}: {e}")
+                self.stdout.write(f"Up to product {last_id}: {done} generated, {failed} failed")
+
+        if failed:
+            raise CommandError(f"{failed} products failed; run the command again to retry them")
+        self.stdout.write(self.style.SUCCESS(f"Done, {done} products got new variants"))
+
+    @staticmethod
+    def generate(product, pool):
+        try:
+            return generate_photo_variants(product, pool=pool)
+        finally:
+            close_old_connections()
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.shop.benchmarks.data import DEFAULT_COUNTS, generate
+from apps.shop.benchmarks.plans import PLANS, VENDORS
+from apps.shop.stripe_fake import start_fake_stripe
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the canonical query of each hot endpoint against a fresh test database filled with synthetic data, "
+        "and fail if any of them scans a whole table or sorts instead of reading an index in order."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_COUNTS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--plan", action="append", help="Check plans with this name prefix, repeatable.")
+
+    def handle(self, *args, **options):
+        prefixes = tuple(options["plan"] or [""])
+        plans = [plan for name, plan in PLANS.items() if name.startswith(prefixes)]
+        if not plans:
+            raise CommandError(f"No plan matches; known plans: {', '.join(PLANS)}")
+        if connection.vendor not in VENDORS:
+            raise CommandError(
+                f"Query plans can only be checked on {' or '.join(VENDORS)}; this database is {connection.vendor}"
+            )
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        stripe = start_fake_stripe()
+        try:
+            counts = {name: options[name] for name in DEFAULT_COUNTS}
+            self.stdout.write(f"Generating data: {', '.join(f'{n} {name}' for name, n in counts.items())}")
+            dataset = generate(counts, options["seed"], stripe)
+            # Planners choose by table statistics; without them they guess.
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            failed = self.check_plans(plans, dataset, options["verbosity"])
+        finally:
+            stripe.shutdown()
+            stripe.server_close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if failed:
+            raise CommandError(f"{len(failed)} queries do not use an index: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(plans)} queries are answered from indexes"))
+
+    def check_plans(self, plans, dataset, verbosity):
+        failed = []
+        for plan in plans:
+            if plan.vendors and connection.vendor not in plan.vendors:
+                self.stdout.write(f"{plan.name:<32}skipped on {connection.vendor}")
+                continue
+            lines, problems = plan.check(dataset)
+            if problems:
+                failed.append(plan.name)
+                self.stdout.write(self.style.ERROR(f"{plan.name:<32}{'; '.join(problems)}"))
+            else:
+                self.stdout.write(f"{plan.name:<32}ok")
+            if problems or verbosity > 1:
+                self.stdout.write("".join(f"    {line}\n" for line in lines), ending="")
+        return failed
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.shop.stripe_fake import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Run a local fake of the Stripe checkout API (use with STRIPE_API_BASE)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=12111)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with 500.")
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            (options["host"], options["port"]), latency=options["latency"], failure_rate=options["failure_rate"]
+        )
+        self.stdout.write(f"Fake Stripe listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
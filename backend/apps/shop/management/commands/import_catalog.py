@@ -0,0 +1,264 @@
+"""
+Bulk catalog import from CSV or JSON Lines.
+
+Rows are read one at a time and written ``--chunk-size`` rows per transaction,
+so memory use does not depend on the file size. Products are upserted on
+``sku`` with ``bulk_create(update_conflicts=True)``: a row whose SKU already
+exists updates that product, keeping its photo and reviews. Categories and
+manufacturers are looked up by name in a cache loaded once, and missing ones
+are created in bulk. Rejected rows are counted, the first few are printed and
+all of them can be written to ``--rejects``.
+
+Columns (CSV header or JSON keys): sku, name, description, price, category,
+manufacturer, photo_url. Only sku, name and price are required.
+"""
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlparse
+
+import httpx
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image
+
+from apps.shop.cache import bump_catalog_version
+from apps.shop.models import Category, Manufacturer, Product
+
+UPDATE_FIELDS = ["name", "description", "price", "category", "manufacturer", "updated_at"]
+SHOWN_REJECTS = 10
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+class NameCache:
+    """``name -> id`` for Category or Manufacturer. Duplicate names resolve to the oldest row."""
+
+    def __init__(self, model):
+        self.model = model
+        self.ids = dict(model.objects.order_by("-id").values_list("name", "id"))
+
+    def resolve(self, names):
+        missing = sorted({name for name in names if name and name not in self.ids})
+        if missing:
+            for obj in self.model.objects.bulk_create([self.model(name=name) for name in missing]):
+                self.ids[obj.name] = obj.id
+        return self.ids
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise CommandError(f"Cannot tell the format of {path!r}, pass --format")
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line, row, error)``; ``row`` is a dict unless the line could not be parsed."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            extra = row.pop(None, None)
+            yield reader.line_num, row, "more values than columns" if extra else None
+        return
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line, None, "expected a JSON object"
+            continue
+        yield line, row, None
+
+
+def text(row, key, max_length, required=False):
+    value = row.get(key)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise RejectedRow(f"{key} is required")
+    if len(value) > max_length:
+        raise RejectedRow(f"{key} is longer than {max_length} characters")
+    return value
+
+
+def clean(row):
+    try:
+        price = Decimal(str(row.get("price", "")).strip())
+    except InvalidOperation:
+        raise RejectedRow(f"price {row.get('price')!r} is not a number")
+    if not price.is_finite() or price < 0 or price != price.to_integral_value():
+        raise RejectedRow(f"price {row.get('price')!r} is not a whole non-negative number")
+    return {
+        "sku": text(row, "sku", 64, required=True),
+        "name": text(row, "name", 150, required=True),
+        "description": text(row, "description", 1500),
+        "price": int(price),
+        "category": text(row, "category", 255) or None,
+        "manufacturer": text(row, "manufacturer", 255) or None,
+        "photo_url": text(row, "photo_url", 2048),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert or update products from a CSV or JSON Lines file ('-' for stdin), matching existing products by "
+        "sku. Columns: sku, name, description, price, category, manufacturer, photo_url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Default: from the file extension.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Products per INSERT statement.")
+        parser.add_argument("--chunk-size", type=int, default=20000, help="Rows per transaction.")
+        parser.add_argument("--rejects", help="Write rejected rows to this JSON Lines file.")
+        parser.add_argument("--photos", action="store_true", help="Download photo_url for products without a photo.")
+        parser.add_argument("--photo-workers", type=int, default=16)
+        parser.add_argument("--photo-timeout", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if path == "-" and not options["format"]:
+            raise CommandError("Pass --format when reading from stdin")
+        fmt = options["format"] or detect_format(path)
+        self.batch_size = options["batch_size"]
+        self.categories = NameCache(Category)
+        self.manufacturers = NameCache(Manufacturer)
+        self.stats = {"rows": 0, "imported": 0, "rejected": 0, "photos": 0, "photo_errors": 0}
+
+        with contextlib.ExitStack() as stack:
+            if path == "-":
+                stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+            else:
+                stream = stack.enter_context(open(path, encoding="utf-8-sig", newline=""))
+            self.rejects = stack.enter_context(open(options["rejects"], "w")) if options["rejects"] else None
+            self.photos = None
+            if options["photos"]:
+                self.photos = stack.enter_context(ThreadPoolExecutor(max_workers=options["photo_workers"]))
+                self.http = stack.enter_context(httpx.Client(timeout=options["photo_timeout"], follow_redirects=True))
+
+            self.started = time.perf_counter()
+            try:
+                self.run(read_rows(stream, fmt), options["chunk_size"])
+            finally:
+                if self.stats["imported"]:
+                    bump_catalog_version()
+
+        stats = self.stats
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done in {elapsed:.1f}s: {stats['rows']} rows ({stats['rows'] / elapsed:,.0f} rows/s), "
+                f"{stats['imported']} products imported, {stats['rejected']} rows rejected"
+            )
+        )
+        if self.photos:
+            self.stdout.write(
+                f"{stats['photos']} photos attached, {stats['photo_errors']} failed; "
+                "run build_photo_variants to render their variants"
+            )
+
+    def run(self, rows, chunk_size):
+        chunk, count = {}, 0
+        for line, row, error in rows:
+            self.stats["rows"] += 1
+            try:
+                if error:
+                    raise RejectedRow(error)
+                item = clean(row)
+            except RejectedRow as e:
+                self.reject(line, row, str(e))
+                continue
+            # A later row for the same SKU replaces an earlier one; one statement cannot upsert a key twice.
+            chunk.pop(item["sku"], None)
+            chunk[item["sku"]] = item
+            count += 1
+            if count >= chunk_size:
+                self.write_chunk(chunk)
+                chunk, count = {}, 0
+        if chunk:
+            self.write_chunk(chunk)
+
+    def write_chunk(self, chunk):
+        items = list(chunk.values())
+        with transaction.atomic():
+            categories = self.categories.resolve(item["category"] for item in items)
+            manufacturers = self.manufacturers.resolve(item["manufacturer"] for item in items)
+            products = [
+                Product(
+                    sku=item["sku"],
+                    name=item["name"],
+                    description=item["description"],
+                    price=item["price"],
+                    category_id=categories.get(item["category"]),
+                    manufacturer_id=manufacturers.get(item["manufacturer"]),
+                )
+                for item in items
+            ]
+            Product.objects.bulk_create(
+                products,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=UPDATE_FIELDS,
+            )
+        self.stats["imported"] += len(items)
+
+        if self.photos:
+            self.attach_photos({item["sku"]: item["photo_url"] for item in items if item["photo_url"]})
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(
+            f"{self.stats['rows']} rows, {self.stats['rows'] / elapsed:,.0f} rows/s, "
+            f"{self.stats['imported']} imported, {self.stats['rejected']} rejected"
+        )
+
+    def reject(self, line, row, error):
+        self.stats["rejected"] += 1
+        if self.stats["rejected"] <= SHOWN_REJECTS:
+            self.stderr.write(f"Line {line}: {error}")
+        if self.rejects:
+            self.rejects.write(json.dumps({"line": line, "error": error, "row": row}, ensure_ascii=False) + "\n")
+
+    def attach_photos(self, urls):
+        """Download photos for the chunk's products that have none; re-imports do not fetch them again."""
+        missing = (
+            Product.objects.filter(sku__in=list(urls))
+            .filter(Q(photo="") | Q(photo__isnull=True))
+            .values_list("id", "sku")
+        )
+        jobs = {self.photos.submit(self.fetch_photo, sku, urls[sku]): product_id for product_id, sku in missing}
+        attached = []
+        for future, product_id in jobs.items():
+            try:
+                attached.append(Product(id=product_id, photo=future.result()))
+            except Exception as e:
+                self.stats["photo_errors"] += 1
+                self.stderr.write(f"Product {product_id}: photo not attached: {e}")
+        Product.objects.bulk_update(attached, ["photo"], batch_size=self.batch_size)
+        self.stats["photos"] += len(attached)
+
+    def fetch_photo(self, sku, url):
+        response = self.http.get(url)
+        response.raise_for_status()
+        content = response.content
+        with Image.open(io.BytesIO(content)) as image:
+            image.verify()
+        field = Product._meta.get_field("photo")
+        filename = os.path.basename(urlparse(url).path) or f"{sku}.jpg"
+        return field.storage.save(field.generate_filename(None, filename), ContentFile(content))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.shop.webhooks import process_stripe_events
+
+
+class Command(BaseCommand):
+    help = "Apply stored Stripe webhook events to orders in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--max-attempts", type=int, default=10, help="Tries of a refund that arrived before its payment."
+        )
+        parser.add_argument("--base-delay", type=float, default=5.0)
+        parser.add_argument("--max-delay", type=float, default=600.0)
+        parser.add_argument("--once", action="store_true", help="Drain due events and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_stripe_events(
+                options["batch_size"], options["max_attempts"], options["base_delay"], options["max_delay"]
+            )
+            if processed:
+                self.stdout.write(f"Processed {processed} events")
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["poll_interval"])
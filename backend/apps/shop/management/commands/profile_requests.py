@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from config import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch sampled stack profiling of slow requests on for every running process, or off with --off. "
+        "Profiles are written to METRICS_PROFILE_DIR as folded stacks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rate", type=float, default=0.01, help="Share of requests to sample, 0 to 1.")
+        parser.add_argument("--slow", type=float, default=0.5, help="Keep profiles of requests slower than this, in s.")
+        parser.add_argument("--minutes", type=float, default=10, help="Switch off by itself after this long.")
+        parser.add_argument("--off", action="store_true")
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_PROFILE_DIR:
+            raise CommandError("Set METRICS_PROFILE_DIR to a directory shared by the web processes")
+        if options["off"]:
+            profiling.disable()
+            self.stdout.write(self.style.SUCCESS("Profiling off"))
+            return
+        if not 0 < options["rate"] <= 1:
+            raise CommandError("--rate must be in (0, 1]")
+        profiling.enable(options["rate"], options["slow"], options["minutes"] * 60)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Profiling {options['rate']:.1%} of requests for {options['minutes']:g} minutes; "
+                f"requests over {options['slow']:g}s are written to {settings.METRICS_PROFILE_DIR}"
+            )
+        )
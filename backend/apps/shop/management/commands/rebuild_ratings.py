@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.shop.cache import bump_catalog_version
+from apps.shop.models import Product
+from apps.shop.ratings import RATING_FIELDS, compute_ratings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the rating aggregates stored on products from their reviews and verify them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--check", action="store_true", help="Only report products whose aggregates drifted.")
+
+    def handle(self, *args, **options):
+        fixed = self.process(options["batch_size"], write=not options["check"])
+        if options["check"]:
+            if fixed:
+                raise CommandError(f"{fixed} products have stale rating aggregates")
+            self.stdout.write(self.style.SUCCESS("All rating aggregates are consistent"))
+            return
+
+        bump_catalog_version()
+        self.stdout.write(f"Rebuilt aggregates, {fixed} products changed")
+        drifted = self.process(options["batch_size"], write=False)
+        if drifted:
+            raise CommandError(f"{drifted} products still differ from a from-scratch recomputation")
+        self.stdout.write(self.style.SUCCESS("Verified against a from-scratch recomputation"))
+
+    def process(self, batch_size, write):
+        changed, last_id = 0, 0
+        while True:
+            with transaction.atomic():
+                products = list(
+                    Product.objects.filter(id__gt=last_id)
+                    .order_by("id")
+                    .select_for_update()
+                    .only("id", *RATING_FIELDS)[:batch_size]
+                )
+                if not products:
+                    return changed
+                last_id = products[-1].id
+
+                computed = compute_ratings([product.id for product in products])
+                stale = []
+                for product in products:
+                    expected = computed[product.id]
+                    if any(getattr(product, field) != value for field, value in expected.items()):
+                        for field, value in expected.items():
+                            setattr(product, field, value)
+                        stale.append(product)
+                changed += len(stale)
+                if write and stale:
+                    Product.objects.bulk_update(stale, RATING_FIELDS)
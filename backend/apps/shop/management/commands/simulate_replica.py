@@ -0,0 +1,41 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Stand in for replication on SQLite: copy the default database over every replica in DATABASE_REPLICAS "
+        "(LOCAL_REPLICA=1 with the local settings) every --lag seconds, so replicas trail it by up to that long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lag", type=float, default=2.0)
+        parser.add_argument("--once", action="store_true", help="Copy once and exit.")
+
+    def handle(self, *args, **options):
+        databases = settings.DATABASES
+        aliases = ["default", *settings.DATABASE_REPLICAS]
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured; run with LOCAL_REPLICA=1")
+        if any(databases[alias]["ENGINE"] != "django.db.backends.sqlite3" for alias in aliases):
+            raise CommandError("Only SQLite databases can be replicated this way")
+
+        while True:
+            started = time.perf_counter()
+            primary = sqlite3.connect(databases["default"]["NAME"])
+            try:
+                for alias in settings.DATABASE_REPLICAS:
+                    replica = sqlite3.connect(databases[alias]["NAME"])
+                    try:
+                        primary.backup(replica)
+                    finally:
+                        replica.close()
+            finally:
+                primary.close()
+            self.stdout.write(f"Replicated in {(time.perf_counter() - started) * 1000:.0f}ms")
+            if options["once"]:
+                return
+            time.sleep(options["lag"])
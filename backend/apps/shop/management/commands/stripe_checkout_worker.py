@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from apps.shop.payments import claim_checkout_batch, complete_checkout, create_checkout_session, fail_checkout
+
+
+class Command(BaseCommand):
+    help = "Create Stripe checkout sessions for pending orders from the checkout outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--poll-interval", type=float, default=0.5)
+        parser.add_argument("--lease", type=int, default=60, help="Seconds before a claimed row can be reclaimed.")
+        parser.add_argument("--max-attempts", type=int, default=8)
+        parser.add_argument("--base-delay", type=float, default=1.0)
+        parser.add_argument("--max-delay", type=float, default=300.0)
+        parser.add_argument("--once", action="store_true", help="Drain due rows and exit.")
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            while True:
+                entries = claim_checkout_batch(options["batch_size"], options["lease"])
+                if not entries:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                # Stripe calls run in the pool; database writes stay on this thread.
+                futures = {executor.submit(create_checkout_session, entry.order): entry for entry in entries}
+                for future in as_completed(futures):
+                    entry = futures[future]
+                    try:
+                        session = future.result()
+                    except Exception as e:
+                        fail_checkout(
+                            entry, e, options["max_attempts"], options["base_delay"], options["max_delay"]
+                        )
+                        self.stderr.write(f"Order {entry.order_id}: attempt {entry.attempts} failed: {e}")
+                    else:
+                        complete_checkout(entry, session)
+                        self.stdout.write(f"Order {entry.order_id}: checkout session {session.id}")
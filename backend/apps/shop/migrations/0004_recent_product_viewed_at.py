@@ -0,0 +1,64 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:21
+
+from datetime import timedelta
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.utils import timezone
+
+
+def backfill_viewed_at(apps, schema_editor):
+    # Rows used to be listed by -id; each older row gets an earlier time so -viewed_at keeps that order.
+    RecentProduct = apps.get_model("shop", "RecentProduct")
+    recent = RecentProduct.objects.using(schema_editor.connection.alias)
+    now = timezone.now()
+    ids = recent.order_by("-id").values_list("id", flat=True)
+    rows = [RecentProduct(id=id, viewed_at=now - timedelta(seconds=position)) for position, id in enumerate(ids)]
+    recent.bulk_update(rows, ["viewed_at"], batch_size=1000)
+
+
+def remove_duplicates(apps, schema_editor):
+    RecentProduct = apps.get_model("shop", "RecentProduct")
+    recent = RecentProduct.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        recent.values("user_id", "product_id")
+        .annotate(keep=Max("id"), total=Count("id"))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        recent.filter(user_id=row["user_id"], product_id=row["product_id"]).exclude(
+            id=row["keep"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_ratings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recentproduct',
+            options={'ordering': ['-viewed_at'], 'verbose_name': 'Недавно просмотренный товар', 'verbose_name_plural': 'Недавно просмотренные товары'},
+        ),
+        migrations.AddField(
+            model_name='recentproduct',
+            name='viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_viewed_at, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recentproduct',
+            index=models.Index(fields=['user', '-viewed_at'], name='shop_recent_user_viewed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recentproduct',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='shop_recentproduct_user_product_uniq'),
+        ),
+    ]
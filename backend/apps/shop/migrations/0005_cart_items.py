@@ -0,0 +1,63 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_cart_products(apps, schema_editor):
+    Cart = apps.get_model("shop", "Cart")
+    CartItem = apps.get_model("shop", "CartItem")
+    db = schema_editor.connection.alias
+    links = Cart.products.through.objects.using(db).select_related("product").iterator(chunk_size=2000)
+    batch = []
+    for link in links:
+        batch.append(CartItem(cart_id=link.cart_id, product_id=link.product_id, price_at_add=link.product.price))
+        if len(batch) >= 2000:
+            CartItem.objects.using(db).bulk_create(batch)
+            batch = []
+    CartItem.objects.using(db).bulk_create(batch)
+
+
+def copy_cart_items(apps, schema_editor):
+    Cart = apps.get_model("shop", "Cart")
+    CartItem = apps.get_model("shop", "CartItem")
+    db = schema_editor.connection.alias
+    Cart.products.through.objects.using(db).bulk_create(
+        Cart.products.through(cart_id=item.cart_id, product_id=item.product_id)
+        for item in CartItem.objects.using(db).iterator(chunk_size=2000)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_recent_product_viewed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price_at_add', models.PositiveIntegerField()),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shop.cart')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Позиция корзины',
+                'verbose_name_plural': 'Позиции корзины',
+                'constraints': [models.UniqueConstraint(fields=('cart', 'product'), name='shop_cartitem_cart_product_uniq')],
+            },
+        ),
+        migrations.RunPython(copy_cart_products, copy_cart_items),
+        migrations.RemoveField(
+            model_name='cart',
+            name='products',
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='products',
+            field=models.ManyToManyField(through='shop.CartItem', to='shop.product'),
+        ),
+    ]
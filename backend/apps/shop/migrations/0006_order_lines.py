@@ -0,0 +1,84 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_order_lines(apps, schema_editor):
+    # Orders placed before line snapshots existed get one line per product at
+    # its current price; that is the best information left.
+    Order = apps.get_model("shop", "Order")
+    OrderLine = apps.get_model("shop", "OrderLine")
+    db = schema_editor.connection.alias
+    links = Order.products.through.objects.using(db).select_related("product").iterator(chunk_size=2000)
+    batch = []
+    for link in links:
+        batch.append(
+            OrderLine(
+                order_id=link.order_id,
+                product_id=link.product_id,
+                product_name=link.product.name,
+                unit_price=link.product.price,
+                quantity=1,
+            )
+        )
+        if len(batch) >= 2000:
+            OrderLine.objects.using(db).bulk_create(batch)
+            batch = []
+    OrderLine.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_cart_items'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=150)),
+                ('unit_price', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказа',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='checkout_session_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='checkout_url',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotency_key'), name='shop_order_user_idempotency_key_uniq'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shop.order'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='shop.product'),
+        ),
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
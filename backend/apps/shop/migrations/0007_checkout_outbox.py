@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_order_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('processing', 'Обрабатывается'), ('done', 'Выполнено'), ('failed', 'Ошибка')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='checkout_outbox', to='shop.order')),
+            ],
+            options={
+                'verbose_name': 'Задача оплаты',
+                'verbose_name_plural': 'Задачи оплаты',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='shop_outbox_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:47
+
+from django.db import migrations, models
+
+
+def copy_photo_hashes(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    products = Product.objects.using(schema_editor.connection.alias)
+    recorded = products.exclude(photo_variants={}).values_list("id", "photo_variants")
+    rows = [Product(id=id, photo_hash=variants.get("hash")) for id, variants in recorded]
+    products.bulk_update(rows, ["photo_hash"], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_stripe_event_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='photo_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(copy_photo_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('photo_hash__isnull', False)), fields=['photo_hash'], name='shop_product_photo_hash_idx'),
+        ),
+    ]
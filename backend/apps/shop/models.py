@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 from apps.users.models import User
@@ -5,6 +6,7 @@ from apps.users.models import User
 from config.storages import MinIOMediaStorage
 
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
 
@@ -27,49 +29,209 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    # Supplier article number; the key `import_catalog` upserts on.
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=150)
     description = models.TextField(max_length=1500)
     price = models.PositiveIntegerField()
-    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
-    manufacturer = models.ForeignKey(Manufacturer, on_delete=models.CASCADE, null=True, blank=True)
+    # Not indexed on their own: the (category|manufacturer, name|price, id) indexes lead with them.
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    manufacturer = models.ForeignKey(Manufacturer, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     photo = models.ImageField(upload_to="product_photos/", null=True, blank=True, storage=MinIOMediaStorage())
+    # {"source": photo name, "hash": sha256, "variants": {name: {format: path}}}, see apps.shop.photos.
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # photo_variants["hash"] as a column, so products whose variants another upload can reuse are found by index.
+    photo_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Filled in by a database trigger on PostgreSQL, see apps.shop.search.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Review aggregates, maintained incrementally by apps.shop.ratings.
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0, editable=False)
+    rating_hist_0 = models.PositiveIntegerField(default=0, editable=False)
+    rating_hist_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_hist_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_hist_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_hist_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_hist_5 = models.PositiveIntegerField(default=0, editable=False)
+    # Bulk updates set it explicitly; `since=` exports read from it.
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    @property
+    def rating_histogram(self):
+        return [getattr(self, f"rating_hist_{bucket}") for bucket in range(6)]
+
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ["name"]
+        # One index per listing filter and keyset ordering, so a page is read in order without a sort.
+        # `manage.py check_query_plans` verifies the listing queries use them.
+        indexes = [
+            models.Index(fields=["name", "id"], name="shop_product_name_idx"),
+            models.Index(fields=["price", "id"], name="shop_product_price_idx"),
+            models.Index(fields=["rating_avg", "id"], name="shop_product_rating_idx"),
+            models.Index(fields=["category", "name", "id"], name="shop_product_cat_name_idx"),
+            models.Index(fields=["category", "price", "id"], name="shop_product_cat_price_idx"),
+            models.Index(fields=["manufacturer", "name", "id"], name="shop_product_mfr_name_idx"),
+            models.Index(fields=["manufacturer", "price", "id"], name="shop_product_mfr_price_idx"),
+            models.Index(fields=["updated_at", "id"], name="shop_product_updated_idx"),
+            # Only products with variants: a hash is never looked up as NULL.
+            models.Index(
+                fields=["photo_hash"],
+                condition=models.Q(photo_hash__isnull=False),
+                name="shop_product_photo_hash_idx",
+            ),
+        ]
+
+
+class ProductSearchIndex(models.Model):
+    # SQLite FTS5 table kept in sync with Product by triggers, see apps.shop.search.
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        related_name="search_index",
+    )
+    document = models.TextField(db_column="shop_product_fts")
+
+    class Meta:
+        managed = False
+        db_table = "shop_product_fts"
 
 
 class Cart(models.Model):
-    products = models.ManyToManyField(Product)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    products = models.ManyToManyField(Product, through="CartItem")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
 
     class Meta:
         verbose_name = "Корзина"
         verbose_name_plural = "Корзины"
+        indexes = [
+            # Covers the lookup by user: the id comes from the index alone.
+            models.Index(fields=["user", "id"], name="shop_cart_user_idx"),
+        ]
+
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    price_at_add = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Позиция корзины"
+        verbose_name_plural = "Позиции корзины"
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="shop_cartitem_cart_product_uniq"),
+        ]
 
 
 class Order(models.Model):
     STATUS_CHOICES = [
         ("unpaid", "Не оплачен"),
         ("paid", "Оплачен"),
+        ("expired", "Истёк"),
+        ("refunded", "Возвращён"),
     ]
     products = models.ManyToManyField(Product)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     order_price = models.PositiveIntegerField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="unpaid")
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    checkout_session_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    checkout_url = models.TextField(null=True, blank=True)
+    payment_intent_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ["-id"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "idempotency_key"], name="shop_order_user_idempotency_key_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "id"], name="shop_order_user_idx"),
+            models.Index(fields=["updated_at", "id"], name="shop_order_updated_idx"),
+        ]
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    product_name = models.CharField(max_length=150)
+    unit_price = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказа"
+        ordering = ["id"]
+
+
+class CheckoutOutbox(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Ожидает"),
+        ("processing", "Обрабатывается"),
+        ("done", "Выполнено"),
+        ("failed", "Ошибка"),
+    ]
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name="checkout_outbox")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Задача оплаты"
+        verbose_name_plural = "Задачи оплаты"
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="shop_outbox_due_idx"),
+        ]
+
+
+class StripeEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Events that came before the one they depend on are retried from this time, see apps.shop.webhooks.
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Событие Stripe"
+        verbose_name_plural = "События Stripe"
+        indexes = [
+            models.Index(
+                fields=["created"],
+                condition=models.Q(processed_at__isnull=True),
+                name="shop_stripeevent_pending_idx",
+            ),
+        ]
+
+
+class ReviewQuerySet(models.QuerySet):
+    def for_listing(self, product_id):
+        return (
+            self.filter(product_id=product_id)
+            .select_related("user")
+            .only("id", "product_id", "text", "grade", "user__id", "user__fio")
+        )
 
 
 class Review(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
 
@@ -83,6 +245,8 @@ class Review(models.Model):
         help_text="Оценка от 0.0 до 5.0 с шагом 0.1",
     )
 
+    objects = ReviewQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user}: {self.grade}"
 
@@ -90,13 +254,36 @@ class Review(models.Model):
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
         ordering = ["-id"]
+        indexes = [
+            # The orderings of REVIEW_ORDERINGS within a product.
+            models.Index(fields=["product", "id"], name="shop_review_product_idx"),
+            models.Index(fields=["product", "grade", "id"], name="shop_review_product_grade_idx"),
+        ]
 
 
 class RecentProduct(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reviews")
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    viewed_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         verbose_name = "Недавно просмотренный товар"
         verbose_name_plural = "Недавно просмотренные товары"
-        ordering = ["-id"]
+        ordering = ["-viewed_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "product"], name="shop_recentproduct_user_product_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-viewed_at"], name="shop_recent_user_viewed_idx"),
+        ]
+
+
+class CatalogVersion(models.Model):
+    """The catalog version, when the catalog cache is not shared between workers (see apps.shop.cache)."""
+
+    version = models.BigIntegerField()
+    bumped_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Версия каталога"
+        verbose_name_plural = "Версии каталога"
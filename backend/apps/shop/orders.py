@@ -0,0 +1,89 @@
+"""
+Checkout: turning a cart into an order with priced line snapshots, and the
+order history built from those orders.
+
+Callers run ``create_order_from_cart`` inside ``transaction.atomic``. The cart
+row is locked first, so parallel checkouts of one cart serialize, and the
+loser finds the cart gone (or, with the same ``Idempotency-Key``, the order
+the winner created).
+
+The history is paginated by the caller. A page of ``order_history`` costs
+three queries whatever its size: the orders, their products with category and
+manufacturer, and their lines. A page of ``order_summaries`` costs one.
+"""
+from django.db.models import F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Cart, CartItem, Order, OrderLine, Product
+
+ORDER_STATUSES = [status for status, _ in Order.STATUS_CHOICES]
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def find_idempotent_order(user, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+
+
+def create_order_from_cart(user, idempotency_key=None):
+    """Return ``(order, created)``; ``created`` is False for an idempotent replay."""
+    order = find_idempotent_order(user, idempotency_key)
+    if order is not None:
+        return order, False
+
+    cart = Cart.objects.select_for_update().filter(user=user).first()
+    # A concurrent checkout with the same key may have committed while we
+    # waited for the cart lock.
+    order = find_idempotent_order(user, idempotency_key)
+    if order is not None:
+        return order, False
+    if cart is None:
+        raise EmptyCart
+
+    items = CartItem.objects.filter(cart=cart)
+    lines = list(items.values_list("product_id", "product__name", "price_at_add", "quantity"))
+    if not lines:
+        raise EmptyCart
+    total = items.aggregate(total=Sum(F("quantity") * F("price_at_add")))["total"]
+
+    order = Order.objects.create(user=user, order_price=total, idempotency_key=idempotency_key or None)
+    OrderLine.objects.bulk_create(
+        OrderLine(order=order, product_id=product_id, product_name=name, unit_price=price, quantity=quantity)
+        for product_id, name, price, quantity in lines
+    )
+    Order.products.through.objects.bulk_create(
+        Order.products.through(order_id=order.id, product_id=product_id) for product_id, *_ in lines
+    )
+    cart.delete()
+    return order, True
+
+
+def order_history(user, statuses=None):
+    products = Product.objects.select_related("category", "manufacturer").defer("search_vector")
+    return _user_orders(user, statuses).prefetch_related(
+        Prefetch("products", queryset=products),
+        Prefetch("lines", queryset=OrderLine.objects.order_by("id")),
+    )
+
+
+def order_summaries(user, statuses=None):
+    """Orders with ``item_count``, the number of units over all their lines, instead of their contents."""
+    item_count = (
+        OrderLine.objects.filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    return _user_orders(user, statuses).annotate(item_count=Coalesce(Subquery(item_count), 0))
+
+
+def _user_orders(user, statuses):
+    orders = Order.objects.filter(user=user).only("id", "order_price", "status")
+    if statuses:
+        orders = orders.filter(status__in=statuses)
+    return orders
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class Page:
+    items: list
+    next_cursor: str | None
+    previous_cursor: str | None
+
+
+class KeysetPaginator:
+    """
+    Keyset (cursor) pagination over an ordered queryset.
+
+    ``ordering`` uses ``order_by()`` syntax and is always extended with the
+    ``id`` tie-breaker, so every position in the result set is unique and a
+    page is fetched with a single ``WHERE (key) > (cursor) LIMIT n`` query no
+    matter how deep it is. Ordering fields must not be nullable.
+    """
+
+    tie_breaker = "id"
+
+    def __init__(self, ordering, page_size=None, max_page_size=None, default_page_size=None):
+        fields = [field for field in ordering if field.lstrip("-") != self.tie_breaker]
+        explicit = [field for field in ordering if field.lstrip("-") == self.tie_breaker]
+        if explicit:
+            tie_breaker = explicit[0]
+        else:
+            tie_breaker = f"-{self.tie_breaker}" if fields and fields[-1].startswith("-") else self.tie_breaker
+        self.ordering = fields + [tie_breaker]
+        self.max_page_size = max_page_size or settings.SHOP_MAX_PAGE_SIZE
+        self.default_page_size = default_page_size or settings.SHOP_PAGE_SIZE
+        self.page_size = self.clean_page_size(page_size)
+
+    def clean_page_size(self, value):
+        try:
+            size = int(value)
+        except (TypeError, ValueError):
+            return min(self.default_page_size, self.max_page_size)
+        return max(1, min(size, self.max_page_size))
+
+    def paginate(self, queryset: QuerySet, cursor: str | None = None) -> Page:
+        forward, key, queryset = self._window(queryset, cursor)
+        return self._page(list(queryset), forward, key)
+
+    async def apaginate(self, queryset: QuerySet, cursor: str | None = None) -> Page:
+        forward, key, queryset = self._window(queryset, cursor)
+        return self._page([row async for row in queryset], forward, key)
+
+    def page_queryset(self, queryset: QuerySet, cursor: str | None = None) -> QuerySet:
+        """The query ``paginate`` runs for a page, for inspection such as EXPLAIN."""
+        return self._window(queryset, cursor)[2]
+
+    def _window(self, queryset, cursor):
+        forward, key = True, None
+        if cursor:
+            forward, key = self.decode_cursor(cursor)
+
+        ordering = self.ordering if forward else [self._invert(field) for field in self.ordering]
+        if key is not None:
+            queryset = queryset.filter(self._after(ordering, key))
+        return forward, key, queryset.order_by(*ordering)[: self.page_size + 1]
+
+    def _page(self, rows, forward, key):
+        has_more = len(rows) > self.page_size
+        items = rows[: self.page_size]
+        if not forward:
+            items.reverse()
+        if not items:
+            return Page(items=[], next_cursor=None, previous_cursor=None)
+
+        has_next = has_more if forward else key is not None
+        has_previous = key is not None if forward else has_more
+        return Page(
+            items=items,
+            next_cursor=self.encode_cursor(items[-1], forward=True) if has_next else None,
+            previous_cursor=self.encode_cursor(items[0], forward=False) if has_previous else None,
+        )
+
+    def encode_cursor(self, item, forward=True) -> str:
+        key = [getattr(item, field.lstrip("-")) for field in self.ordering]
+        payload = {"o": self.ordering, "d": "n" if forward else "p", "k": key}
+        raw = json.dumps(payload, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, cursor: str):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            payload = json.loads(raw)
+            ordering, direction, key = payload["o"], payload["d"], payload["k"]
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise InvalidCursor("Malformed cursor")
+        if ordering != self.ordering or direction not in ("n", "p") or len(key) != len(self.ordering):
+            raise InvalidCursor("Cursor does not match the requested ordering")
+        return direction == "n", key
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def _after(ordering, key):
+        # (a, b, id) > (x, y, z) expanded into a disjunction, honouring per-field direction.
+        condition = Q()
+        for position, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            term = Q(**{f"{name}__{lookup}": key[position]})
+            for previous, value in zip(ordering[:position], key):
+                term &= Q(**{previous.lstrip("-"): value})
+            condition |= term
+        return condition
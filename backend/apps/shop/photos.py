@@ -0,0 +1,130 @@
+"""
+Responsive variants of product photos.
+
+Saving a product with a new photo schedules ``generate_photo_variants`` once
+the write commits. The original is hashed and each variant is stored next to
+it as ``<upload dir>/variants/<sha256>/<variant>.<format>``, so identical
+uploads share one set of files and are only rendered once; earlier uploads
+are found through the indexed ``Product.photo_hash``. Rendering runs in a
+process pool; a dispatcher thread does the storage I/O and records the result
+in ``Product.photo_variants``, so neither blocks the request.
+"""
+import hashlib
+import logging
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+
+from .cache import bump_catalog_version
+from .images import render_variants
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_process_pool = None
+_dispatcher = None
+
+
+def get_process_pool():
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            # Spawned rather than forked: the parent runs threads.
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.SHOP_PHOTO_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _process_pool
+
+
+def schedule_photo_variants(product_id):
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="photo-variants")
+    _dispatcher.submit(_generate_in_background, product_id)
+
+
+def _generate_in_background(product_id):
+    try:
+        product = Product.objects.only("id", "photo", "photo_variants").filter(id=product_id).first()
+        if product is not None:
+            generate_photo_variants(product)
+    except Exception:
+        logger.exception("Failed to generate photo variants for product %s", product_id)
+    finally:
+        close_old_connections()
+
+
+def needs_variants(product):
+    return bool(product.photo) and product.photo_variants.get("source") != product.photo.name
+
+
+def generate_photo_variants(product, pool=None):
+    """Render, store and record the variants of ``product.photo``; False if they were already current."""
+    if not needs_variants(product):
+        return False
+    storage = product.photo.storage
+    source = product.photo.name
+    with storage.open(source, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    variants = _find_variants(digest)
+    if variants is None:
+        rendered = _render(data, pool)
+        prefix = posixpath.join(posixpath.dirname(source), "variants", digest)
+        variants = {}
+        for (name, extension), content in rendered.items():
+            path = f"{prefix}/{name}.{extension}"
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(content))
+            variants.setdefault(name, {})[extension] = path
+
+    value = {"source": source, "hash": digest, "variants": variants}
+    # Only if the photo was not replaced meanwhile; that save scheduled its own run.
+    if not Product.objects.filter(id=product.id, photo=source).update(photo_variants=value, photo_hash=digest):
+        return False
+    product.photo_variants, product.photo_hash = value, digest
+    bump_catalog_version()
+    return True
+
+
+def _render(data, pool):
+    global _process_pool
+    pool = pool or get_process_pool()
+    try:
+        return pool.submit(render_variants, data, settings.SHOP_PHOTO_VARIANT_SIZES).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time.
+        with _lock:
+            if _process_pool is pool:
+                _process_pool = None
+        raise
+
+
+def variants_with_hash(digest):
+    """The recorded variants of any photo with this hash: at most one row, read from the ``photo_hash`` index."""
+    return Product.objects.filter(photo_hash=digest).order_by().values_list("photo_variants", flat=True)[:1]
+
+
+def _find_variants(digest):
+    value = next(iter(variants_with_hash(digest)), None)
+    return value["variants"] if value else None
+
+
+def photo_variant_urls(product):
+    """``{variant: {format: url}}`` for the current photo, empty until its variants exist."""
+    if not product.photo or product.photo_variants.get("source") != product.photo.name:
+        return {}
+    storage = product.photo.storage
+    return {
+        name: {extension: storage.url(path) for extension, path in formats.items()}
+        for name, formats in product.photo_variants["variants"].items()
+    }
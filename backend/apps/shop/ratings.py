@@ -0,0 +1,102 @@
+"""
+Incremental maintenance of the review aggregates stored on ``Product``.
+
+Every change is a single ``UPDATE`` built from ``F()`` expressions, so
+concurrent reviews of the same product never lose an increment. Callers run
+these inside the transaction that writes the review.
+"""
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from django.utils import timezone
+
+from .models import Product, Review
+
+BUCKETS = range(6)
+
+
+def rating_bucket(grade):
+    return int(Decimal(grade).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _apply(deltas):
+    for product_id, (grade_delta, count_delta, buckets) in deltas.items():
+        if not count_delta and not grade_delta and not any(buckets.values()):
+            continue
+        rating_sum = F("rating_sum") + grade_delta
+        rating_count = F("rating_count") + count_delta
+        updates = {
+            "rating_sum": rating_sum,
+            "rating_count": rating_count,
+            # SET expressions see the row as it was before the update.
+            "rating_avg": Round(Coalesce(Cast(rating_sum, FloatField()) / NullIf(rating_count, 0), Value(0.0)), 2),
+            "updated_at": timezone.now(),
+        }
+        for bucket, delta in buckets.items():
+            if delta:
+                updates[f"rating_hist_{bucket}"] = F(f"rating_hist_{bucket}") + delta
+        Product.objects.filter(id=product_id).update(**updates)
+
+
+def _deltas(*changes):
+    deltas = defaultdict(lambda: [Decimal(0), 0, defaultdict(int)])
+    for product_id, grade, sign in changes:
+        entry = deltas[product_id]
+        entry[0] += Decimal(grade) * sign
+        entry[1] += sign
+        entry[2][rating_bucket(grade)] += sign
+    return deltas
+
+
+def review_added(review):
+    _apply(_deltas((review.product_id, review.grade, 1)))
+
+
+def review_removed(review):
+    _apply(_deltas((review.product_id, review.grade, -1)))
+
+
+def review_changed(old_product_id, old_grade, review):
+    _apply(_deltas((old_product_id, old_grade, -1), (review.product_id, review.grade, 1)))
+
+
+def _bucket_filter(bucket):
+    # Same half-up rounding as rating_bucket().
+    return Q(grade__gte=Decimal(bucket) - Decimal("0.5"), grade__lt=Decimal(bucket) + Decimal("0.5"))
+
+
+def compute_ratings(product_ids):
+    """Recompute aggregates for ``product_ids`` from ``Review`` in one query."""
+    rows = (
+        Review.objects.filter(product_id__in=product_ids)
+        .values("product_id")
+        .annotate(
+            rating_count=Count("id"),
+            rating_sum=Sum("grade"),
+            **{f"rating_hist_{bucket}": Count("id", filter=_bucket_filter(bucket)) for bucket in BUCKETS},
+        )
+        .order_by()
+    )
+    computed = {product_id: empty_ratings() for product_id in product_ids}
+    for row in rows:
+        ratings = computed[row.pop("product_id")]
+        ratings.update(row)
+        ratings["rating_sum"] = Decimal(row["rating_sum"]).quantize(Decimal("0.1"))
+        ratings["rating_avg"] = (ratings["rating_sum"] / row["rating_count"]).quantize(
+            Decimal("0.01"), rounding=ROUND_HALF_UP
+        )
+    return computed
+
+
+def empty_ratings():
+    return {
+        "rating_avg": Decimal("0.00"),
+        "rating_count": 0,
+        "rating_sum": Decimal("0.0"),
+        **{f"rating_hist_{bucket}": 0 for bucket in BUCKETS},
+    }
+
+
+RATING_FIELDS = list(empty_ratings())
@@ -0,0 +1,104 @@
+"""
+Buffered recently-viewed tracking.
+
+Product views are recorded in a per-process buffer and written by a daemon
+thread every ``SHOP_RECENT_VIEWS_FLUSH_INTERVAL`` seconds (or as soon as
+``SHOP_RECENT_VIEWS_MAX_PENDING`` views are waiting), so the detail endpoint
+never waits on the database. Repeated views of the same product coalesce into
+one upsert of ``viewed_at``, and each flush trims every affected user back to
+their ``SHOP_RECENT_PRODUCTS_LIMIT`` newest rows. Views still in the buffer
+when a process dies are lost, which is acceptable for this feature.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Product, RecentProduct
+
+logger = logging.getLogger(__name__)
+
+
+class RecentViewBuffer:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, user_id, product_id):
+        with self._lock:
+            self._pending[(user_id, product_id)] = timezone.now()
+            full = len(self._pending) >= settings.SHOP_RECENT_VIEWS_MAX_PENDING
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        # Products deleted since they were viewed would fail the whole batch.
+        existing = set(Product.objects.filter(id__in={key[1] for key in pending}).values_list("id", flat=True))
+        rows = [
+            RecentProduct(user_id=user_id, product_id=product_id, viewed_at=viewed_at)
+            for (user_id, product_id), viewed_at in pending.items()
+            if product_id in existing
+        ]
+        with transaction.atomic():
+            RecentProduct.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["user", "product"],
+                update_fields=["viewed_at"],
+            )
+            trim_recent_products({user_id for user_id, _ in pending})
+        return len(rows)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="recent-views-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.SHOP_RECENT_VIEWS_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush recently viewed products")
+            finally:
+                close_old_connections()
+
+
+def recent_products(user):
+    return (
+        RecentProduct.objects.filter(user=user)
+        .select_related("user", "product__category", "product__manufacturer")
+        .defer("product__search_vector")
+        .order_by("-viewed_at")[: settings.SHOP_RECENT_PRODUCTS_LIMIT]
+    )
+
+
+def trim_recent_products(user_ids):
+    overflow = (
+        RecentProduct.objects.filter(user_id__in=user_ids)
+        .annotate(position=Window(RowNumber(), partition_by=F("user_id"), order_by=F("viewed_at").desc()))
+        .filter(position__gt=settings.SHOP_RECENT_PRODUCTS_LIMIT)
+        .values_list("id", flat=True)
+    )
+    ids = list(overflow)
+    if ids:
+        RecentProduct.objects.filter(id__in=ids).delete()
+
+
+recent_views = RecentViewBuffer()
@@ -0,0 +1,206 @@
+"""
+Full-text product search.
+
+PostgreSQL keeps ``Product.search_vector`` up to date with a trigger (Russian
+and English stemming, name weighted above description) and searches it through
+a GIN index. SQLite, used by the ``local`` settings, mirrors name and
+description into an external-content FTS5 table maintained by triggers. Both
+paths annotate matching products with a ``rank`` where higher means more
+relevant, a double precision float: PostgreSQL's ``real`` ranks would come
+back rounded to their shortest text form, and a page cursor holding one would
+no longer equal the rank it was read from.
+
+Searching by name alone (``?name=``) is a substring match on PostgreSQL,
+answered from a ``pg_trgm`` index on ``UPPER(name)``, the expression
+``icontains`` compares; SQLite matches the name column of its FTS5 table and
+other databases use the full-text path for it. Given both, ``name`` narrows the
+full-text matches and ``q`` ranks them.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connections
+from django.db.models import F, FloatField, Lookup, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from .models import ProductSearchIndex
+
+PRODUCT_TABLE = "shop_product"
+FTS_TABLE = "shop_product_fts"
+SEARCH_CONFIGS = ("russian", "english")
+
+POSTGRES_INSTALL = [
+    """
+    CREATE OR REPLACE FUNCTION shop_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE TRIGGER shop_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON {PRODUCT_TABLE}
+    FOR EACH ROW EXECUTE FUNCTION shop_product_search_vector_update()
+    """,
+    f"CREATE INDEX IF NOT EXISTS shop_product_search_vector_gin ON {PRODUCT_TABLE} USING gin (search_vector)",
+    f"UPDATE {PRODUCT_TABLE} SET search_vector = NULL",
+]
+
+POSTGRES_NAME_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS shop_product_name_trgm ON {PRODUCT_TABLE} USING gin (UPPER(name::text) gin_trgm_ops)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS shop_product_search_vector_gin",
+    f"DROP TRIGGER IF EXISTS shop_product_search_vector_trigger ON {PRODUCT_TABLE}",
+    "DROP FUNCTION IF EXISTS shop_product_search_vector_update()",
+]
+
+SQLITE_TABLE = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, content='{PRODUCT_TABLE}', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+"""
+
+SQLITE_TRIGGERS = {
+    "shop_product_fts_insert": f"""
+        CREATE TRIGGER shop_product_fts_insert AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """,
+    "shop_product_fts_delete": f"""
+        CREATE TRIGGER shop_product_fts_delete AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """,
+    "shop_product_fts_update": f"""
+        CREATE TRIGGER shop_product_fts_update AFTER UPDATE OF name, description ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """,
+}
+
+
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", (*lhs_params, *rhs_params)
+
+
+ProductSearchIndex._meta.get_field("document").register_lookup(Match)
+
+
+def install_search_index(connection):
+    """Create the vendor-specific index and triggers. Safe to call repeatedly."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"DROP TRIGGER IF EXISTS shop_product_search_vector_trigger ON {PRODUCT_TABLE}")
+            for statement in POSTGRES_INSTALL:
+                cursor.execute(statement)
+        elif connection.vendor == "sqlite":
+            # Rebuilding a table during SQLite migrations drops its triggers, so
+            # missing triggers are recreated and the index re-synced from scratch.
+            cursor.execute(SQLITE_TABLE)
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [PRODUCT_TABLE])
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+            for name in missing:
+                cursor.execute(SQLITE_TRIGGERS[name])
+            if missing:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def install_name_index(connection):
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for statement in POSTGRES_NAME_INDEX:
+                cursor.execute(statement)
+
+
+def uninstall_name_index(connection):
+    # The extension stays: dropping it would break anything else built on it.
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX IF EXISTS shop_product_name_trgm")
+
+
+def uninstall_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for statement in POSTGRES_UNINSTALL:
+                cursor.execute(statement)
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def fts5_match_expression(text):
+    # Quote every term so user input can never be parsed as FTS5 syntax; each
+    # term is a prefix match and all terms must be present.
+    terms = re.findall(r"\w+", text)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_products(queryset, text, name=None):
+    """Filter ``queryset`` to products matching ``text`` and annotate ``rank``.
+
+    With ``name``, matches must also have it in their name, as ``search_product_names`` finds them; the rank is
+    still that of ``text``.
+    """
+    vendor = connections[queryset.db].vendor
+
+    if vendor == "postgresql":
+        query = SearchQuery(text, config=SEARCH_CONFIGS[0], search_type="websearch")
+        for config in SEARCH_CONFIGS[1:]:
+            query |= SearchQuery(text, config=config, search_type="websearch")
+        rank = Cast(SearchRank(F("search_vector"), query), FloatField())
+        queryset = queryset.filter(search_vector=query).annotate(rank=rank)
+        return queryset.filter(name__icontains=name) if name else queryset
+
+    if vendor == "sqlite":
+        expression = fts5_match_expression(text)
+        if name:
+            # One MATCH per query: the name terms join the expression as a column filter.
+            name_expression = fts5_match_expression(name)
+            expression = expression and name_expression and f"({expression}) AND name : ({name_expression})"
+        return fts5_search(queryset, expression)
+
+    queryset = queryset.filter(Q(name__icontains=text) | Q(description__icontains=text))
+    if name:
+        queryset = queryset.filter(name__icontains=name)
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def search_product_names(queryset, text):
+    """Filter ``queryset`` to products whose name contains ``text`` and annotate ``rank``."""
+    vendor = connections[queryset.db].vendor
+    if vendor == "postgresql":
+        rank = Cast(TrigramSimilarity("name", text), FloatField())
+        return queryset.filter(name__icontains=text).annotate(rank=rank)
+    if vendor == "sqlite":
+        expression = fts5_match_expression(text)
+        return fts5_search(queryset, expression and f"name : ({expression})")
+    return search_products(queryset, text)
+
+
+def fts5_search(queryset, expression):
+    if not expression:
+        return queryset.none()
+    # bm25() is lower for better matches; negate it so rank sorts like Postgres.
+    rank = RawSQL(f"-bm25({FTS_TABLE}, 10.0, 1.0)", (), output_field=FloatField())
+    return queryset.filter(search_index__document__match=expression).annotate(rank=rank)
@@ -1,7 +1,32 @@
 from rest_framework import serializers
 
-from .products import ProductSerializer
 
+class CartItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source="product_id")
+    name = serializers.CharField(source="product.name")
+    description = serializers.CharField(source="product.description")
+    price = serializers.IntegerField(source="price_at_add")
+    category = serializers.CharField(source="product.category.name", read_only=True)
+    manufacturer = serializers.CharField(source="product.manufacturer.name", read_only=True)
+    photo = serializers.FileField(source="product.photo")
+    quantity = serializers.IntegerField()
+    line_total = serializers.IntegerField()
 
-class CartSerializer(serializers.Serializer):
-    products = ProductSerializer(many=True, read_only=True)
+
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ("set", "increment", "remove")
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=-999, max_value=999, required=False)
+
+    def validate(self, attrs):
+        if attrs["op"] != "remove" and "quantity" not in attrs:
+            raise serializers.ValidationError({"quantity": "Обязательное поле."})
+        if attrs["op"] == "set" and attrs["quantity"] < 0:
+            raise serializers.ValidationError({"quantity": "Количество не может быть отрицательным."})
+        return attrs
+
+
+class CartOperationsSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
@@ -3,8 +3,23 @@ from rest_framework import serializers
 from .products import ProductSerializer
 
 
+class OrderLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(allow_null=True)
+    product_name = serializers.CharField()
+    unit_price = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+
+
 class OrderSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     order_price = serializers.DecimalField(max_digits=10, decimal_places=2)
     products = ProductSerializer(many=True, read_only=True)
+    lines = OrderLineSerializer(many=True, read_only=True)
+    status = serializers.CharField()
+
+
+class OrderSummarySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    order_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    item_count = serializers.IntegerField()
     status = serializers.CharField()
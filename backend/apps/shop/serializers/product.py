@@ -1,8 +1,12 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 from .products import ProductSerializer
+from ..filters import REVIEW_ORDERINGS
 from ..models import Review, Product
+from ..pagination import KeysetPaginator
+from ..photos import photo_variant_urls
 
 
 class UserSerializer(serializers.Serializer):
@@ -36,11 +40,28 @@ class ProductDetailSerializer(serializers.Serializer):
     category = serializers.CharField(source="category.name", read_only=True)
     manufacturer = serializers.CharField(source="manufacturer.name", read_only=True)
     photo = serializers.FileField()
+    photo_variants = serializers.SerializerMethodField()
+    rating_avg = serializers.DecimalField(max_digits=3, decimal_places=2)
+    rating_count = serializers.IntegerField()
+    rating_histogram = serializers.ListField(child=serializers.IntegerField())
     reviews = serializers.SerializerMethodField()
+    reviews_next = serializers.SerializerMethodField()
+
+    def get_photo_variants(self, obj):
+        return photo_variant_urls(obj)
 
     def get_reviews(self, obj):
-        reviews = Review.objects.filter(product=obj)
-        return ReviewSerializer(reviews, many=True).data
+        return ReviewSerializer(self._reviews_page(obj).items, many=True).data
+
+    def get_reviews_next(self, obj):
+        # Cursor for /product/<id>/reviews to continue after the embedded page.
+        return self._reviews_page(obj).next_cursor
+
+    def _reviews_page(self, obj):
+        if not hasattr(self, "_reviews_page_cache"):
+            paginator = KeysetPaginator(REVIEW_ORDERINGS["newest"], default_page_size=settings.SHOP_REVIEWS_PAGE_SIZE)
+            self._reviews_page_cache = paginator.paginate(Review.objects.for_listing(obj.id))
+        return self._reviews_page_cache
 
 
 class RecentProductSerializer(serializers.Serializer):
@@ -1,12 +1,31 @@
 from rest_framework import serializers
 
 from ..models import Product
+from ..photos import photo_variant_urls
 
 
 class ProductSerializer(serializers.ModelSerializer):
     category = serializers.CharField(source="category.name", read_only=True)
     manufacturer = serializers.CharField(source="manufacturer.name", read_only=True)
+    rating_histogram = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    photo_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ("id", "name", "description", "price", "category", "manufacturer", "photo")
+        fields = (
+            "id",
+            "name",
+            "description",
+            "price",
+            "category",
+            "manufacturer",
+            "photo",
+            "photo_variants",
+            "rating_avg",
+            "rating_count",
+            "rating_histogram",
+        )
+        read_only_fields = ("rating_avg", "rating_count")
+
+    def get_photo_variants(self, obj):
+        return photo_variant_urls(obj)
@@ -0,0 +1,23 @@
+from django.db import connections, router, transaction
+
+from .cache import bump_catalog_version
+from .models import Product
+from .photos import needs_variants, schedule_photo_variants
+from .search import install_search_index
+
+
+def ensure_search_index(sender, using, **kwargs):
+    # Replicas receive the index with the rest of the primary's schema.
+    if connections[using].vendor == "sqlite" and router.allow_migrate_model(using, Product):
+        install_search_index(connections[using])
+
+
+def invalidate_catalog(sender, using, **kwargs):
+    # Bump only once the write is visible, otherwise a concurrent read could
+    # cache pre-commit data under the new version.
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+def render_photo_variants(sender, instance, using, **kwargs):
+    if needs_variants(instance):
+        transaction.on_commit(lambda: schedule_photo_variants(instance.pk), using=using)
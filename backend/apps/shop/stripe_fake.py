@@ -0,0 +1,121 @@
+"""
+A minimal stand-in for the Stripe API, for local runs and benchmarks.
+
+Implements just the checkout session endpoints the shop calls. Point the
+client at it with ``STRIPE_API_BASE=http://127.0.0.1:<port>``; latency and a
+failure rate can be injected to exercise retries.
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sessions = {}
+        self.idempotent = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def create_session(self, form, idempotency_key):
+        with self.lock:
+            if idempotency_key and idempotency_key in self.idempotent:
+                return self.sessions[self.idempotent[idempotency_key]]
+            session_id = f"cs_test_{uuid.uuid4().hex}"
+            session = {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"{self.url}/pay/{session_id}",
+                "mode": form.get("mode", "payment"),
+                "status": "open",
+                "payment_status": "unpaid",
+                "customer_email": form.get("customer_email"),
+                "metadata": {key[9:-1]: value for key, value in form.items() if key.startswith("metadata[")},
+            }
+            self.sessions[session_id] = session
+            if idempotency_key:
+                self.idempotent[idempotency_key] = session_id
+            return session
+
+    def pay(self, session_id):
+        with self.lock:
+            self.sessions[session_id].update(status="complete", payment_status="paid")
+            return self.sessions[session_id]
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    server: FakeStripeServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        if not self._simulate():
+            return
+        if self.path == "/v1/checkout/sessions":
+            form = dict(parse_qsl(body))
+            return self._send(200, self.server.create_session(form, self.headers.get("Idempotency-Key")))
+        if self.path.startswith("/_test/pay/"):
+            session_id = self.path.rsplit("/", 1)[-1]
+            if session_id in self.server.sessions:
+                return self._send(200, self.server.pay(session_id))
+        return self._not_found()
+
+    def do_GET(self):
+        if not self._simulate():
+            return
+        if self.path.startswith("/v1/checkout/sessions/"):
+            session_id = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+            session = self.server.sessions.get(session_id)
+            if session is not None:
+                return self._send(200, session)
+        return self._not_found()
+
+    def _simulate(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self._send(500, {"error": {"type": "api_error", "message": "Injected failure"}})
+            return False
+        return True
+
+    def _not_found(self):
+        self._send(404, {"error": {"type": "invalid_request_error", "message": "No such resource"}})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_stripe(host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0):
+    """Start a server on a background thread; stop it with ``shutdown()``."""
+    server = FakeStripeServer((host, port), latency=latency, failure_rate=failure_rate)
+    threading.Thread(target=server.serve_forever, name="fake-stripe", daemon=True).start()
+    return server
+
+
+def sign_payload(payload, secret):
+    """A ``Stripe-Signature`` header for a webhook body, as Stripe computes it."""
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
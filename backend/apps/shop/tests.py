@@ -0,0 +1,1673 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, connections
+from django.db.models import F
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.conf import settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.throttling import AnonRateThrottle
+import stripe
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from apps.shop import cart_store, photos, views
+from apps.shop.benchmarks import plans
+from apps.shop.benchmarks.plans import Plan, explain
+from apps.shop.cache import database_version
+from apps.shop.cart_store import CacheCartStore, CartBusy, cache_cart_store
+from apps.shop.carts import apply_cart_operations
+from apps.shop.models import (
+    Cart,
+    CartItem,
+    CatalogVersion,
+    Category,
+    CheckoutOutbox,
+    Manufacturer,
+    Order,
+    OrderLine,
+    Product,
+    RecentProduct,
+    Review,
+    StripeEvent,
+)
+from apps.shop.images import render_variants
+from apps.shop.orders import create_order_from_cart
+from apps.shop.management.commands.check_query_plans import Command as CheckQueryPlansCommand
+from apps.shop.photos import generate_photo_variants, needs_variants, photo_variant_urls
+from apps.shop.ratings import compute_ratings, empty_ratings
+from apps.shop.recent import RecentViewBuffer, recent_products, recent_views
+from apps.shop.stripe_fake import sign_payload
+from apps.shop.webhooks import process_stripe_events
+from apps.users.models import User
+from apps.users.token_cache import token_cache
+from config import metrics
+from config.replicas import ReplicaMiddleware
+from config.settings import base as base_settings
+from config.storages import MinIOMediaStorage, StaticStorage
+
+
+def create_customer(email="buyer@example.com", **extra_fields):
+    """A customer and the headers authenticating as them."""
+    user = User.objects.create_user("Покупатель", email, "password", **extra_fields)
+    token = Token.objects.create(user=user)
+    return user, {"Authorization": f"Bearer {token.key}"}
+
+
+@override_settings(SHOP_CHECKOUT_POLL_INTERVAL=0.05)
+class OrderCheckoutTests(TestCase):
+    def setUp(self):
+        self.user, self.headers = create_customer()
+        self.order = Order.objects.create(user=self.user, order_price=1000)
+        CheckoutOutbox.objects.create(order=self.order)
+        self.url = f"/api/shop/order/{self.order.id}/checkout"
+
+    async def test_wait_returns_once_the_session_is_created(self):
+        async def create_session():
+            await asyncio.sleep(0.2)
+            await Order.objects.filter(id=self.order.id).aupdate(
+                checkout_session_id="cs_test_1", checkout_url="https://checkout.example/cs_test_1"
+            )
+
+        started = time.monotonic()
+        response, _ = await asyncio.gather(
+            self.async_client.get(f"{self.url}?wait=10", headers=self.headers), create_session()
+        )
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["state"], "ready")
+        self.assertEqual(response.json()["data"]["checkout_session_id"], "cs_test_1")
+
+    async def test_waits_do_not_block_each_other(self):
+        started = time.monotonic()
+        responses = await asyncio.gather(
+            *(self.async_client.get(f"{self.url}?wait=1", headers=self.headers) for _ in range(5))
+        )
+
+        # Run one after another, five waits would take 5 seconds.
+        self.assertLess(time.monotonic() - started, 3)
+        self.assertEqual([response.json()["data"]["state"] for response in responses], ["pending"] * 5)
+
+    async def test_failed_checkout_is_returned_without_waiting(self):
+        await CheckoutOutbox.objects.filter(order=self.order).aupdate(status="failed")
+
+        started = time.monotonic()
+        response = await self.async_client.get(f"{self.url}?wait=10", headers=self.headers)
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.json()["data"]["state"], "failed")
+
+
+def checkout_session(payment_status="unpaid", status="open"):
+    return stripe.checkout.Session.construct_from(
+        {"id": "cs_test_1", "payment_status": payment_status, "status": status, "payment_intent": "pi_test_1"},
+        "sk_test_fake",
+    )
+
+
+@override_settings(SHOP_PAYMENT_POLL_INTERVAL=0.05, SHOP_PAYMENT_STATUS_TTL=60)
+class PaymentStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.headers = create_customer()
+        self.order = Order.objects.create(user=self.user, order_price=1000, checkout_session_id="cs_test_1")
+        self.retrieve = mock.AsyncMock(return_value=checkout_session())
+        client = mock.Mock()
+        client.checkout.sessions.retrieve_async = self.retrieve
+        patcher = mock.patch("apps.shop.payments.async_stripe_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def status(self, query=""):
+        response = await self.async_client.get(f"/api/shop/payment-status/cs_test_1{query}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["status"]
+
+    async def test_stripe_is_asked_once_per_ttl(self):
+        self.assertEqual(await self.status(), "unpaid")
+        self.assertEqual(await self.status(), "unpaid")
+        self.retrieve.assert_awaited_once_with("cs_test_1")
+
+        with override_settings(SHOP_PAYMENT_STATUS_TTL=0.1):
+            await cache.aclear()
+            await self.status()
+            await asyncio.sleep(0.2)
+            await self.status()
+        self.assertEqual(self.retrieve.await_count, 3)
+
+    async def test_a_stale_status_is_taken_from_stripe(self):
+        self.retrieve.return_value = checkout_session(payment_status="paid", status="complete")
+
+        self.assertEqual(await self.status(), "paid")
+
+        order = await Order.objects.aget(id=self.order.id)
+        self.assertEqual((order.status, order.payment_intent_id), ("paid", "pi_test_1"))
+        # Settled orders are answered from the row.
+        self.assertEqual(await self.status(), "paid")
+        self.retrieve.assert_awaited_once()
+
+    async def test_stripe_errors_report_the_known_status_and_are_retried(self):
+        self.retrieve.side_effect = stripe.error.APIConnectionError("Stripe is down")
+
+        self.assertEqual(await self.status(), "unpaid")
+        self.assertEqual(await self.status(), "unpaid")
+        self.assertEqual(self.retrieve.await_count, 2)
+
+    async def test_wait_gives_up_at_its_timeout(self):
+        started = time.monotonic()
+        self.assertEqual(await self.status("?wait=0.3"), "unpaid")
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+        with override_settings(SHOP_PAYMENT_MAX_WAIT=0.2):
+            started = time.monotonic()
+            self.assertEqual(await self.status("?wait=600"), "unpaid")
+            self.assertLess(time.monotonic() - started, 2)
+
+    async def test_a_status_change_ends_the_wait(self):
+        async def webhook():
+            await asyncio.sleep(0.2)
+            await Order.objects.filter(id=self.order.id).aupdate(status="paid")
+
+        started = time.monotonic()
+        status, _ = await asyncio.gather(self.status("?wait=10"), webhook())
+
+        self.assertEqual(status, "paid")
+        self.assertLess(time.monotonic() - started, 5)
+        self.retrieve.assert_awaited_once()
+
+    async def test_other_customers_sessions_are_not_found(self):
+        _, headers = await sync_to_async(create_customer)("other@example.com")
+
+        response = await self.async_client.get("/api/shop/payment-status/cs_test_1", headers=headers)
+
+        self.assertEqual(response.status_code, 404)
+        self.retrieve.assert_not_awaited()
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name, description in [
+            ("Bosch GSB drill", "Impact drill"),
+            ("Makita drill", "Fits Bosch bits"),
+            ("Bosch saw", "Cuts what a drill cannot"),
+            ("Bosch sander", "Orbital"),
+        ]:
+            Product.objects.create(name=name, description=description, price=1000)
+
+    def setUp(self):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+
+    def names(self, query):
+        response = self.client.get(f"/api/shop/products?{query}")
+        self.assertEqual(response.status_code, 200)
+        return sorted(product["name"] for product in response.json()["data"])
+
+    def test_q_and_name_both_filter(self):
+        self.assertEqual(self.names("q=drill"), ["Bosch GSB drill", "Bosch saw", "Makita drill"])
+        self.assertEqual(self.names("name=bosch"), ["Bosch GSB drill", "Bosch sander", "Bosch saw"])
+        self.assertEqual(self.names("q=drill&name=bosch"), ["Bosch GSB drill", "Bosch saw"])
+        self.assertEqual(self.names("name=bosch&q=drill&sort_by=relevance"), ["Bosch GSB drill", "Bosch saw"])
+
+    def test_pages_of_equally_ranked_products(self):
+        for number in range(5):
+            Product.objects.create(name=f"Drill {number}", description="Cordless drill, two batteries", price=1000)
+
+        names, cursor = [], ""
+        for _ in range(10):
+            response = self.client.get(f"/api/shop/products?q=cordless&page_size=2&cursor={cursor}")
+            self.assertEqual(response.status_code, 200)
+            names += [product["name"] for product in response.json()["data"]]
+            cursor = response.json()["next"]
+            if not cursor:
+                break
+
+        # Ties on rank are broken by descending id; a cursor rank that no longer equals its row's would skip them.
+        self.assertEqual(names, [f"Drill {number}" for number in reversed(range(5))])
+
+
+WORKER_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "worker-1": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "worker-1"},
+    "worker-2": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "worker-2"},
+}
+
+
+@override_settings(CACHES=WORKER_CACHES)
+class CatalogVersionTests(TestCase):
+    """Per-process catalog caches of two workers, sharing the version through the database."""
+
+    def setUp(self):
+        database_version.clear()
+        self.product = Product.objects.create(name="Bosch drill", price=1000)
+
+    def get_products(self, worker, **headers):
+        with self.settings(SHOP_CATALOG_CACHE=worker):
+            return self.client.get("/api/shop/products", headers=headers)
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [product["name"] for product in response.json()["data"]]
+
+    def test_a_write_reaches_the_entries_of_every_worker(self):
+        self.assertIsNone(settings.SHOP_CATALOG_VERSION_CACHE)
+        etags = {worker: self.get_products(worker)["ETag"] for worker in ("worker-1", "worker-2")}
+
+        with self.settings(SHOP_CATALOG_CACHE="worker-1"), self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Makita drill"
+            self.product.save()
+
+        for worker, etag in etags.items():
+            response = self.get_products(worker)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(self.names(response), ["Makita drill"])
+
+    def test_writes_of_other_processes_show_within_the_ttl(self):
+        self.get_products("worker-1")
+        # Another process's write: the row changes, this process's copy of it does not.
+        Product.objects.filter(id=self.product.id).update(name="Makita drill")
+        CatalogVersion.objects.update(version=F("version") + 1)
+
+        self.assertEqual(self.names(self.get_products("worker-1")), ["Bosch drill"])
+        later = time.monotonic() + settings.SHOP_CATALOG_VERSION_TTL
+        with mock.patch("apps.shop.cache.time.monotonic", return_value=later):
+            self.assertEqual(self.names(self.get_products("worker-1")), ["Makita drill"])
+
+    def test_hits_and_not_modified_answers_run_no_queries(self):
+        etag = self.get_products("worker-1")["ETag"]
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_products("worker-1").status_code, 200)
+            self.assertEqual(self.get_products("worker-1", If_None_Match=etag).status_code, 304)
+
+    def test_the_version_survives_a_cleared_cache(self):
+        etag = self.get_products("worker-1")["ETag"]
+        caches["worker-1"].clear()
+
+        self.assertEqual(self.get_products("worker-1")["ETag"], etag)
+
+    @override_settings(SHOP_CATALOG_VERSION_CACHE="worker-2")
+    def test_a_shared_version_cache_replaces_the_row(self):
+        etag = self.get_products("worker-1")["ETag"]
+        database_version.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_products("worker-1", If_None_Match=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertNotEqual(self.get_products("worker-1")["ETag"], etag)
+        self.assertFalse(CatalogVersion.objects.filter(bumped_at__isnull=False).exists())
+
+
+class ProductPaginationTests(TestCase):
+    SORTS = ["", "name", "-name", "price", "-price", "rating", "-rating", "relevance", "-relevance"]
+
+    @classmethod
+    def setUpTestData(cls):
+        # Few distinct prices and ratings, so most pages end inside a run of ties.
+        for number in range(9):
+            product = Product.objects.create(
+                name=f"Drill {number % 4}", description="Cordless drill", price=1000 * (number % 3)
+            )
+            Product.objects.filter(id=product.id).update(rating_avg=number % 2 + 4)
+
+    def setUp(self):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+
+    def get(self, query):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+        response = self.client.get(f"/api/shop/products?{query}")
+        self.assertEqual(response.status_code, 200, query)
+        return response.json()
+
+    def walk(self, query, page_size):
+        """Ids page by page following ``next``, then the same pages following ``previous`` back."""
+        forward, body = [], self.get(f"{query}&page_size={page_size}")
+        forward.append([product["id"] for product in body["data"]])
+        while body["next"]:
+            body = self.get(f"{query}&page_size={page_size}&cursor={body['next']}")
+            forward.append([product["id"] for product in body["data"]])
+        backward = [forward[-1]]
+        while body["previous"]:
+            body = self.get(f"{query}&page_size={page_size}&cursor={body['previous']}")
+            backward.append([product["id"] for product in body["data"]])
+        return forward, backward[::-1]
+
+    def test_every_sort_pages_through_ties_without_gaps_or_repeats(self):
+        for sort in self.SORTS:
+            query = f"q=cordless&sort_by={sort}" if "relevance" in sort else f"sort_by={sort}"
+            everything = [product["id"] for product in self.get(f"{query}&page_size=100")["data"]]
+            self.assertEqual(len(everything), 9, sort)
+            for page_size in (1, 2, 4):
+                forward, backward = self.walk(query, page_size)
+                self.assertEqual(sum(forward, []), everything, (sort, page_size))
+                self.assertEqual(backward, forward, (sort, page_size))
+
+    def test_malformed_and_foreign_cursors(self):
+        cursor = self.get("sort_by=price&page_size=2")["next"]
+
+        for query in ("cursor=nonsense", f"sort_by=name&cursor={cursor}", "cursor=e30"):
+            response = self.client.get(f"/api/shop/products?{query}")
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json()["error"]["code"], 400)
+
+    def test_queries_per_page_do_not_depend_on_depth_or_size(self):
+        counts = set()
+        for page_size in (1, 4):
+            body = self.get(f"sort_by=price&page_size={page_size}")
+            for cursor in ("", body["next"]):
+                caches[settings.SHOP_CATALOG_CACHE].clear()
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(f"/api/shop/products?sort_by=price&page_size={page_size}&cursor={cursor}")
+                counts.add(len(queries))
+
+        # The page itself, with category and manufacturer joined in.
+        self.assertEqual(counts, {1})
+
+
+@override_settings(SHOP_PRICE_FACET_BOUNDS=[1000, 5000])
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.drills, cls.saws = Category.objects.create(name="Drills"), Category.objects.create(name="Saws")
+        cls.bosch, cls.makita = Manufacturer.objects.create(name="Bosch"), Manufacturer.objects.create(name="Makita")
+        for category, manufacturer, price in [
+            (cls.drills, cls.bosch, 500),
+            (cls.drills, cls.bosch, 3000),
+            (cls.drills, cls.makita, 3000),
+            (cls.saws, cls.bosch, 8000),
+            (cls.saws, cls.makita, 700),
+        ]:
+            Product.objects.create(name="Tool", price=price, category=category, manufacturer=manufacturer)
+
+    def facets(self, query):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+        response = self.client.get(f"/api/shop/products?facets=category,manufacturer,price&{query}")
+        self.assertEqual(response.status_code, 200)
+        facets = response.json()["facets"]
+        return (
+            {row["name"]: row["count"] for row in facets["category"]},
+            {row["name"]: row["count"] for row in facets["manufacturer"]},
+            [row["count"] for row in facets["price"]],
+        )
+
+    def test_each_facet_ignores_only_its_own_filter(self):
+        self.assertEqual(self.facets(""), ({"Drills": 3, "Saws": 2}, {"Bosch": 3, "Makita": 2}, [2, 2, 1]))
+
+        categories, manufacturers, prices = self.facets(
+            f"category={self.drills.id}&manufacturer={self.bosch.id}&price_min=1000"
+        )
+
+        # Bosch from 1000: a drill and a saw.
+        self.assertEqual(categories, {"Drills": 1, "Saws": 1})
+        # Drills from 1000, by anyone.
+        self.assertEqual(manufacturers, {"Bosch": 1, "Makita": 1})
+        # Bosch drills at any price.
+        self.assertEqual(prices, [1, 1, 0])
+
+    def test_unknown_facets(self):
+        response = self.client.get("/api/shop/products?facets=category,colour")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"]["message"], "Unknown facet: colour")
+
+    def test_one_query_per_facet_whatever_the_number_of_buckets(self):
+        query = "/api/shop/products?facets=category,manufacturer,price"
+        counts = []
+        for extra in (0, 10):
+            for number in range(extra):
+                category = Category.objects.create(name=f"Category {number}")
+                manufacturer = Manufacturer.objects.create(name=f"Manufacturer {number}")
+                Product.objects.create(name="Tool", price=100, category=category, manufacturer=manufacturer)
+            with self.settings(SHOP_PRICE_FACET_BOUNDS=list(range(100, 100 * (extra + 3), 100))):
+                caches[settings.SHOP_CATALOG_CACHE].clear()
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.client.get(query).status_code, 200)
+            counts.append(len(queries))
+
+        # The page, then one aggregate per facet.
+        self.assertEqual(counts, [4, 4])
+
+
+class ParallelCheckoutTests(TransactionTestCase):
+    """Checkouts of one cart from several threads at once, each with its own connection."""
+
+    def setUp(self):
+        self.user, self.headers = create_customer()
+        cart = Cart.objects.create(user=self.user)
+        for index, price in enumerate([1000, 2500, 400]):
+            product = Product.objects.create(name=f"Product {index}", description="", price=price)
+            CartItem.objects.create(cart=cart, product=product, quantity=index + 1, price_at_add=price)
+
+    def checkout_in_parallel(self, idempotency_keys):
+        responses = [None] * len(idempotency_keys)
+        start = threading.Barrier(len(idempotency_keys))
+
+        def checkout(index, key):
+            headers = {**self.headers, "Idempotency-Key": key} if key else self.headers
+            start.wait()
+            try:
+                responses[index] = Client().post("/api/shop/order", headers=headers)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=item) for item in enumerate(idempotency_keys)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def assertOneOrder(self):
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.order_price, 1000 * 1 + 2500 * 2 + 400 * 3)
+        self.assertEqual(
+            sorted(OrderLine.objects.values_list("order_id", "unit_price", "quantity")),
+            [(order.id, 400, 3), (order.id, 1000, 1), (order.id, 2500, 2)],
+        )
+        self.assertEqual(order.products.count(), 3)
+        self.assertEqual(CheckoutOutbox.objects.filter(order=order).count(), 1)
+        self.assertFalse(Cart.objects.exists())
+        return order
+
+    def test_same_idempotency_key(self):
+        responses = self.checkout_in_parallel(["checkout-1"] * 4)
+
+        order = self.assertOneOrder()
+        self.assertEqual([response.status_code for response in responses], [202] * 4)
+        self.assertEqual({response.json()["data"]["order_id"] for response in responses}, {order.id})
+
+    def test_different_idempotency_keys(self):
+        responses = self.checkout_in_parallel(["checkout-1", "checkout-2", "checkout-3", None])
+
+        order = self.assertOneOrder()
+        self.assertEqual(sorted(response.status_code for response in responses), [202, 400, 400, 400])
+        accepted = next(response for response in responses if response.status_code == 202)
+        self.assertEqual(accepted.json()["data"]["order_id"], order.id)
+
+    def test_without_idempotency_keys(self):
+        responses = self.checkout_in_parallel([None] * 4)
+
+        self.assertOneOrder()
+        self.assertEqual(sorted(response.status_code for response in responses), [202, 400, 400, 400])
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], DATABASE_PIN_CACHE="default", DATABASE_REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        caches["default"].clear()
+        self.user, self.headers = create_customer()
+        self.product = Product.objects.create(name="Drill", description="", price=1000)
+        Product.objects.using("replica").create(id=self.product.id, name="Drill", description="", price=1000)
+        # A change the replica has not caught up with.
+        Product.objects.filter(id=self.product.id).update(name="Drill v2")
+        # Long enough ago that catalog misses are no longer built from the primary.
+        CatalogVersion.objects.update(bumped_at=None)
+        database_version.clear()
+
+    def tearDown(self):
+        # The detail views recorded; written now, while the tables still exist.
+        recent_views.flush()
+
+    def product_name(self, headers):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+        response = self.client.get(f"/api/shop/product/{self.product.id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["data"]["name"]
+
+    def add_to_cart(self):
+        response = self.client.post(f"/api/shop/cart/{self.product.id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_catalog_reads_go_to_the_replica(self):
+        self.assertEqual(self.product_name(self.headers), "Drill")
+        self.assertEqual(self.product_name({}), "Drill")
+
+    def test_client_that_wrote_reads_from_the_primary(self):
+        _, other_headers = create_customer("other@example.com")
+
+        self.add_to_cart()
+
+        self.assertEqual(self.product_name(self.headers), "Drill v2")
+        self.assertEqual(self.product_name(self.headers), "Drill v2")
+        self.assertEqual(self.product_name(other_headers), "Drill")
+        self.assertEqual(self.product_name({}), "Drill")
+
+    @override_settings(DATABASE_REPLICA_PIN_SECONDS=0.2)
+    def test_pin_expires(self):
+        self.add_to_cart()
+        self.assertEqual(self.product_name(self.headers), "Drill v2")
+
+        time.sleep(0.3)
+
+        self.assertEqual(self.product_name(self.headers), "Drill")
+
+    @override_settings(DATABASE_PIN_CACHE=None)
+    def test_replicas_need_a_pin_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaMiddleware(lambda request: None)
+
+
+class CartTestMixin:
+    def setUp(self):
+        self.user, self.headers = create_customer()
+        self.drill = Product.objects.create(name="Drill", description="", price=1000)
+        self.saw = Product.objects.create(name="Saw", description="", price=2500)
+
+    def post_operations(self, operations):
+        return self.client.post(
+            "/api/shop/cart/items",
+            {"operations": operations},
+            content_type="application/json",
+            headers=self.headers,
+        )
+
+    def update_cart(self, *operations):
+        response = self.post_operations(list(operations))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def saved_lines(self):
+        lines = CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity", "price_at_add")
+        return sorted(lines)
+
+
+class DatabaseCartStoreTests(CartTestMixin, TestCase):
+    def test_totals_come_with_the_lines(self):
+        self.update_cart({"op": "increment", "product": self.drill.id, "quantity": 2})
+
+        with self.assertNumQueries(1):
+            cart = self.client.get("/api/shop/cart", headers=self.headers).json()
+
+        self.assertEqual((cart["subtotal"], cart["count"]), (2000, 2))
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 2, 1000)])
+
+    def test_operations_apply_in_order(self):
+        hammer = Product.objects.create(name="Hammer", description="", price=500)
+        self.update_cart(
+            {"op": "set", "product": self.drill.id, "quantity": 5},
+            {"op": "increment", "product": self.saw.id, "quantity": 2},
+            {"op": "increment", "product": hammer.id, "quantity": 1},
+        )
+        Product.objects.filter(id=self.drill.id).update(price=1200)
+
+        cart = self.update_cart(
+            {"op": "increment", "product": self.drill.id, "quantity": 1},
+            {"op": "set", "product": self.drill.id, "quantity": 2},
+            {"op": "increment", "product": self.saw.id, "quantity": -3},
+            {"op": "remove", "product": hammer.id},
+            {"op": "remove", "product": hammer.id},
+            {"op": "set", "product": hammer.id, "quantity": 0},
+        )
+
+        # The drill keeps the price it was added at; the saw went below zero and the hammer was removed.
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 2, 1000)])
+        self.assertEqual((cart["subtotal"], cart["count"]), (2000, 2))
+
+        self.update_cart(
+            {"op": "remove", "product": self.drill.id},
+            {"op": "set", "product": self.saw.id, "quantity": 1},
+        )
+        self.assertEqual(self.saved_lines(), [(self.saw.id, 1, 2500)])
+
+    def test_invalid_operations_change_nothing(self):
+        self.update_cart({"op": "set", "product": self.drill.id, "quantity": 2})
+        missing = Product.objects.order_by("-id").values_list("id", flat=True)[0] + 1
+        invalid = (
+            [{"op": "set", "product": self.saw.id, "quantity": 1}, {"op": "set", "product": missing, "quantity": 1}],
+            [{"op": "set", "product": self.drill.id, "quantity": -1}],
+            [{"op": "increment", "product": self.drill.id}],
+            [{"op": "increment", "product": self.drill.id, "quantity": 1000}],
+            [{"op": "double", "product": self.drill.id, "quantity": 1}],
+            [{"op": "remove", "product": 0}],
+            [],
+        )
+
+        for operations in invalid:
+            response = self.post_operations(operations)
+            self.assertEqual(response.status_code, 400, operations)
+            self.assertEqual(self.saved_lines(), [(self.drill.id, 2, 1000)])
+
+        response = self.post_operations(invalid[0])
+        self.assertEqual(response.json()["error"], {"code": 400, "message": f"Unknown products: {missing}"})
+
+    def test_queries_do_not_depend_on_the_number_of_operations(self):
+        products = [Product.objects.create(name=f"Nail {number}", description="", price=10) for number in range(20)]
+        apply_cart_operations(self.user, [{"op": "set", "product": self.drill.id, "quantity": 1}])
+        counts = []
+        for batch in (products[:1], products):
+            operations = [{"op": "increment", "product": product.id, "quantity": 2} for product in batch]
+            operations += [
+                {"op": "remove", "product": self.drill.id},
+                {"op": "set", "product": self.drill.id, "quantity": 0},
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                apply_cart_operations(self.user, operations)
+            counts.append(len(queries))
+
+        # The locked cart, the products, the current lines, one upsert and one delete, inside a savepoint.
+        self.assertEqual(counts, [7, 7])
+        self.assertEqual(len(self.saved_lines()), 20)
+
+
+CART_CACHE = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "carts"}
+
+
+@override_settings(CACHES={**settings.CACHES, "carts": CART_CACHE}, SHOP_CART_CACHE="carts")
+class CacheCartStoreTests(CartTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches["carts"].clear()
+        # No flusher thread: the tests flush themselves.
+        patcher = mock.patch.object(CacheCartStore, "_start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_changes_are_written_behind(self):
+        cart = self.update_cart(
+            {"op": "increment", "product": self.drill.id, "quantity": 2},
+            {"op": "set", "product": self.saw.id, "quantity": 1},
+        )
+
+        self.assertEqual((cart["subtotal"], cart["count"]), (4500, 3))
+        self.assertEqual(self.saved_lines(), [])
+        self.assertEqual(cache_cart_store.flush(), 1)
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 2, 1000), (self.saw.id, 1, 2500)])
+        self.assertEqual(cache_cart_store.flush(), 0)
+
+    def test_changes_outlive_the_worker_that_made_them(self):
+        self.update_cart({"op": "increment", "product": self.drill.id, "quantity": 2})
+
+        # The worker that took the change is gone with its memory; another one finds it in the cache.
+        self.assertEqual(CacheCartStore().flush(), 1)
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 2, 1000)])
+
+    def test_checkout_writes_the_cached_cart_first(self):
+        self.update_cart({"op": "set", "product": self.saw.id, "quantity": 3})
+
+        response = self.client.post("/api/shop/order", headers=self.headers)
+
+        self.assertEqual(response.status_code, 202)
+        order = Order.objects.get(id=response.json()["data"]["order_id"])
+        self.assertEqual(order.order_price, 7500)
+        self.assertEqual(list(order.lines.values_list("product_id", "quantity")), [(self.saw.id, 3)])
+        self.assertIsNone(caches["carts"].get(f"shop:cart:{self.user.id}"))
+        # The change's journal entry finds the cart gone and writes nothing back.
+        self.assertEqual(cache_cart_store.flush(), 0)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_cart_is_reloaded_after_a_cache_miss(self):
+        self.update_cart({"op": "increment", "product": self.drill.id, "quantity": 2})
+        cache_cart_store.flush()
+        caches["carts"].clear()
+
+        cart = self.client.get("/api/shop/cart", headers=self.headers).json()
+        self.assertEqual([(line["id"], line["quantity"]) for line in cart["data"]], [(self.drill.id, 2)])
+
+        caches["carts"].clear()
+        self.update_cart({"op": "increment", "product": self.drill.id, "quantity": 1})
+        cache_cart_store.flush()
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 3, 1000)])
+
+    def test_an_entry_its_writer_never_wrote_is_given_up(self):
+        cache = caches["carts"]
+        # A worker that died between numbering its entry and writing it.
+        cache.add(cart_store.JOURNAL_KEY, 0, timeout=None)
+        cache.incr(cart_store.JOURNAL_KEY)
+        self.update_cart({"op": "increment", "product": self.drill.id, "quantity": 1})
+
+        self.assertEqual(cache_cart_store.flush(), 0)
+        later = time.time() + cart_store.LOCK_TIMEOUT + 1
+        with mock.patch.object(cart_store.time, "time", return_value=later):
+            self.assertEqual(cache_cart_store.flush(), 1)
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 1, 1000)])
+
+    def test_locked_carts_are_left_for_the_next_flush(self):
+        self.update_cart({"op": "increment", "product": self.drill.id, "quantity": 1})
+        cache = caches["carts"]
+        lease = cart_store._acquire(cache, cart_store._lock_key(self.user.id), cart_store.LOCK_TIMEOUT)
+
+        self.assertEqual(cache_cart_store.flush(), 0)
+        self.assertEqual(self.saved_lines(), [])
+
+        cart_store._release(cache, cart_store._lock_key(self.user.id), lease)
+        self.assertEqual(cache_cart_store.flush(), 1)
+        self.assertEqual(self.saved_lines(), [(self.drill.id, 1, 1000)])
+
+    @mock.patch.object(cart_store, "LOCK_WAIT", 0.1)
+    def test_a_cart_locked_too_long_is_busy(self):
+        cart_store._acquire(caches["carts"], cart_store._lock_key(self.user.id), cart_store.LOCK_TIMEOUT)
+
+        response = self.client.post(
+            "/api/shop/cart/items",
+            {"operations": [{"op": "increment", "product": self.drill.id, "quantity": 1}]},
+            content_type="application/json",
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 409)
+
+    @mock.patch.object(cart_store, "LOCK_TIMEOUT", 0.3)
+    def test_checkout_keeps_the_lock_for_its_whole_transaction(self):
+        self.update_cart({"op": "set", "product": self.saw.id, "quantity": 3})
+        cache, key = caches["carts"], cart_store._lock_key(self.user.id)
+
+        with cache_cart_store.checkout(self.user):
+            time.sleep(1)
+            self.assertIsNone(cart_store._acquire(cache, key, 1))
+            order, _ = create_order_from_cart(self.user, None)
+
+        self.assertEqual(list(order.lines.values_list("product_id", "quantity")), [(self.saw.id, 3)])
+        self.assertIsNone(cache.get(key))
+
+    @mock.patch.object(cart_store, "LOCK_TIMEOUT", 0.3)
+    def test_checkout_that_lost_its_lock_is_rolled_back(self):
+        self.update_cart({"op": "set", "product": self.saw.id, "quantity": 3})
+        cache = caches["carts"]
+
+        with self.assertRaises(CartBusy):
+            with cache_cart_store.checkout(self.user):
+                create_order_from_cart(self.user, None)
+                # Stalled past its lease, which another request then took.
+                cache.set(cart_store._lock_key(self.user.id), "other", 60)
+                time.sleep(0.3)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.saved_lines(), [])
+        self.assertEqual(cache.get(f"shop:cart:{self.user.id}"), [(self.saw.id, 3, 2500)])
+
+    def test_an_expired_lock_is_not_released_by_its_old_holder(self):
+        cache, key = caches["carts"], cart_store._lock_key(self.user.id)
+        lease = cart_store._acquire(cache, key, 0.05)
+        time.sleep(0.1)
+        self.assertIsNotNone(cart_store._acquire(cache, key, cart_store.LOCK_TIMEOUT))
+
+        cart_store._release(cache, key, lease)
+
+        self.assertIsNone(cart_store._acquire(cache, key, cart_store.LOCK_TIMEOUT))
+
+
+def png(color, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@override_settings(SHOP_PHOTO_VARIANT_SIZES={"thumb": 16, "card": 32})
+class PhotoVariantTests(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = FileSystemStorage(location=location, base_url="/media/")
+        patcher = mock.patch.object(Product._meta.get_field("photo"), "storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Rendered in this process, where the mock below can see it.
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.pool.shutdown)
+        self.render = mock.patch.object(photos, "render_variants", wraps=render_variants).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def create_product(self, name, data):
+        product = Product.objects.create(name=name, price=1000)
+        with mock.patch("apps.shop.signals.schedule_photo_variants") as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.photo.save(f"{name}.png", ContentFile(data))
+        schedule.assert_called_once_with(product.id)
+        return product
+
+    def test_variants_are_stored_and_recorded(self):
+        product = self.create_product("drill", png("red"))
+
+        self.assertTrue(generate_photo_variants(product, self.pool))
+
+        product.refresh_from_db()
+        self.assertFalse(needs_variants(product))
+        variants = product.photo_variants["variants"]
+        self.assertEqual(set(variants), {"thumb", "card"})
+        for formats in variants.values():
+            self.assertEqual(set(formats), {"webp", "jpeg"})
+            for path in formats.values():
+                self.assertTrue(self.storage.exists(path))
+        with self.storage.open(variants["card"]["jpeg"]) as f:
+            self.assertEqual(Image.open(f).size, (32, 24))
+        self.assertEqual(photo_variant_urls(product)["thumb"]["webp"], self.storage.url(variants["thumb"]["webp"]))
+        self.assertFalse(generate_photo_variants(product, self.pool))
+
+    def test_identical_photos_share_their_variants(self):
+        first = self.create_product("drill", png("red"))
+        second = self.create_product("saw", png("red"))
+        self.assertNotEqual(first.photo.name, second.photo.name)
+
+        self.assertTrue(generate_photo_variants(first, self.pool))
+        self.assertTrue(generate_photo_variants(second, self.pool))
+
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual(second.photo_variants["variants"], first.photo_variants["variants"])
+        self.assertEqual(second.photo_variants["source"], second.photo.name)
+        self.assertEqual(Product.objects.get(id=second.id).photo_hash, first.photo_variants["hash"])
+
+    @skipUnless(connection.vendor == "sqlite", "reads SQLite's EXPLAIN")
+    def test_earlier_uploads_are_found_by_index(self):
+        lines, problems = explain(photos.variants_with_hash("0" * 64))
+
+        self.assertEqual(problems, [])
+        self.assertTrue(any("shop_product_photo_hash_idx" in line for line in lines), lines)
+
+    def test_a_photo_replaced_while_rendering_keeps_its_own_run(self):
+        product = self.create_product("drill", png("red"))
+
+        render = photos._render
+
+        def replace_then_render(data, pool):
+            Product.objects.filter(id=product.id).update(photo=self.storage.save("drill.png", ContentFile(png("blue"))))
+            return render(data, pool)
+
+        with mock.patch.object(photos, "_render", side_effect=replace_then_render):
+            self.assertFalse(generate_photo_variants(product, self.pool))
+
+        product.refresh_from_db()
+        self.assertEqual(product.photo_variants, {})
+        self.assertTrue(needs_variants(product))
+        self.assertTrue(generate_photo_variants(product, self.pool))
+        self.assertEqual(product.photo_variants["source"], product.photo.name)
+
+
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.user, _ = create_customer()
+        self.order = Order.objects.create(user=self.user, order_price=1000)
+
+    def deliver(self, event_id, event_type, created, **obj):
+        payload = json.dumps({"id": event_id, "type": event_type, "created": created, "data": {"object": obj}})
+        return self.client.post(
+            "/api/shop/stripe/webhook",
+            payload,
+            content_type="application/json",
+            headers={"Stripe-Signature": sign_payload(payload, settings.STRIPE_WEBHOOK_SECRET)},
+        )
+
+    def complete(self, event_id="evt_completed", created=100):
+        return self.deliver(
+            event_id,
+            "checkout.session.completed",
+            created,
+            payment_status="paid",
+            payment_intent="pi_1",
+            metadata={"order_id": str(self.order.id)},
+        )
+
+    def refund(self, event_id="evt_refunded", created=200, refunded=True):
+        return self.deliver(event_id, "charge.refunded", created, payment_intent="pi_1", refunded=refunded)
+
+    def status(self):
+        self.order.refresh_from_db()
+        return self.order.status
+
+    def test_redeliveries_are_stored_once(self):
+        self.assertEqual(self.complete().status_code, 200)
+        self.assertEqual(self.complete().status_code, 200)
+
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(process_stripe_events(), 1)
+        self.assertEqual(self.status(), "paid")
+        self.assertEqual(self.order.payment_intent_id, "pi_1")
+
+        self.complete()
+        self.assertEqual(process_stripe_events(), 0)
+
+    def test_unsigned_events_are_rejected(self):
+        response = self.client.post(
+            "/api/shop/stripe/webhook", "{}", content_type="application/json", headers={"Stripe-Signature": "t=1,v1=0"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_events_apply_in_the_order_stripe_created_them(self):
+        # The refund arrives first, but was created after the payment.
+        self.refund()
+        self.complete()
+
+        self.assertEqual(process_stripe_events(), 2)
+        self.assertEqual(self.status(), "refunded")
+
+    def test_a_refund_processed_before_its_payment_is_retried(self):
+        self.refund()
+        self.assertEqual(process_stripe_events(), 1)
+
+        refund = StripeEvent.objects.get(event_id="evt_refunded")
+        self.assertIsNone(refund.processed_at)
+        self.assertEqual(refund.attempts, 1)
+        self.assertEqual(self.status(), "unpaid")
+
+        self.complete()
+        # The refund waits out its delay.
+        self.assertEqual(process_stripe_events(), 1)
+        self.assertEqual(self.status(), "paid")
+
+        StripeEvent.objects.filter(id=refund.id).update(available_at=timezone.now())
+        self.assertEqual(process_stripe_events(), 1)
+        self.assertEqual(self.status(), "refunded")
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_refunds_without_a_payment_are_given_up(self):
+        self.refund()
+
+        self.assertEqual(process_stripe_events(max_attempts=1), 1)
+
+        self.assertIsNotNone(StripeEvent.objects.get().processed_at)
+        self.assertEqual(self.status(), "unpaid")
+
+    def test_a_late_expiry_does_not_undo_a_payment(self):
+        self.complete()
+        process_stripe_events()
+
+        self.deliver("evt_expired", "checkout.session.expired", 50, metadata={"order_id": str(self.order.id)})
+        process_stripe_events()
+
+        self.assertEqual(self.status(), "paid")
+
+    def test_partial_refunds_keep_the_order_paid(self):
+        self.complete()
+        self.refund("evt_partial", refunded=False)
+        process_stripe_events()
+        self.assertEqual(self.status(), "paid")
+
+        self.refund("evt_full", created=300)
+        process_stripe_events()
+        self.assertEqual(self.status(), "refunded")
+
+
+class ImportCatalogTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, filename, content):
+        path = f"{self.directory}/{filename}"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def import_catalog(self, path, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("import_catalog", path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_rows_upsert_on_sku(self):
+        existing = Product.objects.create(sku="D-1", name="Old drill", price=500, photo="product_photos/drill.jpg")
+        path = self.write(
+            "catalog.csv",
+            "sku,name,description,price,category,manufacturer\n"
+            "D-1,Drill,Impact drill,1500,Drills,Bosch\n"
+            "S-1,Saw,,2000,Saws,Bosch\n"
+            "S-1,Circular saw,,2500,Saws,Makita\n",
+        )
+
+        stdout, _ = self.import_catalog(path, "--chunk-size", "2")
+
+        self.assertIn("3 products imported, 0 rows rejected", stdout)
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price, existing.category.name), ("Drill", 1500, "Drills"))
+        self.assertEqual(existing.photo.name, "product_photos/drill.jpg")
+        # The later row for a SKU wins, within a chunk and across chunks alike.
+        saw = Product.objects.get(sku="S-1")
+        self.assertEqual((saw.name, saw.price, saw.manufacturer.name), ("Circular saw", 2500, "Makita"))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Category.objects.filter(name="Saws").count(), 1)
+
+    def test_invalid_rows_are_rejected(self):
+        path = self.write(
+            "catalog.jsonl",
+            '{"sku": "D-1", "name": "Drill", "price": 1500}\n'
+            '{"sku": "D-2", "name": "Drill", "price": "cheap"}\n'
+            '{"sku": "D-3", "name": "Drill", "price": 10.5}\n'
+            '{"name": "Drill", "price": 100}\n'
+            "not json\n"
+            "\n"
+            '["D-4"]\n',
+        )
+        rejects = f"{self.directory}/rejects.jsonl"
+
+        stdout, stderr = self.import_catalog(path, "--rejects", rejects)
+
+        self.assertIn("1 products imported, 5 rows rejected", stdout)
+        self.assertEqual(list(Product.objects.values_list("sku", flat=True)), ["D-1"])
+        with open(rejects, encoding="utf-8") as f:
+            rejected = [json.loads(line) for line in f]
+        self.assertEqual([reject["line"] for reject in rejected], [2, 3, 4, 5, 7])
+        self.assertEqual(rejected[0]["row"], {"sku": "D-2", "name": "Drill", "price": "cheap"})
+        self.assertEqual(rejected[2]["error"], "sku is required")
+        self.assertIn("Line 5: invalid JSON", stderr)
+
+
+class ExportSinceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff, cls.headers = create_customer("staff@example.com", is_staff=True)
+        for day in (1, 2, 3):
+            product = Product.objects.create(sku=f"D-{day}", name=f"Drill {day}", price=1000)
+            order = Order.objects.create(user=cls.staff, order_price=1000 * day)
+            OrderLine.objects.create(
+                order=order, product=product, product_name=product.name, unit_price=1000, quantity=day
+            )
+            # update() leaves auto_now alone.
+            updated_at = datetime.datetime(2024, 5, day, 12, tzinfo=datetime.timezone.utc)
+            Product.objects.filter(id=product.id).update(updated_at=updated_at)
+            Order.objects.filter(id=order.id).update(updated_at=updated_at)
+
+    def export(self, path):
+        response = self.client.get(f"/api/shop/export/{path}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def product_skus(self, since):
+        lines = self.export(f"products.ndjson?since={since}").splitlines()
+        return [json.loads(line)["sku"] for line in lines]
+
+    def test_since_keeps_rows_changed_at_or_after_it(self):
+        self.assertEqual(self.product_skus(""), ["D-1", "D-2", "D-3"])
+        # Exactly the last updated_at received: that row repeats.
+        self.assertEqual(self.product_skus("2024-05-02T12:00:00%2B00:00"), ["D-2", "D-3"])
+        self.assertEqual(self.product_skus("2024-05-02T12:00:01Z"), ["D-3"])
+        # A date is its midnight, a naive datetime is in TIME_ZONE.
+        self.assertEqual(self.product_skus("2024-05-02"), ["D-2", "D-3"])
+        self.assertEqual(self.product_skus("2024-05-03T13:00"), [])
+
+    def test_orders_since(self):
+        rows = self.export("orders.csv?since=2024-05-02").splitlines()
+
+        self.assertEqual(rows[0].split(",")[:4], ["id", "user", "order_price", "status"])
+        self.assertEqual([row.split(",")[2] for row in rows[1:]], ["2000", "3000"])
+
+    def test_invalid_since(self):
+        response = self.client.get("/api/shop/export/products.csv?since=yesterday", headers=self.headers)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"]["message"], "since must be an ISO 8601 date or datetime")
+
+
+@override_settings(METRICS_TOKEN="scrape")
+class MetricsTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, "registry", metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self):
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer scrape"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        return response.content.decode().splitlines()
+
+    def test_scrapes_need_the_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 404)
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_requests_are_counted_per_route(self):
+        Product.objects.create(name="Drill", price=1000)
+        for _ in range(2):
+            caches[settings.SHOP_CATALOG_CACHE].clear()
+            self.assertEqual(self.client.get("/api/shop/products").status_code, 200)
+        self.scrape()
+
+        lines = self.scrape()
+
+        route = 'route="api/shop/products"'
+        self.assertIn("# TYPE http_requests_total counter", lines)
+        self.assertIn(f'http_requests_total{{{route},method="GET",status="200"}} 2', lines)
+        self.assertIn(f'http_request_duration_seconds_count{{{route},method="GET"}} 2', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{route},method="GET",le="+Inf"}} 2', lines)
+        self.assertIn(f"http_response_size_bytes_count{{{route}}} 2", lines)
+        self.assertTrue(any(line.startswith(f"db_queries_total{{{route}}} ") for line in lines))
+        # Scrapes are not requests to report.
+        self.assertFalse(any('route="metrics"' in line for line in lines))
+
+    def test_snapshots_of_other_processes_are_summed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        labels = [["route", "api/shop/products"], ["method", "GET"], ["status", "200"]]
+        for pid, age in ((1, 0), (2, 3600)):
+            path = f"{directory}/metrics-{pid}.json"
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "counters": [["http_requests_total", labels, 3]],
+                        "gauges": [["auth_token_cache_entries", [], 5]],
+                        "histograms": [],
+                    },
+                    f,
+                )
+            os.utime(path, (time.time() - age, time.time() - age))
+
+        token_cache.clear()
+        with self.settings(METRICS_DIR=directory, METRICS_FLUSH_INTERVAL=60):
+            lines = self.scrape()
+
+        self.assertIn('http_requests_total{route="api/shop/products",method="GET",status="200"} 6', lines)
+        # Gauges of a process that stopped flushing are left out; this process caches no tokens.
+        self.assertIn("auth_token_cache_entries 5", lines)
+
+
+S3_OPTIONS = {"bucket_name": "shop", "access_key": "key", "secret_key": "secret", "region_name": "eu-west-1"}
+
+
+@override_settings(AWS_URL_CACHE_MARGIN=300)
+class StorageURLTests(TestCase):
+    names = ["photo.png", "products/a b/ü.png", "x+y&z?.jpg", "~draft/#1.png", "./media/../nested//photo.png"]
+
+    def test_public_urls_match_boto3(self):
+        for options in ({"endpoint_url": "http://minio:9000"}, {}):
+            for storage_class, location in ((MinIOMediaStorage, "media"), (StaticStorage, "static")):
+                storage = storage_class(querystring_auth=False, **S3_OPTIONS, **options)
+                plain = S3Boto3Storage(querystring_auth=False, location=location, **S3_OPTIONS, **options)
+                for name in self.names:
+                    self.assertEqual(storage.url(name), plain.url(name), (options, location, name))
+
+    def test_public_urls_are_built_without_boto3(self):
+        storage = MinIOMediaStorage(querystring_auth=False, endpoint_url="http://minio:9000", **S3_OPTIONS)
+        storage.url("photo.png")
+
+        with mock.patch.object(S3Boto3Storage, "url") as boto3_url:
+            self.assertEqual(storage.url("a b.png"), "http://minio:9000/shop/media/a%20b.png")
+        boto3_url.assert_not_called()
+
+    def test_signed_urls_expire_and_are_renewed_before_they_do(self):
+        storage = MinIOMediaStorage(querystring_auth=True, querystring_expire=1800, default_acl="private", **S3_OPTIONS)
+        started = time.time()
+
+        url = storage.url("photo.png")
+
+        self.assertIn("Signature=", url)
+        expires = int(url.split("Expires=")[1].split("&")[0])
+        self.assertAlmostEqual(expires, started + 1800, delta=5)
+        self.assertEqual(storage.url("photo.png"), url)
+
+        # Reused while at least AWS_URL_CACHE_MARGIN is left, then signed again.
+        later = time.monotonic() + 1800 - 300 + 1
+        with (
+            mock.patch("config.storages.time.monotonic", return_value=later),
+            mock.patch("time.time", return_value=started + 1501),
+        ):
+            renewed = storage.url("photo.png")
+        self.assertNotEqual(renewed, url)
+        self.assertIn(f"Expires={int(started) + 1501 + 1800}", renewed)
+
+    def test_explicit_expiry_and_short_lived_urls_are_not_cached(self):
+        storage = MinIOMediaStorage(querystring_auth=True, querystring_expire=60, **S3_OPTIONS)
+
+        with mock.patch.object(S3Boto3Storage, "url", side_effect=["first", "second", "third"]) as boto3_url:
+            self.assertEqual(storage.url("photo.png"), "first")
+            self.assertEqual(storage.url("photo.png"), "second")
+            self.assertEqual(storage.url("photo.png", expire=10), "third")
+        boto3_url.assert_called_with("photo.png", None, 10, None)
+
+
+class QueryPlanTests(TestCase):
+    @skipUnless(connection.vendor == "sqlite", "reads SQLite's EXPLAIN")
+    def test_sqlite_plans(self):
+        self.assertEqual(explain(Product.objects.filter(id=1))[1], [])
+
+        _, problems = explain(Product.objects.order_by("description"))
+
+        self.assertEqual(len(problems), 2)
+        self.assertTrue(problems[0].startswith("full scan: SCAN shop_product"))
+        self.assertTrue(problems[1].startswith("sort: USE TEMP B-TREE FOR ORDER BY"))
+
+    def test_postgres_plans(self):
+        root = {
+            "Node Type": "Sort",
+            "Sort Key": ["shop_product.price"],
+            "Plans": [
+                {
+                    "Node Type": "Hash Join",
+                    "Plans": [
+                        {"Node Type": "Seq Scan", "Relation Name": "shop_product"},
+                        {"Node Type": "Seq Scan", "Relation Name": "shop_category"},
+                        {"Node Type": "Index Scan", "Relation Name": "shop_review", "Index Name": "shop_review_idx"},
+                    ],
+                }
+            ],
+        }
+
+        self.assertEqual(plans._postgres_problems(root), ["sort: shop_product.price", "full scan: shop_product"])
+        self.assertEqual(
+            plans._postgres_lines(root)[4], "    Index Scan on shop_review using shop_review_idx (rows=None)"
+        )
+
+    def test_allowed_sorts_still_fail_on_scans(self):
+        explained = {"sorted": ([], ["sort: name"]), "scanned": ([], ["full scan: shop_product", "sort: name"])}
+
+        with mock.patch.object(plans, "explain", side_effect=explained.get):
+            self.assertEqual(Plan("sorted", lambda dataset: "sorted", allow_sort=True).check(None)[1], [])
+            scanned = Plan("scanned", lambda dataset: "scanned", allow_sort=True).check(None)[1]
+
+        self.assertEqual(scanned, ["full scan: shop_product"])
+
+    def test_failed_plans_are_reported(self):
+        command = CheckQueryPlansCommand(stdout=io.StringIO())
+        explained = {"indexed": (["SEARCH shop_product"], []), "scanned": (["SCAN shop_product"], ["full scan"])}
+        checked = [
+            Plan("indexed", lambda dataset: "indexed"),
+            Plan("scanned", lambda dataset: "scanned"),
+            Plan("elsewhere", lambda dataset: "scanned", vendors=("oracle",)),
+        ]
+
+        with mock.patch.object(plans, "explain", side_effect=explained.get):
+            failed = command.check_plans(checked, None, verbosity=1)
+
+        self.assertEqual(failed, ["scanned"])
+        output = command.stdout.getvalue()
+        self.assertRegex(output, r"indexed +ok")
+        self.assertRegex(output, rf"elsewhere +skipped on {connection.vendor}")
+        # Failing plans are printed in full, passing ones only with -v 2.
+        self.assertIn("    SCAN shop_product\n", output)
+        self.assertNotIn("SEARCH shop_product", output)
+
+    def test_other_databases_are_refused(self):
+        with (
+            mock.patch.object(connection, "vendor", "mysql"),
+            mock.patch.object(connection.creation, "create_test_db") as create,
+        ):
+            with self.assertRaisesMessage(CommandError, "on postgresql or sqlite; this database is mysql"):
+                call_command("check_query_plans", stdout=io.StringIO())
+            with self.assertRaisesMessage(ValueError, "Cannot read mysql query plans"):
+                explain(Product.objects.all())
+
+        create.assert_not_called()
+
+
+class PoolSettingsTests(TestCase):
+    def production_databases(self, **environ):
+        # The module appends its replicas to the list from base, which the running settings share.
+        with mock.patch.dict(os.environ, environ), mock.patch.object(base_settings, "DATABASE_REPLICAS", []):
+            return runpy.run_module("config.settings.dev")["DATABASES"]
+
+    def test_connections_are_pooled_by_default(self):
+        databases = self.production_databases(POSTGRES_REPLICA_HOSTS="replica-1")
+
+        pool = {"min_size": 2, "max_size": 16, "timeout": 10.0, "max_lifetime": 1800.0, "max_idle": 300.0}
+        self.assertEqual(databases["default"]["OPTIONS"], {"pool": pool})
+        self.assertTrue(databases["default"]["CONN_HEALTH_CHECKS"])
+        # A pool manages connection lifetimes itself: Django refuses one with persistent connections.
+        self.assertNotIn("CONN_MAX_AGE", databases["default"])
+        self.assertEqual(databases["replica_1"]["OPTIONS"], {"pool": pool})
+        self.assertEqual(databases["replica_1"]["HOST"], "replica-1")
+
+    def test_pool_sizes_come_from_the_environment(self):
+        databases = self.production_databases(DB_POOL_MIN_SIZE="4", DB_POOL_MAX_SIZE="32", DB_POOL_TIMEOUT="2.5")
+
+        pool = databases["default"]["OPTIONS"]["pool"]
+        self.assertEqual((pool["min_size"], pool["max_size"], pool["timeout"]), (4, 32, 2.5))
+
+    def test_pooling_can_be_turned_off(self):
+        databases = self.production_databases(DB_POOL="0", DB_CONN_MAX_AGE="60", DB_HEALTH_CHECKS="0")
+
+        self.assertNotIn("OPTIONS", databases["default"])
+        self.assertEqual(databases["default"]["CONN_MAX_AGE"], 60)
+        self.assertFalse(databases["default"]["CONN_HEALTH_CHECKS"])
+
+    def test_pool_statistics_are_exported(self):
+        stats = {"pool_available": 3, "pool_size": 5, "pool_max": 16, "requests_waiting": 1, "requests_num": 40}
+        pooled = mock.Mock(**{"pool.get_stats.return_value": stats})
+        counters, gauges = {}, {}
+
+        with mock.patch.object(metrics, "connections", {"default": pooled}):
+            metrics._add_pool_stats(counters, gauges)
+
+        database = ("database", "default")
+        self.assertEqual(gauges["db_pool_connections", (database, ("state", "idle"))], 3)
+        self.assertEqual(gauges["db_pool_connections", (database, ("state", "in_use"))], 2)
+        self.assertEqual(gauges["db_pool_max_connections", (database,)], 16)
+        self.assertEqual(counters["db_pool_requests_total", (database,)], 40)
+        self.assertEqual(counters["db_pool_timeouts_total", (database,)], 0)
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.headers = create_customer()
+        other, _ = create_customer("other@example.com")
+        category = Category.objects.create(name="Drills")
+        products = [Product.objects.create(name=f"Drill {n}", price=1000, category=category) for n in range(3)]
+        cls.order_ids = []
+        for n in range(7):
+            order = Order.objects.create(user=cls.user, order_price=1000, status="paid" if n % 2 else "unpaid")
+            for quantity, product in enumerate(products, start=1):
+                OrderLine.objects.create(
+                    order=order, product=product, product_name=product.name, unit_price=1000, quantity=quantity
+                )
+                order.products.add(product)
+            cls.order_ids.append(order.id)
+        Order.objects.create(user=other, order_price=1000)
+
+    def setUp(self):
+        token_cache.clear()
+        # Authenticates once, so the counts below are those of the history alone.
+        self.get("")
+
+    def get(self, query):
+        response = self.client.get(f"/api/shop/order?{query}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def pages(self, query):
+        ids, cursor = [], ""
+        while True:
+            body = self.get(f"{query}&cursor={cursor}")
+            ids.append([order["id"] for order in body["data"]])
+            cursor = body["next"]
+            if not cursor:
+                return ids, body
+
+    def test_pages_are_newest_first(self):
+        ids, last = self.pages("page_size=3")
+
+        newest_first = self.order_ids[::-1]
+        self.assertEqual(ids, [newest_first[:3], newest_first[3:6], newest_first[6:]])
+        previous = self.get(f"page_size=3&cursor={last['previous']}")
+        self.assertEqual([order["id"] for order in previous["data"]], newest_first[3:6])
+
+    def test_status_filter(self):
+        ids, _ = self.pages("page_size=2&status=paid")
+
+        self.assertEqual(sum(ids, []), self.order_ids[1::2][::-1])
+
+    def test_full_pages_cost_three_queries(self):
+        for page_size in (1, 7):
+            with self.assertNumQueries(3):
+                orders = self.get(f"page_size={page_size}")["data"]
+            self.assertEqual(len(orders), page_size)
+
+        order = orders[0]
+        self.assertEqual([product["name"] for product in order["products"]], ["Drill 0", "Drill 1", "Drill 2"])
+        self.assertEqual([line["quantity"] for line in order["lines"]], [1, 2, 3])
+
+    def test_summary_pages_cost_one_query(self):
+        for page_size in (1, 7):
+            with self.assertNumQueries(1):
+                orders = self.get(f"view=summary&page_size={page_size}")["data"]
+            self.assertEqual(len(orders), page_size)
+
+        self.assertEqual(set(orders[0]), {"id", "order_price", "item_count", "status"})
+        self.assertEqual({order["item_count"] for order in orders}, {6})
+
+    def test_invalid_parameters(self):
+        for query in ("status=lost", "view=everything", "cursor=nonsense"):
+            response = self.client.get(f"/api/shop/order?{query}", headers=self.headers)
+            self.assertEqual(response.status_code, 400, query)
+
+
+class OneRequestThrottle(AnonRateThrottle):
+    rate = "1/min"
+
+
+class AsyncViewPolicyTests(TestCase):
+    """An async view enforces the same DRF policy as a sync one: product detail against product reviews."""
+
+    def setUp(self):
+        caches["default"].clear()
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+        product = Product.objects.create(name="Drill", price=1000)
+        self.paths = [f"/api/shop/product/{product.id}/reviews", f"/api/shop/product/{product.id}"]
+
+    def set_policy(self, name, value):
+        for view in (views.get_product_reviews, views.get_detail_product):
+            patcher = mock.patch.object(view.cls, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_permissions(self):
+        self.set_policy("permission_classes", [IsAuthenticated])
+
+        for path in self.paths:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 401, path)
+            self.assertEqual(response["WWW-Authenticate"], "Bearer", path)
+
+    def test_throttles(self):
+        self.set_policy("throttle_classes", [OneRequestThrottle])
+
+        for path in self.paths:
+            caches["default"].clear()
+            self.assertEqual(self.client.get(path).status_code, 200, path)
+            self.assertEqual(self.client.get(path).status_code, 429, path)
+
+    def test_content_negotiation(self):
+        for path in self.paths:
+            self.assertEqual(self.client.get(path, headers={"Accept": "application/xml"}).status_code, 406, path)
+            response = self.client.get(path, headers={"Accept": "text/html"})
+            self.assertEqual(response["Content-Type"], "text/html; charset=utf-8", path)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.user, self.headers = create_customer()
+        self.drill = Product.objects.create(name="Drill", price=1000)
+        self.saw = Product.objects.create(name="Saw", price=1000)
+
+    def review(self, product, grade):
+        response = self.client.post(
+            "/api/shop/review", {"product": product.id, "text": "Fine", "grade": grade}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def change(self, review_id, method, data=None):
+        return getattr(self.client, method)(
+            f"/api/shop/review:{review_id}", data, content_type="application/json", headers=self.headers
+        )
+
+    def ratings(self, product):
+        product.refresh_from_db()
+        stored = {field: getattr(product, field) for field in empty_ratings()}
+        # Whatever the path, the stored aggregates equal a recomputation.
+        self.assertEqual(stored, compute_ratings([product.id])[product.id])
+        hist = [stored[f"rating_hist_{bucket}"] for bucket in range(6)]
+        return stored["rating_count"], stored["rating_avg"], hist
+
+    def test_create_edit_and_delete(self):
+        first = self.review(self.drill, "4.0")
+        second = self.review(self.drill, "4.5")
+        self.assertEqual(self.ratings(self.drill), (2, Decimal("4.25"), [0, 0, 0, 0, 1, 1]))
+
+        self.assertEqual(self.change(second, "patch", {"grade": "2.0"}).status_code, 200)
+        self.assertEqual(self.ratings(self.drill), (2, Decimal("3.00"), [0, 0, 1, 0, 1, 0]))
+
+        self.assertEqual(self.change(first, "delete").status_code, 204)
+        self.assertEqual(self.ratings(self.drill), (1, Decimal("2.00"), [0, 0, 1, 0, 0, 0]))
+        self.assertEqual(self.change(second, "delete").status_code, 204)
+        self.assertEqual(self.ratings(self.drill), (0, Decimal("0.00"), [0] * 6))
+
+    def test_moving_a_review_to_another_product(self):
+        review_id = self.review(self.drill, "5.0")
+        self.review(self.saw, "3.0")
+
+        response = self.change(review_id, "patch", {"product": self.saw.id, "grade": "4.0"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ratings(self.drill), (0, Decimal("0.00"), [0] * 6))
+        self.assertEqual(self.ratings(self.saw), (2, Decimal("3.50"), [0, 0, 0, 1, 1, 0]))
+
+    def test_rebuild_finds_and_fixes_drift(self):
+        self.review(self.drill, "4.0")
+        self.review(self.saw, "3.0")
+        call_command("rebuild_ratings", "--check", stdout=io.StringIO())
+        # A review written around the maintenance, e.g. in the admin.
+        Review.objects.create(product=self.drill, user=self.user, text="Bad", grade=Decimal("1.0"))
+
+        with self.assertRaisesMessage(CommandError, "1 products have stale rating aggregates"):
+            call_command("rebuild_ratings", "--check", stdout=io.StringIO())
+        stdout = io.StringIO()
+        call_command("rebuild_ratings", "--batch-size", "1", stdout=stdout)
+
+        self.assertIn("1 products changed", stdout.getvalue())
+        self.assertEqual(self.ratings(self.drill), (2, Decimal("2.50"), [0, 1, 0, 0, 1, 0]))
+        call_command("rebuild_ratings", "--check", stdout=io.StringIO())
+
+
+@override_settings(SHOP_REVIEWS_PAGE_SIZE=5)
+class ProductReviewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Drill", price=1000)
+        cls.other = Product.objects.create(name="Saw", price=1000)
+        grades = ["4.0", "2.0", "4.0", "5.0", "2.0", "4.0", "1.0", "3.0"]
+        cls.review_ids = []
+        for number, grade in enumerate(grades):
+            user = User.objects.create_user(f"Покупатель {number}", f"buyer{number}@example.com", "password")
+            review = Review.objects.create(product=cls.product, user=user, text="Text", grade=Decimal(grade))
+            cls.review_ids.append(review.id)
+        Review.objects.create(product=cls.other, user=user, text="Text", grade=Decimal("5.0"))
+
+    def setUp(self):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+
+    def get(self, path):
+        caches[settings.SHOP_CATALOG_CACHE].clear()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+        return response.json()
+
+    def reviews(self, query):
+        ids, grades, cursor = [], [], ""
+        while True:
+            body = self.get(f"/api/shop/product/{self.product.id}/reviews?page_size=3&{query}&cursor={cursor}")
+            ids += [review["id"] for review in body["data"]]
+            grades += [review["grade"] for review in body["data"]]
+            cursor = body["next"]
+            if not cursor:
+                return ids, grades
+
+    def test_detail_embeds_the_newest_page_in_fixed_queries(self):
+        self.get(f"/api/shop/product/{self.other.id}")
+        for product, count in ((self.other, 1), (self.product, 8)):
+            caches[settings.SHOP_CATALOG_CACHE].clear()
+            # The product with its category and manufacturer, then the page of reviews with their authors.
+            with self.assertNumQueries(2):
+                response = self.client.get(f"/api/shop/product/{product.id}")
+            self.assertEqual(len(response.json()["data"]["reviews"]), min(count, 5))
+
+        data = response.json()["data"]
+        self.assertEqual([review["id"] for review in data["reviews"]], self.review_ids[::-1][:5])
+        self.assertEqual(data["reviews"][0]["user"]["fio"], "Покупатель 7")
+        body = self.get(f"/api/shop/product/{self.product.id}/reviews?cursor={data['reviews_next']}")
+        self.assertEqual([review["id"] for review in body["data"]], self.review_ids[::-1][5:])
+        self.assertIsNone(body["next"])
+
+    def test_orderings_and_pages(self):
+        newest = self.review_ids[::-1]
+        self.assertEqual(self.reviews("")[0], newest)
+        self.assertEqual(self.reviews("sort_by=oldest")[0], self.review_ids)
+        ids, grades = self.reviews("sort_by=grade")
+        self.assertEqual(grades, sorted(grades, key=Decimal))
+        self.assertEqual(sorted(ids), sorted(self.review_ids))
+        ids, grades = self.reviews("sort_by=-grade")
+        self.assertEqual(grades, sorted(grades, key=Decimal, reverse=True))
+        self.assertEqual(sorted(ids), sorted(self.review_ids))
+
+    def test_pages_cost_one_query(self):
+        self.get(f"/api/shop/product/{self.product.id}/reviews")
+        for page_size in (1, 8):
+            caches[settings.SHOP_CATALOG_CACHE].clear()
+            with self.assertNumQueries(1):
+                self.client.get(f"/api/shop/product/{self.product.id}/reviews?page_size={page_size}")
+
+    def test_unknown_ordering_and_bad_cursor(self):
+        for query in ("sort_by=helpful", "cursor=nonsense"):
+            response = self.client.get(f"/api/shop/product/{self.product.id}/reviews?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+
+@override_settings(SHOP_RECENT_PRODUCTS_LIMIT=3)
+class RecentViewBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, _ = create_customer()
+        cls.products = [Product.objects.create(name=f"Drill {number}", price=1000) for number in range(5)]
+
+    def setUp(self):
+        self.buffer = RecentViewBuffer()
+        self.clock = timezone.now()
+        # No flusher thread; the tests flush by hand and read the clock they set.
+        patcher = mock.patch.object(RecentViewBuffer, "_start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("apps.shop.recent.timezone.now", side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, *products):
+        for product in products:
+            self.clock += datetime.timedelta(seconds=1)
+            self.buffer.record(self.user.id, product.id)
+
+    def recent(self):
+        return [row.product for row in recent_products(self.user)]
+
+    def test_repeat_views_merge_into_the_newest(self):
+        drill, saw = self.products[:2]
+        self.view(drill, saw, drill)
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.recent(), [drill, saw])
+        self.assertEqual(RecentProduct.objects.get(product=drill).viewed_at, self.clock)
+
+        # An upsert of the row a previous flush wrote.
+        self.view(saw)
+        self.buffer.flush()
+        self.assertEqual(self.recent(), [saw, drill])
+        self.assertEqual(RecentProduct.objects.filter(user=self.user).count(), 2)
+
+    def test_flush_trims_to_the_newest(self):
+        self.view(*self.products[:2])
+        self.buffer.flush()
+        self.view(*self.products[2:])
+
+        # Existing products, then one upsert, the overflow lookup and its delete inside a savepoint.
+        with self.assertNumQueries(6):
+            self.buffer.flush()
+
+        self.assertEqual(self.recent(), self.products[:1:-1])
+        self.assertEqual(RecentProduct.objects.filter(user=self.user).count(), 3)
+
+    def test_deleted_products_are_skipped(self):
+        self.view(*self.products[:2])
+        self.products[0].delete()
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.recent(), [self.products[1]])
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_a_full_buffer_wakes_the_flusher(self):
+        with override_settings(SHOP_RECENT_VIEWS_MAX_PENDING=2):
+            self.view(self.products[0], self.products[0])
+            self.assertFalse(self.buffer._wakeup.is_set())
+            self.view(self.products[1])
+            self.assertTrue(self.buffer._wakeup.is_set())
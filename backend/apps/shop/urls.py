@@ -6,26 +6,36 @@ from .views import (
     update_or_delete_product,
     get_list_of_products_from_cart,
     add_or_delete_product_from_cart,
+    update_cart_items,
     get_list_of_products_from_order,
+    get_order_checkout,
     payment_status,
     stripe_webhook,
     get_detail_product,
+    get_product_reviews,
     get_recent_products,
     create_review,
     manage_reviews,
+    export_products,
+    export_orders,
 )
 
 urlpatterns = [
     path("products", get_list_of_products),
     path("product", create_product),
     path("product/<int:product_id>", get_detail_product),
+    path("product/<int:product_id>/reviews", get_product_reviews),
     path("product/<int:pk>", update_or_delete_product),
     path("cart", get_list_of_products_from_cart),
     path("cart/<int:pk>", add_or_delete_product_from_cart),
+    path("cart/items", update_cart_items),
     path("order", get_list_of_products_from_order),
+    path("order/<int:order_id>/checkout", get_order_checkout),
     path("payment-status/<str:session_id>", payment_status),
     path("stripe/webhook", stripe_webhook),
     path("review", create_review),
     path("review:<int:review_id>", manage_reviews),
     path("recent", get_recent_products),
+    path("export/products.<str:export_format>", export_products),
+    path("export/orders.<str:export_format>", export_orders),
 ]
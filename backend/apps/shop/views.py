@@ -1,60 +1,147 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.request import Request
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN
-import stripe
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_202_ACCEPTED,
+    HTTP_204_NO_CONTENT,
+    HTTP_400_BAD_REQUEST,
+    HTTP_403_FORBIDDEN,
+    HTTP_404_NOT_FOUND,
+    HTTP_409_CONFLICT,
+)
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
 from django.conf import settings
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
-from .filters import ProductFilter
-from .models import Product, Cart, Order, Review, RecentProduct
-from .serializers.carts import CartSerializer
-from .serializers.orders import OrderSerializer
+from .cache import acached_response, cached_response
+from .cart_store import CartBusy, get_cart_store
+from .carts import CartError
+from .decorators import async_api_view
+from .exports import (
+    FORMATS as EXPORT_FORMATS,
+    LINE_COLUMNS,
+    ORDER_COLUMNS,
+    PRODUCT_COLUMNS,
+    InvalidSince,
+    encode_csv,
+    encode_ndjson,
+    order_line_rows,
+    order_rows,
+    parse_since,
+    product_rows,
+    streaming_export,
+)
+from .facets import UnknownFacet, get_facet_counts, parse_facets
+from .filters import REVIEW_ORDERINGS, ProductFilter
+from .models import Product, Order, CheckoutOutbox, Review
+from .orders import ORDER_STATUSES, EmptyCart, create_order_from_cart, order_history, order_summaries
+from .pagination import InvalidCursor, KeysetPaginator
+from .payments import checkout_state, refresh_payment_status, wait_for_checkout, wait_for_payment
+from .ratings import review_added, review_changed, review_removed
+from .recent import recent_products, recent_views
+from .serializers.carts import CartItemSerializer, CartOperationsSerializer
+from .serializers.orders import OrderSerializer, OrderSummarySerializer
 from .serializers.product import ReviewSerializer, RecentProductSerializer, ProductDetailSerializer
 from .serializers.products import ProductSerializer
+from .webhooks import InvalidEvent, parse_stripe_event, record_stripe_event
 from rest_framework.generics import get_object_or_404
 
 
-stripe.api_key = settings.STRIPE_TEST_SECRET_KEY
+@async_api_view(["GET"])
+async def get_list_of_products(request):
+    return await acached_response(request, lambda: _list_products(request))
 
 
-@api_view(["GET"])
-def get_list_of_products(request):
-    product_filter = ProductFilter(request.GET, queryset=Product.objects.all())
-    products = product_filter.qs
-    serializer = ProductSerializer(products, many=True)
-    return Response({"data": serializer.data}, status=HTTP_200_OK)
+async def _list_products(request):
+    queryset = Product.objects.select_related("category", "manufacturer").defer("search_vector")
+    product_filter = ProductFilter(request.GET, queryset=queryset)
+    paginator = KeysetPaginator(product_filter.get_ordering(), page_size=request.GET.get("page_size"))
+    try:
+        facets = parse_facets(request.GET.get("facets"))
+        page = await paginator.apaginate(product_filter.qs, request.GET.get("cursor"))
+    except (InvalidCursor, UnknownFacet) as e:
+        return Response({"error": {"code": 400, "message": str(e)}}, status=HTTP_400_BAD_REQUEST)
 
+    serializer = ProductSerializer(page.items, many=True)
+    response = {"data": serializer.data, "next": page.next_cursor, "previous": page.previous_cursor}
+    if facets:
+        response["facets"] = await sync_to_async(get_facet_counts)(product_filter, facets)
+    return Response(response, status=HTTP_200_OK)
 
-@api_view(["GET"])
-def get_detail_product(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    serializer = ProductDetailSerializer(product)
-    print(request.user.is_authenticated, "sss")
+
+@async_api_view(["GET"])
+async def get_detail_product(request, product_id):
+    response = await acached_response(request, lambda: _detail_product(product_id))
     if request.user.is_active:
-        RecentProduct.objects.get_or_create(product=product, user=request.user)
+        recent_views.record(request.user.id, product_id)
 
-    return Response({"data": serializer.data}, status=HTTP_200_OK)
+    return response
+
+
+async def _detail_product(product_id):
+    queryset = Product.objects.select_related("category", "manufacturer").defer("search_vector")
+    product = await aget_object_or_404(queryset, id=product_id)
+    # The serializer queries the first page of reviews.
+    data = await sync_to_async(lambda: ProductDetailSerializer(product).data)()
+    return Response({"data": data}, status=HTTP_200_OK)
+
+
+@api_view(["GET"])
+def get_product_reviews(request, product_id):
+    return cached_response(request, lambda: _product_reviews(request, product_id))
+
+
+def _product_reviews(request, product_id):
+    ordering = REVIEW_ORDERINGS.get(request.GET.get("sort_by") or "newest")
+    if ordering is None:
+        return Response({"error": {"code": 400, "message": "Unknown ordering"}}, status=HTTP_400_BAD_REQUEST)
+
+    paginator = KeysetPaginator(
+        ordering, page_size=request.GET.get("page_size"), default_page_size=settings.SHOP_REVIEWS_PAGE_SIZE
+    )
+    try:
+        page = paginator.paginate(Review.objects.for_listing(product_id), request.GET.get("cursor"))
+    except InvalidCursor as e:
+        return Response({"error": {"code": 400, "message": str(e)}}, status=HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "data": ReviewSerializer(page.items, many=True).data,
+            "next": page.next_cursor,
+            "previous": page.previous_cursor,
+        },
+        status=HTTP_200_OK,
+    )
 
 
 @api_view(["POST"])
 def create_review(request):
     serializer = ReviewSerializer(data=request.data, context={"request": request})
     serializer.is_valid(raise_exception=True)
-    review = serializer.save()
+    with transaction.atomic():
+        review = serializer.save()
+        review_added(review)
     return Response(ReviewSerializer(review).data, status=HTTP_201_CREATED)
 
 
 @api_view(["DELETE", "PATCH"])
+@transaction.atomic
 def manage_reviews(request, review_id):
-    review = get_object_or_404(Review, id=review_id)
+    review = get_object_or_404(Review.objects.select_for_update(), id=review_id)
     if request.method == "PATCH":
+        old_product_id, old_grade = review.product_id, review.grade
         serializer = ReviewSerializer(data=request.data, partial=True, instance=review)
         serializer.is_valid(raise_exception=True)
         review = serializer.save()
+        review_changed(old_product_id, old_grade, review)
         return Response(ReviewSerializer(review).data, status=HTTP_200_OK)
     if request.method == "DELETE":
         review.delete()
+        review_removed(review)
         return Response(status=HTTP_204_NO_CONTENT)
 
 
@@ -85,128 +172,177 @@ def update_or_delete_product(request: Request, pk: int) -> Response:
     return Response({"data": serializer.data}, status=HTTP_200_OK)
 
 
-@api_view(["GET"])
-def get_list_of_products_from_cart(request: Request) -> Response:
+@async_api_view(["GET"])
+async def get_list_of_products_from_cart(request: Request) -> Response:
     if not request.user.is_authenticated or request.user.is_staff:
         return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
 
-    cart, _ = Cart.objects.get_or_create(user=request.user)
-    serialized_cart = CartSerializer(cart).data
-    data = [{"id": idx + 1, **item} for idx, item in enumerate(serialized_cart["products"])]
-
-    return Response({"data": data}, status=HTTP_200_OK)
+    return await _cart_response(request.user)
 
 
-@api_view(["POST", "DELETE"])
-def add_or_delete_product_from_cart(request: Request, pk: int) -> Response:
+@async_api_view(["POST", "DELETE"])
+async def add_or_delete_product_from_cart(request: Request, pk: int) -> Response:
     if not request.user.is_authenticated or request.user.is_staff:
         return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
-    product = get_object_or_404(Product, pk=pk)
-    cart, _ = Cart.objects.get_or_create(user=request.user)
 
     if request.method == "POST":
-        cart.products.add(product)
-        return Response({"data": {"message": "Product added to cart"}}, status=HTTP_200_OK)
+        operation = {"op": "increment", "product": pk, "quantity": 1}
+    else:
+        operation = {"op": "remove", "product": pk}
+    try:
+        await sync_to_async(get_cart_store().apply)(request.user, [operation])
+    except CartError:
+        return Response({"error": {"code": 404, "message": "Not found"}}, status=HTTP_404_NOT_FOUND)
+    except CartBusy:
+        return Response({"error": {"code": 409, "message": "Cart is busy, try again"}}, status=HTTP_409_CONFLICT)
 
-    cart.products.remove(product)
+    if request.method == "POST":
+        return Response({"data": {"message": "Product added to cart"}}, status=HTTP_200_OK)
     return Response(status=HTTP_204_NO_CONTENT)
 
 
+@async_api_view(["POST"])
+async def update_cart_items(request: Request) -> Response:
+    if not request.user.is_authenticated or request.user.is_staff:
+        return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
+
+    serializer = CartOperationsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        await sync_to_async(get_cart_store().apply)(request.user, serializer.validated_data["operations"])
+    except CartError as e:
+        return Response({"error": {"code": 400, "message": str(e)}}, status=HTTP_400_BAD_REQUEST)
+    except CartBusy:
+        return Response({"error": {"code": 409, "message": "Cart is busy, try again"}}, status=HTTP_409_CONFLICT)
+
+    return await _cart_response(request.user)
+
+
+async def _cart_response(user):
+    store = get_cart_store()
+    items = await store.aitems(user)
+    return Response(
+        {"data": CartItemSerializer(items, many=True).data, **store.summarize(items)},
+        status=HTTP_200_OK,
+    )
+
+
 @api_view(["GET", "POST"])
 def get_list_of_products_from_order(request: Request) -> Response:
     if not request.user.is_authenticated or request.user.is_staff:
         return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
 
     if request.method == "GET":
-        orders = Order.objects.filter(user=request.user)
-        return Response({"data": OrderSerializer(orders, many=True).data}, status=HTTP_200_OK)
-
-    cart = get_object_or_404(Cart, user=request.user)
-    order_price = sum(p.price for p in cart.products.all())
-    order = Order.objects.create(user=request.user, order_price=order_price)
-    order.products.set(cart.products.all())
+        return _order_history(request)
 
     try:
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": "usd",
-                        "product_data": {
-                            "name": f"Заказ #{order.id}",
-                        },
-                        "unit_amount": int(order_price * 100),
-                    },
-                    "quantity": 1,
-                }
-            ],
-            mode="payment",
-            success_url="http://146.255.188.248:5173/orders",
-            cancel_url="http://146.255.188.248:5173/cart",
-            metadata={"order_id": order.id},
-            customer_email=request.user.email,
-        )
-    except Exception as e:
-        return Response({"error": {"code": 500, "message": str(e)}}, status=500)
-
-    cart.delete()
+        with get_cart_store().checkout(request.user):
+            order, created = create_order_from_cart(request.user, request.headers.get("Idempotency-Key"))
+            if created:
+                CheckoutOutbox.objects.create(order=order)
+    except EmptyCart:
+        return Response({"error": {"code": 400, "message": "Cart is empty"}}, status=HTTP_400_BAD_REQUEST)
+    except CartBusy:
+        return Response({"error": {"code": 409, "message": "Cart is busy, try again"}}, status=HTTP_409_CONFLICT)
 
     return Response(
         {
             "data": {
-                "order_id": order.id,
-                "checkout_session_id": checkout_session.id,
-                "checkout_url": checkout_session.url,
-                "message": "Заказ создан и платеж инициирован",
+                **_checkout_data(order, checkout_state(order)),
+                "message": "Заказ создан, платеж инициируется",
             }
         },
-        status=HTTP_201_CREATED,
+        status=HTTP_202_ACCEPTED,
     )
 
 
-@api_view(["GET"])
-def payment_status(request: Request, session_id: str) -> Response:
+def _order_history(request):
+    """Newest first; ``?view=summary`` gives totals and item counts only, ``?status=`` (repeatable) filters."""
+    statuses = [status for status in request.GET.getlist("status") if status]
+    if any(status not in ORDER_STATUSES for status in statuses):
+        return Response({"error": {"code": 400, "message": "Unknown status"}}, status=HTTP_400_BAD_REQUEST)
+
+    view = request.GET.get("view") or "full"
+    if view == "full":
+        orders, serializer_class = order_history(request.user, statuses), OrderSerializer
+    elif view == "summary":
+        orders, serializer_class = order_summaries(request.user, statuses), OrderSummarySerializer
+    else:
+        return Response({"error": {"code": 400, "message": "Unknown view"}}, status=HTTP_400_BAD_REQUEST)
+
+    paginator = KeysetPaginator(
+        ["-id"], page_size=request.GET.get("page_size"), default_page_size=settings.SHOP_ORDERS_PAGE_SIZE
+    )
+    try:
+        page = paginator.paginate(orders, request.GET.get("cursor"))
+    except InvalidCursor as e:
+        return Response({"error": {"code": 400, "message": str(e)}}, status=HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "data": serializer_class(page.items, many=True).data,
+            "next": page.next_cursor,
+            "previous": page.previous_cursor,
+        },
+        status=HTTP_200_OK,
+    )
+
+
+@async_api_view(["GET"])
+async def get_order_checkout(request: Request, order_id: int) -> Response:
+    """The order's checkout session; ``?wait=N`` long-polls until it is no longer pending."""
     if not request.user.is_authenticated or request.user.is_staff:
         return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
 
+    order = await aget_object_or_404(Order, id=order_id, user=request.user)
     try:
-        session = stripe.checkout.Session.retrieve(session_id, expand=["payment_status"])
-        order_id = session.metadata.get("order_id")
-        order = get_object_or_404(Order, id=order_id, user=request.user)
+        wait = min(max(float(request.GET.get("wait", 0)), 0), settings.SHOP_CHECKOUT_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    state = await wait_for_checkout(order, wait)
+    return Response({"data": _checkout_data(order, state)}, status=HTTP_200_OK)
 
-        if session.payment_status == "paid" and order.status != "paid":
-            order.status = "paid"
-            order.save(update_fields=["status"])
 
-        return Response({"status": order.status}, status=HTTP_200_OK)
+def _checkout_data(order, state):
+    return {
+        "order_id": order.id,
+        "state": state,
+        "checkout_session_id": order.checkout_session_id,
+        "checkout_url": order.checkout_url,
+        "status_url": f"/api/shop/order/{order.id}/checkout",
+    }
 
-    except Exception as e:
-        return Response({"error": {"code": 500, "message": str(e)}}, status=500)
 
+@async_api_view(["GET"])
+async def payment_status(request: Request, session_id: str) -> Response:
+    """Status of the order paid through ``session_id``; ``?wait=N`` long-polls until it leaves unpaid."""
+    if not request.user.is_authenticated or request.user.is_staff:
+        return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
 
-@csrf_exempt
-def stripe_webhook(request):
-    payload = request.body
-    sig_header = request.headers.get("Stripe-Signature")
-    webhook_secret = "whsec_4c7cb0bc16a35f6bc65f139d2b2af2aa21552a4e7890bce7d70b5994d25ae8b1"
+    order = await aget_object_or_404(
+        Order.objects.only("id", "status"), checkout_session_id=session_id, user=request.user
+    )
+    order.checkout_session_id = session_id
 
+    status = await refresh_payment_status(order)
     try:
-        event = stripe.Webhook.construct_event(payload=payload, sig_header=sig_header, secret=webhook_secret)
+        wait = min(max(float(request.GET.get("wait", 0)), 0), settings.SHOP_PAYMENT_MAX_WAIT)
     except ValueError:
-        return HttpResponse(status=400)
-    except stripe.error.SignatureVerificationError:
-        return HttpResponse(status=400)
+        wait = 0
+    if status == "unpaid" and wait:
+        status = await wait_for_payment(order, wait)
+    return Response({"status": status}, status=HTTP_200_OK)
+
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        order_id = session.get("metadata", {}).get("order_id")
-        if order_id:
-            try:
-                Order.objects.filter(id=order_id).update(status="paid")
-            except Exception:
-                pass
+@csrf_exempt
+def stripe_webhook(request):
+    try:
+        event = parse_stripe_event(request.body, request.headers.get("Stripe-Signature"))
+    except InvalidEvent:
+        return HttpResponse(status=400)
 
+    # Processing happens in `process_stripe_events`; Stripe only needs the event durably stored.
+    record_stripe_event(event)
     return HttpResponse(status=200)
 
 
@@ -214,5 +350,41 @@ def stripe_webhook(request):
 def get_recent_products(request):
     if not request.user.is_authenticated or request.user.is_staff:
         return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
-    recent_produtcs = RecentProduct.objects.filter(user=request.user)
-    return Response(RecentProductSerializer(recent_produtcs, many=True).data, status=HTTP_200_OK)
+    return Response(RecentProductSerializer(recent_products(request.user), many=True).data, status=HTTP_200_OK)
+
+
+@api_view(["GET"])
+def export_products(request, export_format):
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
+    if export_format not in EXPORT_FORMATS:
+        return Response({"error": {"code": 404, "message": "Unknown export format"}}, status=HTTP_404_NOT_FOUND)
+    try:
+        rows = product_rows(parse_since(request.GET.get("since")))
+    except InvalidSince as e:
+        return Response({"error": {"code": 400, "message": str(e)}}, status=HTTP_400_BAD_REQUEST)
+
+    if export_format == "csv":
+        parts = encode_csv(rows, list(PRODUCT_COLUMNS))
+    else:
+        parts = encode_ndjson(rows)
+    return streaming_export(request, parts, export_format, "products")
+
+
+@api_view(["GET"])
+def export_orders(request, export_format):
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return Response({"error": {"code": 403, "message": "Forbidden"}}, status=HTTP_403_FORBIDDEN)
+    if export_format not in EXPORT_FORMATS:
+        return Response({"error": {"code": 404, "message": "Unknown export format"}}, status=HTTP_404_NOT_FOUND)
+    try:
+        rows = order_rows(parse_since(request.GET.get("since")))
+    except InvalidSince as e:
+        return Response({"error": {"code": 400, "message": str(e)}}, status=HTTP_400_BAD_REQUEST)
+
+    # CSV has one row per order line; NDJSON nests the lines in each order.
+    if export_format == "csv":
+        parts = encode_csv(order_line_rows(rows), [*ORDER_COLUMNS, *LINE_COLUMNS])
+    else:
+        parts = encode_ndjson(rows)
+    return streaming_export(request, parts, export_format, "orders")
@@ -0,0 +1,165 @@
+"""
+Stripe webhook ingestion.
+
+The webhook view only verifies the signature and inserts the event into
+``StripeEvent``; the unique ``event_id`` turns Stripe's redeliveries into
+no-ops. ``process_stripe_events`` later drains stored events in batches and
+applies the resulting order status changes with a single UPDATE per batch.
+
+Stripe does not deliver events in order. A full refund of an order whose
+payment has not been applied yet is left unprocessed and retried with
+exponential backoff, up to ``max_attempts`` times; every other event that
+does not apply (a partial refund, an expiry after payment) is consumed.
+"""
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Order, StripeEvent
+
+# Event type -> (status the order must be in, status it moves to).
+TRANSITIONS = {
+    "checkout.session.completed": ("unpaid", "paid"),
+    "checkout.session.async_payment_succeeded": ("unpaid", "paid"),
+    "checkout.session.expired": ("unpaid", "expired"),
+    "charge.refunded": ("paid", "refunded"),
+}
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def parse_stripe_event(payload, sig_header, secret=None):
+    """Verify the ``Stripe-Signature`` header and return the decoded event."""
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode() if isinstance(payload, bytes) else payload,
+            sig_header,
+            secret or settings.STRIPE_WEBHOOK_SECRET,
+            stripe.Webhook.DEFAULT_TOLERANCE,
+        )
+        event = json.loads(payload)
+        return {"id": event["id"], "type": event["type"], "created": event["created"], "data": event["data"]}
+    except (stripe.error.SignatureVerificationError, ValueError, KeyError, TypeError) as e:
+        raise InvalidEvent(str(e)) from e
+
+
+def record_stripe_event(event):
+    """Store an event; a redelivery of an already stored event is ignored."""
+    StripeEvent.objects.bulk_create(
+        [
+            StripeEvent(
+                event_id=event["id"],
+                type=event["type"],
+                payload=event["data"]["object"],
+                created=datetime.fromtimestamp(event["created"], tz=dt_timezone.utc),
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _transition(event, orders_by_intent):
+    """Return ``(order_id, source, target, payment_intent)`` for an event, or None if it changes nothing."""
+    if event.type not in TRANSITIONS:
+        return None
+    source, target = TRANSITIONS[event.type]
+    obj = event.payload
+    if event.type == "charge.refunded":
+        if not obj.get("refunded"):
+            return None  # partial refund, the order stays paid
+        # No order when the payment that set its payment intent has not been applied yet.
+        return orders_by_intent.get(obj.get("payment_intent")), source, target, None
+
+    if event.type == "checkout.session.completed" and obj.get("payment_status") != "paid":
+        # Delayed payment methods report success later via async_payment_succeeded.
+        return None
+    try:
+        order_id = int((obj.get("metadata") or {}).get("order_id"))
+    except (TypeError, ValueError):
+        return None
+    payment_intent = obj.get("payment_intent") if target == "paid" else None
+    return order_id, source, target, payment_intent
+
+
+def process_stripe_events(batch_size=500, max_attempts=10, base_delay=5.0, max_delay=600.0):
+    """
+    Apply one batch of due, unprocessed events; return how many were handled.
+
+    Events are applied in Stripe's ``created`` order. Each transition only
+    fires from its source status, and the UPDATE re-checks that status, so a
+    concurrent change (e.g. ``payment_status`` marking an order paid) is
+    never overwritten. ``SKIP LOCKED`` lets several processors run at once.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(Q(available_at__isnull=True) | Q(available_at__lte=now), processed_at__isnull=True)
+            .order_by("created", "id")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        intents = {
+            event.payload.get("payment_intent")
+            for event in events
+            if event.type == "charge.refunded" and event.payload.get("payment_intent")
+        }
+        orders_by_intent = {}
+        if intents:
+            orders_by_intent = dict(
+                Order.objects.filter(payment_intent_id__in=intents).values_list("payment_intent_id", "id")
+            )
+
+        transitions = {}
+        for event in events:
+            transition = _transition(event, orders_by_intent)
+            if transition:
+                transitions[event.id] = transition
+                order_id, _, _, payment_intent = transition
+                if payment_intent:
+                    # A refund later in the same batch finds the order through this.
+                    orders_by_intent[payment_intent] = order_id
+        order_ids = {order_id for order_id, *_ in transitions.values() if order_id}
+        current = dict(Order.objects.filter(id__in=order_ids).values_list("id", "status"))
+        statuses, payment_intents, deferred = {}, {}, []
+        for event in events:
+            if event.id not in transitions:
+                continue
+            order_id, source, target, payment_intent = transitions[event.id]
+            status = statuses.get(order_id, current.get(order_id))
+            if status == source:
+                statuses[order_id] = target
+                if payment_intent:
+                    payment_intents[order_id] = payment_intent
+            elif target == "refunded" and status in (None, "unpaid") and event.attempts + 1 < max_attempts:
+                deferred.append(event)
+
+        if statuses:
+            status_cases = [
+                When(id=order_id, status=current[order_id], then=Value(status))
+                for order_id, status in statuses.items()
+            ]
+            intent_cases = [When(id=order_id, then=Value(intent)) for order_id, intent in payment_intents.items()]
+            Order.objects.filter(id__in=statuses).update(
+                status=Case(*status_cases, default=F("status")),
+                payment_intent_id=Case(*intent_cases, default=F("payment_intent_id")),
+                updated_at=timezone.now(),
+            )
+        for event in deferred:
+            delay = min(base_delay * 2**event.attempts, max_delay)
+            StripeEvent.objects.filter(id=event.id).update(
+                attempts=event.attempts + 1, available_at=now + timedelta(seconds=delay)
+            )
+        deferred_ids = {event.id for event in deferred}
+        StripeEvent.objects.filter(id__in=[event.id for event in events if event.id not in deferred_ids]).update(
+            processed_at=timezone.now()
+        )
+    return len(events)
@@ -1,7 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.users"
-    verbose_name = "Пользователи"
\ No newline at end of file
+    verbose_name = "Пользователи"
+
+    def ready(self):
+        from rest_framework.authtoken.models import Token
+
+        from .models import User
+        from .signals import token_deleted, user_changed
+
+        post_save.connect(user_changed, sender=User)
+        post_delete.connect(user_changed, sender=User)
+        post_delete.connect(token_deleted, sender=Token)
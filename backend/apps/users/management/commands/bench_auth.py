@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.decorators import api_view, authentication_classes
+from rest_framework.response import Response
+
+from apps.users.models import User
+from apps.users.token import Bearer, CachingBearer
+from apps.users.token_cache import token_cache
+
+
+def build_view(authenticator):
+    @api_view(["GET"])
+    @authentication_classes([authenticator])
+    def view(request):
+        return Response({"user": request.user.pk})
+
+    return view
+
+
+class Command(BaseCommand):
+    help = "Compare authenticated request throughput with and without the token cache (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--requests", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                User(email=f"bench-auth-{i}@example.com", fio="Bench") for i in range(options["users"])
+            )
+            tokens = Token.objects.bulk_create(Token(user=user, key=Token.generate_key()) for user in users)
+            keys = [token.key for token in tokens]
+            # A few active users make most of the requests, as in real traffic.
+            weights = [1 / (rank + 1) for rank in range(len(keys))]
+            factory = RequestFactory()
+            requests = [
+                factory.get("/bench", HTTP_AUTHORIZATION=f"Bearer {key}")
+                for key in rng.choices(keys, weights, k=options["requests"])
+            ]
+
+            token_cache.clear()
+            self.stdout.write(f"{'authenticator':<16}{'req/s':>10}{'queries/req':>14}{'hit ratio':>12}")
+            for authenticator in (Bearer, CachingBearer):
+                view = build_view(authenticator)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for request in requests:
+                        view(request)
+                    elapsed = time.perf_counter() - started
+                hit_ratio = token_cache.stats()["hit_ratio"] if authenticator is CachingBearer else 0.0
+                self.stdout.write(
+                    f"{authenticator.__name__:<16}{len(requests) / elapsed:>10,.0f}"
+                    f"{len(queries) / len(requests):>14.3f}{hit_ratio:>12.1%}"
+                )
+
+            transaction.set_rollback(True)
+            token_cache.clear()
@@ -0,0 +1,17 @@
+from django.db import transaction
+
+from .token_cache import token_cache
+
+
+def _invalidate(user_id, using):
+    # After commit, so a concurrent request cannot re-cache the old row.
+    transaction.on_commit(lambda: token_cache.invalidate_user(user_id), using=using)
+
+
+def user_changed(sender, instance, using, **kwargs):
+    # Any save, not just is_active/is_staff: cached users are served as request.user.
+    _invalidate(instance.pk, using)
+
+
+def token_deleted(sender, instance, using, **kwargs):
+    _invalidate(instance.user_id, using)
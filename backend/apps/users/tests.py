@@ -1 +1,100 @@
-# Create your tests here.
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from apps.users.models import User
+from apps.users.token_cache import TokenCache, token_cache
+
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "shared"},
+}
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user("Покупатель", "buyer@example.com", "password")
+        self.key = Token.objects.create(user=self.user).key
+        self.headers = {"Authorization": f"Bearer {self.key}"}
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def get_cart(self):
+        return self.client.get("/api/shop/cart", headers=self.headers)
+
+    def test_logout_revokes_the_cached_token(self):
+        self.assertEqual(self.get_cart().status_code, 200)
+        self.assertEqual(token_cache.stats()["size"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/users/logout/", headers=self.headers)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_cart().status_code, 401)
+
+    def test_deactivation_revokes_the_cached_token(self):
+        self.assertEqual(self.get_cart().status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        self.assertEqual(self.get_cart().status_code, 401)
+
+    def test_local_entries_are_short_lived_without_a_shared_cache(self):
+        self.assertIsNone(settings.AUTH_TOKEN_SHARED_CACHE)
+        self.assertEqual(token_cache.ttl, settings.AUTH_TOKEN_LOCAL_TTL)
+
+        # Another worker's cache, which the logout below cannot reach.
+        other_worker = TokenCache(10, settings.AUTH_TOKEN_LOCAL_TTL)
+        other_worker.set(self.key, self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/users/logout/", headers=self.headers)
+
+        self.assertIsNotNone(other_worker.get(self.key))
+        later = time.monotonic() + settings.AUTH_TOKEN_LOCAL_TTL + 0.1
+        with mock.patch("apps.users.token_cache.time.monotonic", return_value=later):
+            self.assertIsNone(other_worker.get(self.key))
+
+
+    def test_without_a_lifetime_nothing_is_cached(self):
+        worker = TokenCache(10, 0)
+        worker.set(self.key, self.user)
+
+        self.assertIsNone(worker.get(self.key))
+        self.assertEqual(worker.stats()["size"], 0)
+
+        with mock.patch.object(token_cache, "ttl", 0):
+            self.assertEqual(self.get_cart().status_code, 200)
+            with self.assertNumQueries(2):
+                # The token and its user, then the cart.
+                self.assertEqual(self.get_cart().status_code, 200)
+
+@override_settings(CACHES=SHARED_CACHES)
+class SharedTokenCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("Покупатель", "buyer@example.com", "password")
+        self.key = Token.objects.create(user=self.user).key
+        # The caches of two worker processes.
+        self.workers = [TokenCache(10, 300, "shared"), TokenCache(10, 300, "shared")]
+
+    def test_invalidation_reaches_other_workers_at_once(self):
+        for worker in self.workers:
+            worker.set(self.key, self.user)
+            self.assertEqual(worker.get(self.key), self.user)
+
+        self.workers[0].invalidate_user(self.user.pk)
+
+        self.assertIsNone(self.workers[1].get(self.key))
+        self.assertEqual(self.workers[1].stats()["size"], 0)
+
+    def test_other_workers_are_filled_from_the_shared_cache(self):
+        self.workers[0].set(self.key, self.user)
+
+        self.assertEqual(self.workers[1].get(self.key), self.user)
+        self.assertEqual(self.workers[1].stats()["shared_hits"], 1)
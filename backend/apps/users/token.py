@@ -1,5 +1,19 @@
 from rest_framework.authentication import TokenAuthentication
 
+from .token_cache import token_cache
+
 
 class Bearer(TokenAuthentication):
     keyword = "Bearer"
+
+
+class CachingBearer(Bearer):
+    """``Bearer`` that skips the token/user query for recently seen tokens (see ``token_cache``)."""
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is not None:
+            return user, self.get_model()(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user)
+        return user, token
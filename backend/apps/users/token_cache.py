@@ -0,0 +1,156 @@
+"""
+Cache of authenticated users by token key, used by ``CachingBearer``.
+
+Each worker keeps a bounded LRU; with ``AUTH_TOKEN_SHARED_CACHE`` set, a
+shared cache (e.g. Redis) is consulted on a local miss before the database.
+Entries expire after ``AUTH_TOKEN_CACHE_TTL`` seconds.
+
+Invalidation is per user: dropping a token or saving a user calls
+``invalidate_user``, which evicts the local entries and replaces the user's
+generation in the shared cache. Every hit is checked against that
+generation, so other workers stop serving their local copies at once. Without
+a shared cache other workers cannot be told, so entries expire after
+``AUTH_TOKEN_LOCAL_TTL`` seconds instead: that bounds how long a logged out or
+deactivated user stays authenticated there. It is 0 unless set, and a cache
+with no lifetime stores nothing, so every request authenticates against the
+database.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class TokenCache:
+    def __init__(self, max_size, ttl, shared_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local_hits = self.shared_hits = self.misses = self.invalidations = 0
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        """Return a copy of the cached user for ``key``, or None."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                else:
+                    del self.entries[key]
+                    entry = None
+        if entry is not None:
+            _, user, generation = entry
+            if self._is_current(user.pk, generation):
+                self._count("local_hits")
+                return copy.copy(user)
+            self._discard(key)
+
+        shared = self.shared
+        if shared is not None:
+            value = shared.get(self._shared_key(key))
+            if value is not None:
+                user, generation = value
+                if self._is_current(user.pk, generation):
+                    self._store(key, user, generation)
+                    self._count("shared_hits")
+                    return copy.copy(user)
+        self._count("misses")
+        return None
+
+    def set(self, key, user):
+        if not self.enabled:
+            return
+        snapshot = copy.copy(user)
+        snapshot._state.fields_cache.clear()
+        generation = self._generation(user.pk)
+        self._store(key, snapshot, generation)
+        shared = self.shared
+        if shared is not None:
+            shared.set(self._shared_key(key), (snapshot, generation), self.ttl)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (_, user, _) in self.entries.items() if user.pk == user_id]:
+                del self.entries[key]
+            self.invalidations += 1
+        shared = self.shared
+        if shared is not None:
+            shared.set(self._generation_key(user_id), time.time_ns(), timeout=None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.local_hits = self.shared_hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": (self.local_hits + self.shared_hits) / lookups if lookups else 0.0,
+        }
+
+    def _store(self, key, user, generation):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, user, generation)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def _discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _generation(self, user_id):
+        shared = self.shared
+        if shared is None:
+            return None
+        key = self._generation_key(user_id)
+        generation = shared.get(key)
+        if generation is None:
+            # Seeded from the clock so an evicted generation never comes back with an old value.
+            shared.add(key, time.time_ns(), timeout=None)
+            generation = shared.get(key)
+        return generation
+
+    def _is_current(self, user_id, generation):
+        shared = self.shared
+        return shared is None or shared.get(self._generation_key(user_id)) == generation
+
+    @staticmethod
+    def _shared_key(key):
+        return f"users:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    @staticmethod
+    def _generation_key(user_id):
+        return f"users:token-generation:{user_id}"
+
+
+token_cache = TokenCache(
+    settings.AUTH_TOKEN_CACHE_SIZE,
+    settings.AUTH_TOKEN_CACHE_TTL if settings.AUTH_TOKEN_SHARED_CACHE else settings.AUTH_TOKEN_LOCAL_TTL,
+    settings.AUTH_TOKEN_SHARED_CACHE,
+)
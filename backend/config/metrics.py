@@ -0,0 +1,339 @@
+"""
+Always-on request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records, per route: request counts and latency,
+response sizes, database queries and time, and time spent calling Stripe
+and S3 (``external_call``). Database time comes from an execute wrapper
+installed on every connection; the request being served is found through a
+context variable, which asgiref carries into ``sync_to_async`` threads.
+Streamed bodies are produced after the middleware returns and are not
+included. Pooled PostgreSQL connections are reported per database from the
+pools' own statistics.
+
+Each process keeps its numbers in memory. With ``METRICS_DIR`` set, every
+process also writes a snapshot there every ``METRICS_FLUSH_INTERVAL``
+seconds and ``/metrics`` sums the snapshots of all of them, so any worker can
+answer a scrape. Clear the directory when the whole deployment restarts.
+"""
+import atexit
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseNotFound
+
+from . import profiling
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help)
+METRICS = {
+    "http_requests_total": ("counter", "Requests served, by route, method and status."),
+    "http_request_duration_seconds": ("histogram", "Time to produce the response, by route and method."),
+    "http_response_size_bytes": ("histogram", "Size of non-streamed response bodies, by route."),
+    "db_queries_total": ("counter", "Database queries run while serving requests, by route."),
+    "db_query_duration_seconds_total": ("counter", "Time spent in database queries, by route."),
+    "external_calls_total": ("counter", "Calls to external services, by route and service."),
+    "external_call_duration_seconds_total": ("counter", "Time spent calling external services, by route and service."),
+    "external_call_duration_seconds": ("histogram", "Duration of calls to external services, by service."),
+    "auth_token_cache_lookups_total": ("counter", "Token cache lookups, by result."),
+    "auth_token_cache_entries": ("gauge", "Tokens cached in live processes."),
+    "db_pool_connections": ("gauge", "Connections held by the pools of live processes, by database and state."),
+    "db_pool_max_connections": ("gauge", "Connections the pools of live processes may open, by database."),
+    "db_pool_waiting_requests": ("gauge", "Requests waiting for a pooled connection, by database."),
+    "db_pool_requests_total": ("counter", "Connections taken from the pool, by database."),
+    "db_pool_wait_seconds_total": ("counter", "Time requests spent waiting for a pooled connection, by database."),
+    "db_pool_timeouts_total": ("counter", "Requests that got no pooled connection in time, by database."),
+    "db_pool_connects_total": ("counter", "Connections opened by the pool, by database."),
+    "db_pool_connections_lost_total": ("counter", "Pooled connections found broken and replaced, by database."),
+}
+
+_request = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_time", "external")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        # service -> [calls, seconds]
+        self.external = defaultdict(lambda: [0, 0.0])
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value; labels is a tuple of (key, value) pairs.
+        self.counters = defaultdict(float)
+        # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+        self._thread = None
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[name, labels] += value
+        self._ensure_flusher()
+
+    def observe(self, name, labels, value, buckets):
+        index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = [0] * (len(buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+        self._ensure_flusher()
+
+    def snapshot(self):
+        from apps.users.token_cache import token_cache
+
+        stats = token_cache.stats()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+        for result in ("local_hits", "shared_hits", "misses"):
+            counters["auth_token_cache_lookups_total", (("result", result),)] = stats[result]
+        gauges = {("auth_token_cache_entries", ()): stats["size"]}
+        _add_pool_stats(counters, gauges)
+        return {
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+            "histograms": [[name, labels, value] for (name, labels), value in histograms.items()],
+        }
+
+    def flush(self):
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def _ensure_flusher(self):
+        if self._thread is None and settings.METRICS_DIR:
+            with self.lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+
+registry = Registry()
+
+
+def _add_pool_stats(counters, gauges):
+    for alias in connections:
+        # Only PostgreSQL connections have a pool, and only with OPTIONS["pool"] set.
+        pool = getattr(connections[alias], "pool", None)
+        if pool is None:
+            continue
+        stats = pool.get_stats()
+        labels = (("database", alias),)
+        gauges["db_pool_connections", (*labels, ("state", "idle"))] = stats["pool_available"]
+        # Connections still being opened count as in use.
+        gauges["db_pool_connections", (*labels, ("state", "in_use"))] = stats["pool_size"] - stats["pool_available"]
+        gauges["db_pool_max_connections", labels] = stats["pool_max"]
+        gauges["db_pool_waiting_requests", labels] = stats["requests_waiting"]
+        # The pool leaves out counters that are still zero.
+        counters["db_pool_requests_total", labels] = stats.get("requests_num", 0)
+        counters["db_pool_wait_seconds_total", labels] = stats.get("requests_wait_ms", 0) / 1000
+        counters["db_pool_timeouts_total", labels] = stats.get("requests_errors", 0)
+        counters["db_pool_connects_total", labels] = stats.get("connections_num", 0)
+        counters["db_pool_connections_lost_total", labels] = stats.get("connections_lost", 0)
+
+
+def collect():
+    """This process's numbers merged with the latest snapshots of the others in ``METRICS_DIR``."""
+    if not settings.METRICS_DIR:
+        return [registry.snapshot()]
+    registry.flush()
+    # Gauges describe the present, so only processes that flushed recently count.
+    fresh_after = time.time() - 3 * settings.METRICS_FLUSH_INTERVAL
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            if os.path.getmtime(path) < fresh_after:
+                snapshot["gauges"] = []
+        except (OSError, ValueError):
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def render(snapshots):
+    counters, gauges, histograms = defaultdict(float), defaultdict(float), {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, value in snapshot["gauges"]:
+            gauges[name, tuple(map(tuple, labels))] += value
+        for name, labels, value in snapshot["histograms"]:
+            key = name, tuple(map(tuple, labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], value)]
+            else:
+                histograms[key] = list(value)
+
+    series = defaultdict(list)
+    for (name, labels), value in sorted({**counters, **gauges}.items()):
+        series[name].append(f"{name}{_labels(labels)} {_number(value)}")
+    for (name, labels), value in sorted(histograms.items()):
+        buckets = SIZE_BUCKETS if name == "http_response_size_bytes" else LATENCY_BUCKETS
+        cumulative = 0
+        for bound, count in zip([*buckets, "+Inf"], value[:-1]):
+            cumulative += count
+            series[name].append(f"{name}_bucket{_labels((*labels, ('le', str(bound))))} {cumulative}")
+        series[name].append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+        series[name].append(f"{name}_count{_labels(labels)} {cumulative}")
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        if name in series:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *series[name]]
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def record_external_call(service, elapsed):
+    """Count a call to ``service`` (e.g. "stripe", "s3") overall and for the request being served."""
+    registry.observe("external_call_duration_seconds", (("service", service),), elapsed, LATENCY_BUCKETS)
+    stats = _request.get()
+    if stats is not None:
+        entry = stats.external[service]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+@contextlib.contextmanager
+def external_call(service):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_external_call(service, time.perf_counter() - started)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_query_timer, dispatch_uid="config.metrics.query_timer")
+
+
+class MetricsMiddleware:
+    """Put it first in ``MIDDLEWARE`` so the numbers cover the whole stack."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started, profiler = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        self._finish(request, response, stats, started, profiler)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started, profiler = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        self._finish(request, response, stats, started, profiler)
+        return response
+
+    def _start(self, request):
+        stats = RequestStats()
+        token = _request.set(stats)
+        profiler = profiling.maybe_start()
+        return stats, token, time.perf_counter(), profiler
+
+    def _finish(self, request, response, stats, started, profiler):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        if profiler is not None:
+            profiler.stop(f"{request.method} {route}", elapsed)
+        if match and match.func is metrics_view:
+            return
+
+        labels = (("route", route),)
+        with_method = (*labels, ("method", request.method))
+        registry.inc("http_requests_total", (*with_method, ("status", str(response.status_code))))
+        registry.observe("http_request_duration_seconds", with_method, elapsed, LATENCY_BUCKETS)
+        if not response.streaming:
+            registry.observe("http_response_size_bytes", labels, len(response.content), SIZE_BUCKETS)
+        if stats.queries:
+            registry.inc("db_queries_total", labels, stats.queries)
+            registry.inc("db_query_duration_seconds_total", labels, stats.query_time)
+        for service, (calls, seconds) in stats.external.items():
+            registry.inc("external_calls_total", (*labels, ("service", service)), calls)
+            registry.inc("external_call_duration_seconds_total", (*labels, ("service", service)), seconds)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; requires ``Authorization: Bearer <METRICS_TOKEN>`` unless DEBUG is on."""
+    if settings.METRICS_TOKEN:
+        if request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+            return HttpResponseNotFound()
+    elif not settings.DEBUG:
+        return HttpResponseNotFound()
+    return HttpResponse(render(collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
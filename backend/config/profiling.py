@@ -0,0 +1,113 @@
+"""
+Sampled stack profiles of slow requests, switched on at runtime.
+
+``manage.py profile_requests`` writes a control file to ``METRICS_PROFILE_DIR``
+that every process re-reads at most once a second: the share of requests to
+sample, the duration above which a profile is kept, and an expiry. While a
+sampled request runs, a thread records the stack of the thread serving it
+every ``SAMPLE_INTERVAL`` seconds; profiles of requests slower than the
+threshold are written next to the control file in the folded format
+(``frame;frame;frame count``) that flamegraph.pl and speedscope read.
+
+Only the thread running the middleware is sampled. For async views that is
+the event loop, so work handed to ``sync_to_async`` threads is not seen.
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+CONTROL_FILE = "profiling.json"
+SAMPLE_INTERVAL = 0.005
+
+_control = {"checked": 0.0, "config": None}
+# One profiled request at a time per process keeps the overhead bounded.
+_slot = threading.Semaphore(1)
+
+
+def enable(rate, slow_seconds, duration_seconds):
+    path = os.path.join(settings.METRICS_PROFILE_DIR, CONTROL_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"rate": rate, "slow": slow_seconds, "until": time.time() + duration_seconds}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def disable():
+    try:
+        os.remove(os.path.join(settings.METRICS_PROFILE_DIR, CONTROL_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def current_config():
+    now = time.monotonic()
+    if now - _control["checked"] < 1:
+        return _control["config"]
+    _control["checked"] = now
+    config = None
+    if settings.METRICS_PROFILE_DIR:
+        try:
+            with open(os.path.join(settings.METRICS_PROFILE_DIR, CONTROL_FILE)) as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            config = None
+    if config is not None and config["until"] < time.time():
+        config = None
+    _control["config"] = config
+    return config
+
+
+def maybe_start():
+    """A running ``StackSampler`` for the current thread if this request is sampled, else None."""
+    config = current_config()
+    if config is None or random.random() >= config["rate"] or not _slot.acquire(blocking=False):
+        return None
+    return StackSampler(threading.get_ident(), config["slow"])
+
+
+class StackSampler:
+    def __init__(self, thread_id, slow_seconds):
+        self.thread_id = thread_id
+        self.slow_seconds = slow_seconds
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, label, elapsed):
+        """Stop sampling and write the profile if the request was slow; returns its path or None."""
+        self._stopped.set()
+        self._thread.join()
+        _slot.release()
+        if elapsed < self.slow_seconds or not self.samples:
+            return None
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", label).strip("-")[:80]
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{elapsed * 1000:.0f}ms-{slug}.folded"
+        path = os.path.join(settings.METRICS_PROFILE_DIR, name)
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+        return path
+
+
+def _short_path(filename):
+    for marker in ("site-packages/", f"{settings.BASE_DIR.parent}/"):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    return filename
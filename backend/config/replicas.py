@@ -0,0 +1,160 @@
+"""
+Read replicas for catalog traffic.
+
+``ReplicaRouter`` sends reads of the catalog models (products, categories,
+manufacturers, reviews, recently viewed) to one of ``DATABASE_REPLICAS``,
+picked at random once per request so a response is built from one snapshot.
+Everything else, orders, carts, payments and users included, stays on
+``default``, as does every read:
+
+- outside a request served through ``ReplicaMiddleware`` (commands, workers);
+- inside a transaction, so ``select_for_update`` and read-modify-write run
+  against the primary;
+- after the request sent anything but a SELECT to the primary, or called
+  ``read_from_primary``;
+- for ``DATABASE_REPLICA_PIN_SECONDS`` after a client's last write, so a
+  client reads its own writes despite replication lag. Clients are told apart
+  by their Authorization header or session cookie; the pin is kept in the
+  ``DATABASE_PIN_CACHE`` cache, which must be shared by all workers for pins
+  to follow a client from one worker to another. Replicas without it are
+  refused at startup.
+"""
+import contextvars
+import hashlib
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+REPLICATED_MODELS = {
+    "shop.product",
+    "shop.category",
+    "shop.manufacturer",
+    "shop.productsearchindex",
+    "shop.review",
+    "shop.recentproduct",
+}
+
+_request = contextvars.ContextVar("replica_routing", default=None)
+
+
+class RoutingState:
+    __slots__ = ("client", "replica", "wrote")
+
+    def __init__(self, client, replica):
+        self.client = client
+        self.replica = replica
+        self.wrote = False
+
+
+def _client_key(request):
+    credentials = request.headers.get("Authorization") or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return "db:pin:" + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def read_from_primary():
+    """Send the rest of the current request's reads to the primary."""
+    state = _request.get()
+    if state is not None:
+        state.replica = None
+
+
+def _note_write(execute, sql, params, many, context):
+    # Django also asks routers for a write database when merely assigning related objects, so writes are
+    # recognised by the statements sent to the primary instead.
+    state = _request.get()
+    if state is not None and not state.wrote and sql.lstrip()[:6].upper() != "SELECT":
+        state.wrote = True
+    return execute(sql, params, many, context)
+
+
+def _install_write_tracker(sender, connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS and _note_write not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_note_write)
+
+
+connection_created.connect(_install_write_tracker, dispatch_uid="config.replicas.write_tracker")
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request.get()
+        if state is None or state.replica is None or state.wrote:
+            return None
+        if model._meta.label_lower not in REPLICATED_MODELS or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        # Related objects are left to Django, which reads them where their instance came from: products of
+        # an order come from the primary with the order.
+        if hints.get("instance") is not None:
+            return None
+        return state.replica
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaMiddleware:
+    """Picks the request's replica, unless the client wrote recently, and pins clients that write."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DATABASE_REPLICAS and not settings.DATABASE_PIN_CACHE:
+            raise ImproperlyConfigured(
+                "DATABASE_REPLICAS needs DATABASE_PIN_CACHE, a cache shared by all workers, so clients that wrote "
+                "keep reading from the primary whichever worker serves them"
+            )
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        cache = caches[settings.DATABASE_PIN_CACHE]
+        state = self._state(request)
+        if state.replica and state.client and cache.get(state.client):
+            state.replica = None
+        token = _request.set(state)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+            if state.wrote and state.client:
+                cache.set(state.client, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        cache = caches[settings.DATABASE_PIN_CACHE]
+        state = self._state(request)
+        if state.replica and state.client and await cache.aget(state.client):
+            state.replica = None
+        token = _request.set(state)
+        try:
+            return await self.get_response(request)
+        finally:
+            _request.reset(token)
+            if state.wrote and state.client:
+                await cache.aset(state.client, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+    @staticmethod
+    def _state(request):
+        return RoutingState(_client_key(request), random.choice(settings.DATABASE_REPLICAS))
@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.metrics.MetricsMiddleware",
+    "config.replicas.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -123,7 +125,7 @@ USE_TZ = True
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = "users.User"
 REST_FRAMEWORK = {
-    "DEFAULT_AUTHENTICATION_CLASSES": ["apps.users.token.Bearer"],
+    "DEFAULT_AUTHENTICATION_CLASSES": ["apps.users.token.CachingBearer"],
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
 }
 
@@ -140,10 +142,99 @@ AWS_S3_ACCESS_KEY_ID = os.getenv("AWS_S3_ACCESS_KEY_ID")
 AWS_S3_SECRET_ACCESS_KEY = os.getenv("AWS_S3_SECRET_ACCESS_KEY")
 AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME")
 AWS_QUERYSTRING_EXPIRE = int(os.getenv("AWS_QUERYSTRING_EXPIRE", 60 * 30))
+# Signed media URLs are reused until this many seconds before they expire (config.storages.CachedURLMixin).
+AWS_URL_CACHE_MARGIN = int(os.getenv("AWS_URL_CACHE_MARGIN", 5 * 60))
+
+# Aliases from DATABASES that replicate `default`; see config.replicas.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ["config.replicas.ReplicaRouter"]
+# How long a client's reads stay on the primary after it writes; keep it above the replication lag.
+DATABASE_REPLICA_PIN_SECONDS = float(os.getenv("DATABASE_REPLICA_PIN_SECONDS", 5))
+# Alias from CACHES holding those pins, shared by all workers like AUTH_TOKEN_SHARED_CACHE; required with replicas.
+DATABASE_PIN_CACHE = os.getenv("DATABASE_PIN_CACHE") or None
+
+# Catalog responses are cached in their own alias. Local memory is per worker
+# process and LRU-culled at MAX_ENTRIES; set CATALOG_CACHE_LOCATION to a Redis
+# URL to share entries and the catalog version between workers (the server's
+# maxmemory-policy should be allkeys-lru).
+CATALOG_CACHE_LOCATION = os.getenv("CATALOG_CACHE_LOCATION")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "catalog": (
+        {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CATALOG_CACHE_LOCATION,
+            "TIMEOUT": 60 * 60,
+        }
+        if CATALOG_CACHE_LOCATION
+        else {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "catalog",
+            "TIMEOUT": 60 * 60,
+            "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", 2000)), "CULL_FREQUENCY": 4},
+        }
+    ),
+}
+SHOP_CATALOG_CACHE = "catalog"
+# Alias from CACHES shared by all workers that holds the catalog version; the catalog cache when it is Redis. Without
+# one the version is kept in the database and each worker re-reads it every SHOP_CATALOG_VERSION_TTL seconds, so its
+# entries outlive a write made through another worker by up to that long.
+SHOP_CATALOG_VERSION_CACHE = os.getenv("SHOP_CATALOG_VERSION_CACHE") or ("catalog" if CATALOG_CACHE_LOCATION else None)
+SHOP_CATALOG_VERSION_TTL = float(os.getenv("SHOP_CATALOG_VERSION_TTL", 1))
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+# Alias from CACHES shared by all workers; the catalog cache when it is Redis. Authenticated users are cached for
+# AUTH_TOKEN_CACHE_TTL only with one, since only then does a logout or deactivation reach every worker at once.
+AUTH_TOKEN_SHARED_CACHE = os.getenv("AUTH_TOKEN_SHARED_CACHE") or ("catalog" if CATALOG_CACHE_LOCATION else None)
+# Entry lifetime without the shared cache, where other workers only see a logout or deactivation once it passes.
+# 0 (the default) turns the token cache off there: a lifetime short enough to be safe would make most lookups miss.
+# Raise it only if serving a revoked token for that long is acceptable.
+AUTH_TOKEN_LOCAL_TTL = float(os.getenv("AUTH_TOKEN_LOCAL_TTL", 0))
+SHOP_CATALOG_CACHE_MAX_ENTRY_BYTES = int(os.getenv("CATALOG_CACHE_MAX_ENTRY_BYTES", 512 * 1024))
+# Alias from CACHES keeping active carts, written back to the database in batches (see apps.shop.cart_store); shared
+# by all workers, like AUTH_TOKEN_SHARED_CACHE. Unset: carts are read and written in the database directly.
+SHOP_CART_CACHE = os.getenv("SHOP_CART_CACHE") or None
+SHOP_CART_CACHE_TIMEOUT = int(os.getenv("SHOP_CART_CACHE_TIMEOUT", 7 * 24 * 3600))
+SHOP_CART_FLUSH_INTERVAL = float(os.getenv("SHOP_CART_FLUSH_INTERVAL", 2))
+SHOP_CART_MAX_PENDING = int(os.getenv("SHOP_CART_MAX_PENDING", 500))
+
+SHOP_PAGE_SIZE = int(os.getenv("SHOP_PAGE_SIZE", 24))
+SHOP_MAX_PAGE_SIZE = int(os.getenv("SHOP_MAX_PAGE_SIZE", 100))
+SHOP_REVIEWS_PAGE_SIZE = int(os.getenv("SHOP_REVIEWS_PAGE_SIZE", 10))
+SHOP_ORDERS_PAGE_SIZE = int(os.getenv("SHOP_ORDERS_PAGE_SIZE", 10))
+SHOP_RECENT_PRODUCTS_LIMIT = int(os.getenv("SHOP_RECENT_PRODUCTS_LIMIT", 50))
+SHOP_RECENT_VIEWS_FLUSH_INTERVAL = float(os.getenv("SHOP_RECENT_VIEWS_FLUSH_INTERVAL", 2))
+SHOP_RECENT_VIEWS_MAX_PENDING = int(os.getenv("SHOP_RECENT_VIEWS_MAX_PENDING", 500))
+SHOP_PRICE_FACET_BOUNDS = [1000, 5000, 10000, 50000, 100000]
+# Longest side in pixels of each photo variant; each is stored as WebP and JPEG.
+SHOP_PHOTO_VARIANT_SIZES = {"thumb": 160, "card": 480, "full": 1600}
+SHOP_PHOTO_WORKERS = int(os.getenv("SHOP_PHOTO_WORKERS", 2))
+# Rows fetched per round trip and encoded per response chunk by the export endpoints.
+SHOP_EXPORT_CHUNK_SIZE = int(os.getenv("SHOP_EXPORT_CHUNK_SIZE", 2000))
 
 STRIPE_TEST_PUBLIC_KEY = os.getenv("STRIPE_TEST_PUBLIC_KEY")
 STRIPE_TEST_SECRET_KEY = os.getenv("STRIPE_TEST_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+# Points the Stripe client at another server, e.g. `manage.py fake_stripe`.
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+
+SHOP_CHECKOUT_MAX_WAIT = int(os.getenv("SHOP_CHECKOUT_MAX_WAIT", 25))
+SHOP_CHECKOUT_POLL_INTERVAL = float(os.getenv("SHOP_CHECKOUT_POLL_INTERVAL", 0.5))
+# How long Stripe's answer for an unpaid checkout session is trusted before it is asked again.
+SHOP_PAYMENT_STATUS_TTL = float(os.getenv("SHOP_PAYMENT_STATUS_TTL", 5))
+SHOP_PAYMENT_MAX_WAIT = int(os.getenv("SHOP_PAYMENT_MAX_WAIT", 30))
+SHOP_PAYMENT_POLL_INTERVAL = float(os.getenv("SHOP_PAYMENT_POLL_INTERVAL", 1))
+
+# Shared directory for per-process metric snapshots; without it /metrics reports only the process it hits.
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# Bearer token /metrics requires; unset, the endpoint is only served with DEBUG on.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+# Where `manage.py profile_requests` leaves its switch and the profiles are written.
+METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR") or None
 
 PAYMENT_HOST = os.getenv("PAYMENT_HOST")
 PAYMENT_PROTOCOL = os.getenv("PAYMENT_PROTOCOL")
@@ -11,5 +11,29 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": "db",
         "PORT": 5432,
+        # Checked with a round trip before a request uses a connection, pooled or persistent.
+        "CONN_HEALTH_CHECKS": os.getenv("DB_HEALTH_CHECKS", "1") != "0",
     }
-}
\ No newline at end of file
+}
+# Each worker process keeps a pool of connections per database, so requests skip the TCP, TLS and auth handshake.
+# Postgres must accept workers x DB_POOL_MAX_SIZE connections per database. With DB_POOL=0, connections are opened
+# per request, or kept for DB_CONN_MAX_AGE seconds.
+if os.getenv("DB_POOL", "1") != "0":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            # At least the threads of a worker, or they queue for connections.
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 16)),
+            # Seconds a request waits for a free connection before failing.
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            # Connections are replaced after this many seconds, and closed above min_size when idle this long.
+            "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),
+            "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+        }
+    }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 0))
+# Streaming replicas of `default`, e.g. POSTGRES_REPLICA_HOSTS=db-replica-1,db-replica-2; they need DATABASE_PIN_CACHE.
+for index, host in enumerate(filter(None, os.getenv("POSTGRES_REPLICA_HOSTS", "").split(",")), start=1):
+    DATABASES[f"replica_{index}"] = {**DATABASES["default"], "HOST": host.strip(), "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(f"replica_{index}")
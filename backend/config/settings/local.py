@@ -9,6 +9,18 @@ DATABASES = {
         'NAME': BASE_DIR / 'local_db.sqlite3',
     }
 }
+# LOCAL_REPLICA=1 adds a replica that `manage.py simulate_replica` refreshes from local_db.sqlite3
+# every --lag seconds, to try replica routing and replication lag locally.
+if os.getenv("LOCAL_REPLICA"):
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "local_replica.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS = ["replica"]
+    # runserver is a single process, so its local memory cache is shared by every request.
+    DATABASE_PIN_CACHE = DATABASE_PIN_CACHE or "default"
+
 INSTALLED_APPS += [
     "silk",
 	"query_counter",
@@ -0,0 +1,44 @@
+import atexit
+import shutil
+import tempfile
+from pathlib import Path
+
+from .base import *
+
+# Database files live outside the checkout, in a directory of this run's own.
+TEST_DB_DIR = Path(tempfile.mkdtemp(prefix="shop-tests-"))
+atexit.register(shutil.rmtree, TEST_DB_DIR, ignore_errors=True)
+
+DEBUG = False
+SECRET_KEY = "test"
+ALLOWED_HOSTS = ["testserver", "localhost"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": TEST_DB_DIR / "test_db.sqlite3",
+        # Writers queue on the database lock instead of failing when they upgrade a read transaction.
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
+        # A file rather than memory, so tests can check concurrent requests from several threads.
+        "TEST": {"NAME": TEST_DB_DIR / "test_db.sqlite3"},
+    },
+    # Stands in for a replica in the routing tests, which enable it; nothing copies `default` into it, so its
+    # rows are as stale as a test makes them.
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": TEST_DB_DIR / "test_replica.sqlite3",
+        "TEST": {"NAME": TEST_DB_DIR / "test_replica.sqlite3"},
+    },
+}
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+# Never the keys from .env: tests talk to apps.shop.stripe_fake, if to Stripe at all.
+STRIPE_TEST_PUBLIC_KEY = "pk_test_fake"
+STRIPE_TEST_SECRET_KEY = "sk_test_fake"
+STRIPE_WEBHOOK_SECRET = "whsec_test"
+STRIPE_API_BASE = None
+# One process, so invalidation reaches every cached token; query counts in the tests leave authentication out.
+AUTH_TOKEN_LOCAL_TTL = 300
+METRICS_DIR = None
+METRICS_TOKEN = None
+METRICS_PROFILE_DIR = None
@@ -1,12 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+from django.conf import settings
 from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+from config.metrics import record_external_call
+
+
+class CachedURLMixin:
+    """
+    URL resolution without a boto3 request per call.
+
+    Public URLs are a prefix, computed once from a probe URL, plus the quoted
+    key. Signed URLs are cached per name for ``AWS_URL_CACHE_MARGIN`` seconds
+    less than ``querystring_expire``, so a cached URL always has at least that
+    long left to live. Calls with extra parameters go to boto3 as before.
+    """
+
+    url_cache_size = 10000
+    _probe_name = "__url-probe__"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._public_prefix = None
+        self._url_cache = OrderedDict()
+        self._url_cache_lock = threading.Lock()
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if parameters or expire is not None or http_method or self.custom_domain:
+            return super().url(name, parameters, expire, http_method)
+        if not self.querystring_auth:
+            return self.public_prefix + quote(self._normalize_name(clean_name(name)), safe="/~")
+        return self._signed_url(name)
+
+    @property
+    def public_prefix(self):
+        if self._public_prefix is None:
+            probe = super().url(self._probe_name)
+            self._public_prefix = probe[: probe.rindex(quote(self._normalize_name(self._probe_name), safe="/~"))]
+        return self._public_prefix
+
+    def _signed_url(self, name):
+        now = time.monotonic()
+        with self._url_cache_lock:
+            entry = self._url_cache.get(name)
+            if entry is not None and entry[1] > now:
+                self._url_cache.move_to_end(name)
+                return entry[0]
 
-class MinIOMediaStorage(S3Boto3Storage):
+        url = super().url(name)
+        ttl = self.querystring_expire - settings.AWS_URL_CACHE_MARGIN
+        if ttl > 0:
+            with self._url_cache_lock:
+                self._url_cache[name] = (url, now + ttl)
+                self._url_cache.move_to_end(name)
+                while len(self._url_cache) > self.url_cache_size:
+                    self._url_cache.popitem(last=False)
+        return url
+
+
+class TimedS3Mixin:
+    """Reports every S3 API call to the request metrics; URL signing makes no call and is not counted."""
+
+    @property
+    def connection(self):
+        connection = super().connection
+        client = connection.meta.client
+        if not getattr(client, "_metrics_hooked", False):
+            client.meta.events.register("before-call.s3", _start_s3_call)
+            client.meta.events.register("after-call.s3", _finish_s3_call)
+            client.meta.events.register("after-call-error.s3", _finish_s3_call)
+            client._metrics_hooked = True
+        return connection
+
+
+def _start_s3_call(context, **kwargs):
+    context["metrics_started"] = time.perf_counter()
+
+
+def _finish_s3_call(context, **kwargs):
+    started = context.get("metrics_started")
+    if started is not None:
+        record_external_call("s3", time.perf_counter() - started)
+
+
+class MinIOMediaStorage(TimedS3Mixin, CachedURLMixin, S3Boto3Storage):
     bucket_name = 'local-bucket-shop'
     location = 'media'
     file_overwrite = False
     custom_domain = False
 
-class StaticStorage(S3Boto3Storage):
+
+class StaticStorage(TimedS3Mixin, CachedURLMixin, S3Boto3Storage):
     bucket_name = 'local-bucket-shop'
     location = "static"
-    default_acl = None
\ No newline at end of file
+    default_acl = None
@@ -18,10 +18,13 @@ from django.contrib import admin
 from django.urls import path, include
 import django
 
+from config.metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("api/", include("apps.urls"))
+    path("api/", include("apps.urls")),
+    path("metrics", metrics_view),
 ]
 if django.conf.settings.DEBUG:
     urlpatterns += [